@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import gc
+import time
+import collections
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+'''
+================================================================================
+
+    ALLOCATION MONITOR
+
+    Diagnostic mode for memory growth and GC pauses during a session. At
+    every phase boundary (checkpoint), it records:
+
+    - the memory traced by tracemalloc, and the peak since the last
+      checkpoint
+    - the number of live objects (objects tracked by the garbage collector,
+      which includes every PsychoPy stimulus), and at the start of each
+      trial the number of each type
+
+    The memory and objects a phase retains are the change from its
+    checkpoint to the next one. A phase is flagged when, summed over the
+    trials after warm-up, it retains more than tolerance bytes: its
+    allocations do not return to baseline. Garbage collections are timed and
+    attributed to the phase they run in.
+
+    Checkpoints go into preallocated arrays, so recording does not itself
+    show up as growth. Counting objects walks the whole heap, which takes
+    milliseconds (tens of milliseconds by type), so this mode distorts
+    timing and is for diagnosis only.
+
+================================================================================
+'''
+
+class AllocationMonitor(object):
+    # trialphase: the phase that starts a trial; the first nwarmup trials are
+    # not used to judge growth (caches and lazily built objects fill up there)
+    def __init__(self, trialphase, nwarmup=2, tolerance=65536, capacity=4096, maxtypes=1024,
+                 countobjects=True, nframes=1):
+        self.trialphase   = trialphase
+        self.nwarmup      = nwarmup
+        self.tolerance    = tolerance
+        self.capacity     = capacity
+        self.maxtypes     = maxtypes
+        self.countobjects = countobjects
+        self.nframes      = nframes
+
+        self.phases     = []
+        self.phasecodes = {}
+        self.types      = []
+        self.typecodes  = {}
+
+        self.trial   = np.zeros(capacity, dtype=np.int32)
+        self.phase   = np.zeros(capacity, dtype=np.int16)
+        self.time    = np.zeros(capacity)
+        self.traced  = np.zeros(capacity, dtype=np.int64)
+        self.peak    = np.zeros(capacity, dtype=np.int64)
+        self.objects = np.zeros(capacity, dtype=np.int64)
+        self.counts  = np.zeros([capacity, maxtypes], dtype=np.int32)
+        self.ncheckpoints = 0
+        self.noverflow    = 0
+
+        self.currenttrial = 0
+        self.current      = self.phasecode('other')
+        self.gcstart      = 0.
+        self.gctime       = np.zeros(256)
+        self.gccount      = np.zeros(256, dtype=np.int64)
+
+        self.baseline = None # tracemalloc snapshot at the end of warm-up
+        self.final    = None
+
+    def phasecode(self, name):
+        if name not in self.phasecodes:
+            self.phasecodes[name] = len(self.phases)
+            self.phases.append(name)
+        return self.phasecodes[name]
+
+    def start(self):
+        tracemalloc.start(self.nframes)
+        gc.callbacks.append(self.gccallback)
+        self.checkpoint('other')
+
+    def stop(self):
+        self.final = tracemalloc.take_snapshot()
+        gc.callbacks.remove(self.gccallback)
+        tracemalloc.stop()
+
+    def gccallback(self, event, info):
+        if event == 'start':
+            self.gcstart = time.perf_counter()
+        else:
+            self.gctime[self.current] += time.perf_counter() - self.gcstart
+            self.gccount[self.current] += 1
+
+    # Live objects per type, added into row i of counts. Returns the total.
+    def countbytype(self, i):
+        typecodes, row = self.typecodes, self.counts[i]
+        total = 0
+        for t, n in collections.Counter(map(type, gc.get_objects())).items():
+            module = t.__module__ if isinstance(t.__module__, str) else 'builtins'
+            name = t.__name__ if module == 'builtins' else module + '.' + t.__name__
+            code = typecodes.get(name)
+            if code is None and len(self.types) < self.maxtypes:
+                code = typecodes[name] = len(self.types)
+                self.types.append(name)
+            if code is not None:
+                row[code] += n
+            total += n
+        return total
+
+    # Record a phase boundary (call on entering phase name)
+    def checkpoint(self, name):
+        self.current = self.phasecode(name)
+        if name == self.trialphase:
+            self.currenttrial += 1
+            if self.currenttrial == self.nwarmup + 1 and self.baseline is None:
+                self.baseline = tracemalloc.take_snapshot()
+        i = self.ncheckpoints
+        if i >= self.capacity:
+            self.noverflow += 1
+            return
+
+        # Memory first, so that counting (which is freed again) is not in the peak
+        self.traced[i], self.peak[i] = tracemalloc.get_traced_memory()
+        if self.countobjects and name == self.trialphase:
+            self.objects[i] = self.countbytype(i)
+        elif self.countobjects:
+            self.objects[i] = len(gc.get_objects())
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        self.trial[i] = self.currenttrial
+        self.phase[i] = self.current
+        self.time[i]  = time.perf_counter()
+        self.ncheckpoints += 1
+
+    # One row per checkpoint; retained_* is the change up to the next checkpoint
+    # and transient_bytes the peak above the checkpoint before the next one
+    def table(self):
+        n = self.ncheckpoints
+        traced, objects = self.traced[:n], self.objects[:n]
+        return pd.DataFrame({
+            'trial'           : self.trial[:n],
+            'phase'           : np.array(self.phases, dtype=object)[self.phase[:n]],
+            'time'            : self.time[:n] - self.time[0],
+            'traced_bytes'    : traced,
+            'objects'         : objects,
+            'retained_bytes'  : np.append(np.diff(traced), np.nan),
+            'retained_objects': np.append(np.diff(objects), np.nan),
+            'transient_bytes' : np.append(self.peak[1:n] - traced[:-1], np.nan)
+        }, columns=['trial', 'phase', 'time', 'traced_bytes', 'objects', 'retained_bytes',
+                    'retained_objects', 'transient_bytes'])
+
+    # Memory and objects at the start of each trial, and their growth from the previous trial
+    def trials(self, table=None):
+        if table is None:
+            table = self.table()
+        starts = table[table['phase'] == self.trialphase][['trial', 'traced_bytes', 'objects']]
+        return starts.assign(growth_bytes=starts['traced_bytes'].diff(),
+                             growth_objects=starts['objects'].diff()).reset_index(drop=True)
+
+    # Retained and transient memory per phase after warm-up, GC time, and a flag
+    # for phases that do not return to baseline
+    def summary(self, table=None):
+        if table is None:
+            table = self.table()
+        measured = table[table['trial'] > self.nwarmup].dropna(subset=['retained_bytes'])
+        rows = []
+        for code, name in enumerate(self.phases):
+            phase = measured[measured['phase'] == name]
+            retained = phase['retained_bytes'].sum()
+            rows.append({
+                'phase'                 : name,
+                'nentries'              : len(phase),
+                'retained_bytes_total'  : retained,
+                'retained_bytes_mean'   : phase['retained_bytes'].mean(),
+                'retained_objects_total': phase['retained_objects'].sum(),
+                'transient_bytes_max'   : phase['transient_bytes'].max(),
+                'gc_collections'        : self.gccount[code],
+                'gc_time_ms'            : 1e3*self.gctime[code],
+                'flagged'               : bool(retained > self.tolerance)
+            })
+        columns = ['phase', 'nentries', 'retained_bytes_total', 'retained_bytes_mean', 'retained_objects_total',
+                   'transient_bytes_max', 'gc_collections', 'gc_time_ms', 'flagged']
+        return pd.DataFrame(rows, columns=columns)
+
+    # Types whose live count grew most between the first trial after warm-up and the last
+    def typegrowth(self, ntypes=30):
+        starts = np.flatnonzero((self.phase[:self.ncheckpoints] == self.phasecodes.get(self.trialphase, -1)) &
+                                (self.trial[:self.ncheckpoints] > self.nwarmup))
+        if len(starts) < 2:
+            return pd.DataFrame(columns=['type', 'baseline', 'final', 'growth', 'growth_per_trial'])
+        first, last = starts[0], starts[-1]
+        ntrials = self.trial[last] - self.trial[first]
+        k = len(self.types)
+        growth = self.counts[last, :k] - self.counts[first, :k]
+        order = np.argsort(-growth, kind='stable')[:ntypes]
+        return pd.DataFrame({
+            'type'            : np.array(self.types, dtype=object)[order],
+            'baseline'        : self.counts[first, order],
+            'final'           : self.counts[last, order],
+            'growth'          : growth[order],
+            'growth_per_trial': growth[order]/float(ntrials)
+        }, columns=['type', 'baseline', 'final', 'growth', 'growth_per_trial'])
+
+    # Source lines whose traced memory grew most between the end of warm-up and stop()
+    def sites(self, nsites=20):
+        if self.baseline is None or self.final is None:
+            return pd.DataFrame(columns=['site', 'size_diff', 'count_diff'])
+        exclude = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        stats = self.final.filter_traces(exclude).compare_to(self.baseline.filter_traces(exclude), 'lineno')
+        return pd.DataFrame({
+            'site'      : [str(stat.traceback) for stat in stats[:nsites]],
+            'size_diff' : [stat.size_diff for stat in stats[:nsites]],
+            'count_diff': [stat.count_diff for stat in stats[:nsites]]
+        }, columns=['site', 'size_diff', 'count_diff'])
+
+    # Write <prefix>.csv (checkpoints), <prefix>_trials.csv, <prefix>_summary.csv,
+    # <prefix>_types.csv and <prefix>_sites.csv. Call stop() first.
+    def write(self, prefix):
+        table = self.table()
+        outputs = [('', table), ('_trials', self.trials(table)), ('_summary', self.summary(table)),
+                   ('_types', self.typegrowth()), ('_sites', self.sites())]
+        for suffix, output in outputs:
+            output.to_csv(prefix + suffix + '.csv', sep='\t', encoding='utf-8', index=False)
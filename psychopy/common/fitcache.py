@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import pickle
+import hashlib
+from collections import OrderedDict
+
+'''
+================================================================================
+
+    CONTENT-ADDRESSED CACHE FOR MODEL FITS
+
+    Results are stored on disk under a key made from a hash of the data
+    file's contents plus the model name, model version and fit settings, so a
+    subject is only refitted when its data or the analysis change. The cache
+    has a size limit; when it is exceeded the least recently used entries are
+    evicted. Hits, misses and evictions are counted for reporting at the end
+    of a batch run.
+
+================================================================================
+'''
+
+# SHA-256 of a file's contents
+def filedigest(filename, blocksize=1 << 20):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        block = f.read(blocksize)
+        while block:
+            h.update(block)
+            block = f.read(blocksize)
+    return h.hexdigest()
+
+# Cache key for a data file (or its digest) analysed with the given model, version and settings
+def cachekey(digest, model, version, settings=None):
+    description = json.dumps({'model': model, 'version': version, 'settings': settings},
+                             sort_keys=True, default=str)
+    return hashlib.sha256((digest + description).encode('utf8')).hexdigest()
+
+class FitCache(object):
+    # directory holds one file per entry; maxbytes is the size limit (None for no limit)
+    def __init__(self, directory='.fitcache', maxbytes=500*2**20):
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # Entries in order of last use (oldest first), with their sizes
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith('.pkl'):
+                stat = os.stat(os.path.join(directory, name))
+                entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        self.entries = OrderedDict((key, size) for mtime, key, size in sorted(entries))
+        self.nbytes = sum(self.entries.values())
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    # Return the cached result for key, or None on a miss
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        try:
+            with open(self.path(key), 'rb') as f:
+                result = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            self.discard(key)
+            self.misses += 1
+            return None
+
+        os.utime(self.path(key), None) # mark as recently used
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+    # Store a result under key, then evict old entries if over the size limit
+    def put(self, key, result):
+        tmpfile = self.path(key) + '.tmp'
+        with open(tmpfile, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpfile, self.path(key))
+
+        self.nbytes -= self.entries.pop(key, 0)
+        self.entries[key] = os.path.getsize(self.path(key))
+        self.nbytes += self.entries[key]
+        self.evict()
+
+    # Remove least recently used entries until the cache is within its size limit
+    def evict(self):
+        if self.maxbytes is None:
+            return
+        while self.nbytes > self.maxbytes and len(self.entries) > 1:
+            key = next(iter(self.entries))
+            self.discard(key)
+            self.evictions += 1
+
+    def discard(self, key):
+        self.nbytes -= self.entries.pop(key, 0)
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    # Hit/miss statistics
+    def stats(self):
+        nlookups = self.hits + self.misses
+        return {
+            'hits'     : self.hits,
+            'misses'   : self.misses,
+            'hitrate'  : self.hits/float(nlookups) if nlookups > 0 else float('nan'),
+            'evictions': self.evictions,
+            'entries'  : len(self.entries),
+            'nbytes'   : self.nbytes
+        }
+
+    def report(self):
+        stats = self.stats()
+        return ('Fit cache: %(hits)d hits, %(misses)d misses (hit rate %(hitrate).0f%%), '
+                '%(evictions)d evicted, %(entries)d entries using %(megabytes).1f MB') % dict(
+                    stats, hitrate=100*stats['hitrate'], megabytes=stats['nbytes']/2.**20)
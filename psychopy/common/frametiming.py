@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+'''
+================================================================================
+
+    FRAME TIMING
+
+    Logs every win.flip() of a task into a preallocated ring buffer: the time
+    the flip was requested, the time it returned, and the task phase it
+    belongs to (set with setphase as the trial moves on). Recording a flip
+    is two clock reads and three array stores; nothing is allocated during
+    the session.
+
+    Dropped frames are counted from how late each flip returned. A flip
+    requested less than maxgap after the previous one returned (an
+    animation, or a screen right after another) should return one frame
+    after the previous flip; a flip after a longer wait should return within
+    one frame of being requested. A flip counts as late when it returns
+    more than 1.5 frames after that reference, and every whole frame beyond
+    the expected one is a dropped frame. Frame intervals are summarized
+    over consecutive flips only, since intervals that span a wait say
+    nothing about the display.
+
+================================================================================
+'''
+
+phases = ['other', 'fixation', 'step1', 'transition', 'step2', 'outcome', 'equation', 'letter', 'recall']
+
+class FrameLog(object):
+    # Wraps win.flip so every flip is logged. clock should be the clock the
+    # task uses (e.g., core.getTime); maxgap (s) should be shorter than any
+    # deliberate wait between flips.
+    def __init__(self, win, clock, capacity=2**17, maxgap=0.05, phases=phases):
+        self.phases    = list(phases)
+        self.codes     = dict((name, code) for code, name in enumerate(self.phases))
+        self.clock     = clock
+        self.period    = win.monitorFramePeriod
+        self.capacity  = capacity
+        self.maxgap    = maxgap
+        self.requested = np.zeros(capacity)
+        self.flipped   = np.zeros(capacity)
+        self.phase     = np.zeros(capacity, dtype=np.int8)
+        self.nflips    = 0
+        self.current   = self.codes['other']
+        self.onphase   = [] # called with the name of each phase entered (e.g., allocation checkpoints)
+
+        self.win = win
+        self.winflip = win.flip
+        win.flip = self.flip
+
+    def setphase(self, name):
+        self.current = self.codes[name]
+        for callback in self.onphase:
+            callback(name)
+
+    def flip(self, *args, **kwargs):
+        requested = self.clock()
+        result = self.winflip(*args, **kwargs)
+        i = self.nflips % self.capacity
+        self.flipped[i]   = self.clock()
+        self.requested[i] = requested
+        self.phase[i]     = self.current
+        self.nflips += 1
+        return result
+
+    # Logged flips in order (the most recent capacity flips)
+    def table(self):
+        n = min(self.nflips, self.capacity)
+        order = (np.arange(self.nflips - n, self.nflips)) % self.capacity
+        requested, flipped = self.requested[order], self.flipped[order]
+
+        previous = np.concatenate([[-np.inf], flipped[:-1]])
+        consecutive = requested - previous < self.maxgap
+        reference = np.where(consecutive, previous, requested)
+        dropped = np.floor((flipped - reference)/self.period - 0.5)
+
+        return pd.DataFrame({
+            'flip'       : np.arange(self.nflips - n, self.nflips) + 1,
+            'phase'      : np.array(self.phases)[self.phase[order]],
+            'requested'  : requested,
+            'flipped'    : flipped,
+            'interval'   : np.where(consecutive, flipped - previous, np.nan),
+            'consecutive': consecutive,
+            'dropped'    : np.maximum(dropped, 0).astype(int)
+        })
+
+    # Frame-interval percentiles (ms, consecutive flips only) and dropped frames per phase
+    def summary(self, table=None):
+        if table is None:
+            table = self.table()
+        rows = []
+        for name in self.phases:
+            flips = table[table['phase'] == name]
+            if len(flips) == 0:
+                continue
+            intervals = 1e3*flips['interval'].dropna().values
+            row = {'phase': name, 'nflips': len(flips), 'nintervals': len(intervals),
+                   'dropped_frames': flips['dropped'].sum(), 'late_flips': np.sum(flips['dropped'] > 0)}
+            for q in (50, 90, 99, 100):
+                row['interval_p%d' % q] = np.percentile(intervals, q) if len(intervals) > 0 else np.nan
+            rows.append(row)
+        columns = ['phase', 'nflips', 'nintervals', 'interval_p50', 'interval_p90', 'interval_p99',
+                   'interval_p100', 'dropped_frames', 'late_flips']
+        summary = pd.DataFrame(rows, columns=columns)
+        summary['frame_period'] = 1e3*self.period
+        return summary
+
+    # Write <prefix>.csv (every flip) and <prefix>_summary.csv
+    def write(self, prefix):
+        table = self.table()
+        table.to_csv(prefix + '.csv', sep='\t', encoding='utf-8', index=False)
+        self.summary(table).to_csv(prefix + '_summary.csv', sep='\t', encoding='utf-8', index=False)
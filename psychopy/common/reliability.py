@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import glob
+import time
+import argparse
+import pandas as pd
+import numpy as np
+from multiprocessing import Pool
+
+'''
+================================================================================
+
+    SPLIT-HALF AND BOOTSTRAP RELIABILITY
+
+    Resampling engine for task scores:
+
+    - split-half reliability (Spearman-Brown corrected) from an odd/even
+      split or from many random splits within each subject
+    - bootstrap confidence intervals of the split-half reliability
+      (resampling subjects)
+    - bootstrap confidence intervals of each subject's score (resampling
+      trials within subjects)
+
+    The data are one set of flat arrays with a row per trial, sorted by
+    subject. Every resample is an array of row indices into them, and scores
+    are computed from the indexed rows with bincount, so no table is ever
+    copied. Resamples are spread across a process pool; each worker receives
+    the arrays once, when it starts, and then only seeds.
+
+    Scores:
+
+    - OPSPAN: partial and absolute score, as proportions of the letters shown
+      (see opspanscore.py); the trials are sets.
+    - Two-step: model-based index (reward x transition effect on the stay
+      probability) and model-free index (reward effect); the trials are pairs
+      of consecutive trials.
+
+================================================================================
+'''
+
+'''
+================================================================================
+
+    TASK DATA AND SCORES
+
+================================================================================
+'''
+
+# Flat trial arrays from OPSPAN data files
+def opspandata(filenames):
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'opspan'))
+    import opspanscore
+
+    trials = opspanscore.scoretrials(opspanscore.readfiles(filenames))
+    subjects, groups = np.unique(trials['subject_id'] + '\t' + trials['file'], return_inverse=True)
+    order = np.argsort(groups, kind='stable')
+    return {
+        'subject_ids'    : [s.split('\t')[0] for s in subjects],
+        'groups'         : groups[order],
+        'span'           : trials['span'].values[order].astype(float),
+        'letters_correct': trials['letters_correct'].values[order].astype(float),
+        'absolute'       : (trials['span']*trials['correct']).values[order].astype(float)
+    }
+
+# Flat trial arrays from two-step data files, one row per pair of consecutive trials
+def twostepdata(filenames):
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'two-step'))
+    import stayanalysis
+
+    subject_ids, choice1, states, rewards, mask = stayanalysis.readfiles(filenames)
+    valid = mask[:, 1:]
+    groups = np.repeat(np.arange(len(subject_ids)), valid.sum(axis=1))
+    return {
+        'subject_ids': subject_ids,
+        'groups'     : groups,
+        'stay'       : (choice1[:, 1:] == choice1[:, :-1])[valid].astype(float),
+        'rewarded'   : (rewards[:, :-1] == 1)[valid],
+        'common'     : (states[:, :-1] == choice1[:, :-1])[valid]
+    }
+
+# Scores take the rows to use and the subject (0 to nsubjects-1) of each row.
+# OPSPAN: letters recalled in place / letters shown
+def partialscore(data, rows, groups, nsubjects):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (np.bincount(groups, data['letters_correct'][rows], nsubjects) /
+                np.bincount(groups, data['span'][rows], nsubjects))
+
+# Letters in perfectly recalled sets (without timeouts) / letters shown
+def absolutescore(data, rows, groups, nsubjects):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (np.bincount(groups, data['absolute'][rows], nsubjects) /
+                np.bincount(groups, data['span'][rows], nsubjects))
+
+# Stay probabilities by previous reward x transition type over the given rows,
+# shaped (subjects x 4) in the order of ppc.staylabels
+def stayprobabilities(data, rows, groups, nsubjects):
+    cell = 2*(~data['rewarded'][rows]) + (~data['common'][rows])
+    bins = 4*groups + cell
+    with np.errstate(invalid='ignore', divide='ignore'):
+        probs = (np.bincount(bins, data['stay'][rows], 4*nsubjects) /
+                 np.bincount(bins, minlength=4*nsubjects))
+    return probs.reshape(nsubjects, 4)
+
+# (rewarded common - rewarded rare) - (unrewarded common - unrewarded rare)
+def mbindex(data, rows, groups, nsubjects):
+    p = stayprobabilities(data, rows, groups, nsubjects)
+    return (p[:, 0] - p[:, 1]) - (p[:, 2] - p[:, 3])
+
+# (rewarded common + rewarded rare) - (unrewarded common + unrewarded rare)
+def mfindex(data, rows, groups, nsubjects):
+    p = stayprobabilities(data, rows, groups, nsubjects)
+    return (p[:, 0] + p[:, 1]) - (p[:, 2] + p[:, 3])
+
+tasks = {
+    'opspan' : (opspandata, 'opspandata*.csv', {'partial': partialscore, 'absolute': absolutescore}),
+    'twostep': (twostepdata, 'data_*.csv', {'mbindex': mbindex, 'mfindex': mfindex})
+}
+
+'''
+================================================================================
+
+    RESAMPLING
+
+================================================================================
+'''
+
+# SeedSequence from an int, None or an existing SeedSequence
+def seedsequence(seed):
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+# First row and number of rows of each subject (rows are sorted by subject)
+def subjectrows(groups, nsubjects):
+    counts = np.bincount(groups, minlength=nsubjects)
+    return np.cumsum(counts) - counts, counts
+
+# Row indices of the two halves of the data.
+#   'oddeven' alternates trials within each subject; 'random' assigns a random
+#   half of each subject's trials to each half.
+def halves(groups, method='oddeven', rng=None):
+    nsubjects = groups.max() + 1
+    starts, counts = subjectrows(groups, nsubjects)
+    if method == 'oddeven':
+        order = np.arange(len(groups))
+    else:
+        order = np.argsort(groups + rng.random(len(groups))) # shuffled within subject
+    position = np.arange(len(groups)) - starts[groups]
+    first = position % 2 == 0
+    return order[first], order[~first]
+
+# Spearman-Brown corrected correlation between two halves' scores (over subjects with both)
+def splithalfr(a, b):
+    valid = np.isfinite(a) & np.isfinite(b)
+    r = np.corrcoef(a[valid], b[valid])[0, 1]
+    return 2*r/(1 + r)
+
+# Row indices of a set of subjects (repeats allowed), with the subjects renumbered
+def resamplesubjects(groups, subjects, starts, counts):
+    n = counts[subjects]
+    offsets = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    rows = np.repeat(starts[subjects], n) + offsets
+    return rows, np.repeat(np.arange(len(subjects)), n)
+
+# Arrays shared by the workers of a pool, set once per process
+shareddata = None
+
+def initworker(data):
+    global shareddata
+    shareddata = data
+
+# Resamples of one kind for one chunk of resamples: job = (kind, score, method, seed, nresamples)
+def resamplechunk(job):
+    kind, score, method, seed, nresamples = job
+    data = shareddata
+    rng = np.random.default_rng(seed)
+    groups = data['groups']
+    nsubjects = groups.max() + 1
+    starts, counts = subjectrows(groups, nsubjects)
+
+    if kind == 'split':
+        # Random split-half reliabilities
+        results = np.empty(nresamples)
+        for i in range(nresamples):
+            first, second = halves(groups, 'random', rng)
+            results[i] = splithalfr(score(data, first, groups[first], nsubjects),
+                                    score(data, second, groups[second], nsubjects))
+    elif kind == 'subjects':
+        # Split-half reliability of a resample of subjects
+        results = np.empty(nresamples)
+        for i in range(nresamples):
+            rows, newgroups = resamplesubjects(groups, rng.integers(0, nsubjects, nsubjects), starts, counts)
+            first, second = halves(newgroups, method, rng)
+            results[i] = splithalfr(score(data, rows[first], newgroups[first], nsubjects),
+                                    score(data, rows[second], newgroups[second], nsubjects))
+    else:
+        # Scores of resamples of trials within subjects
+        results = np.empty([nresamples, nsubjects])
+        for i in range(nresamples):
+            rows = starts[groups] + (rng.random(len(groups))*counts[groups]).astype(int)
+            results[i] = score(data, rows, groups, nsubjects)
+    return results
+
+# Run nresamples resamples of one kind, in chunks across a process pool
+def resample(data, kind, score, method='oddeven', nresamples=1000, seed=0, nworkers=None, nchunks=None):
+    if nchunks is None:
+        nchunks = min(nresamples, 4*(nworkers or os.cpu_count() or 1))
+    sizes = np.diff(np.linspace(0, nresamples, nchunks+1).astype(int))
+    seeds = seedsequence(seed).spawn(nchunks)
+    jobs = [(kind, score, method, s, n) for s, n in zip(seeds, sizes) if n > 0]
+
+    if nworkers == 1 or len(jobs) <= 1:
+        initworker(data)
+        results = [resamplechunk(job) for job in jobs]
+    else:
+        pool = Pool(nworkers, initializer=initworker, initargs=(data,))
+        try:
+            results = pool.map(resamplechunk, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return np.concatenate(results)
+
+# Reliability of one score: odd/even and random split-half, with bootstrap
+# confidence intervals over subjects. Returns a dict of summary values and
+# the per-subject bootstrap intervals of the score as a table.
+def reliability(data, score, nsplits=1000, nboot=1000, seed=0, nworkers=None, mass=0.95):
+    nsubjects = data['groups'].max() + 1
+    seeds = seedsequence(seed).spawn(3)
+    tail = 100*(1 - mass)/2
+
+    first, second = halves(data['groups'], 'oddeven')
+    groups = data['groups']
+    oddeven = splithalfr(score(data, first, groups[first], nsubjects),
+                         score(data, second, groups[second], nsubjects))
+    randomsplits = resample(data, 'split', score, 'random', nsplits, seeds[0], nworkers)
+    bootr = resample(data, 'subjects', score, 'oddeven', nboot, seeds[1], nworkers)
+    bootscores = resample(data, 'trials', score, None, nboot, seeds[2], nworkers)
+
+    summary = {
+        'oddeven'         : oddeven,
+        'oddeven_ci_low'  : np.nanpercentile(bootr, tail),
+        'oddeven_ci_high' : np.nanpercentile(bootr, 100 - tail),
+        'random'          : np.nanmean(randomsplits),
+        'random_ci_low'   : np.nanpercentile(randomsplits, tail),
+        'random_ci_high'  : np.nanpercentile(randomsplits, 100 - tail),
+        'nsubjects'       : nsubjects
+    }
+    scores = pd.DataFrame({
+        'subject_id': data['subject_ids'],
+        'score'     : score(data, np.arange(len(groups)), groups, nsubjects),
+        'ci_low'    : np.nanpercentile(bootscores, tail, axis=0),
+        'ci_high'   : np.nanpercentile(bootscores, 100 - tail, axis=0)
+    })
+    return summary, scores
+
+'''
+================================================================================
+
+    RUN RELIABILITY ANALYSIS
+
+================================================================================
+'''
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Split-half and bootstrap reliability of task scores.')
+    parser.add_argument('task', choices=sorted(tasks))
+    parser.add_argument('files', nargs='*', help='data files or glob patterns')
+    parser.add_argument('--nsplits', type=int, default=1000, help='random splits')
+    parser.add_argument('--nboot', type=int, default=1000, help='bootstrap resamples')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--nworkers', type=int, default=None)
+    parser.add_argument('--output', default='reliability')
+    args = parser.parse_args()
+
+    readdata, pattern, scores = tasks[args.task]
+    filenames = sorted(set(f for p in (args.files or [pattern]) for f in glob.glob(p)))
+    data = readdata(filenames)
+
+    rows, tables = [], []
+    for name in sorted(scores):
+        starttime = time.time()
+        summary, table = reliability(data, scores[name], args.nsplits, args.nboot, args.seed, args.nworkers)
+        summary['score'] = name
+        summary['elapsed'] = time.time() - starttime
+        rows.append(summary)
+        tables.append(table.rename(columns={'score': name, 'ci_low': name + '_ci_low', 'ci_high': name + '_ci_high'}))
+
+    summary = pd.DataFrame(rows)[['score', 'nsubjects', 'oddeven', 'oddeven_ci_low', 'oddeven_ci_high',
+                                  'random', 'random_ci_low', 'random_ci_high', 'elapsed']]
+    subjects = tables[0]
+    for table in tables[1:]:
+        subjects = subjects.merge(table, on='subject_id')
+
+    summary.to_csv(args.output + '_summary.csv', sep='\t', encoding='utf-8', index=False)
+    subjects.to_csv(args.output + '_subjects.csv', sep='\t', encoding='utf-8', index=False)
+    print(summary.to_string(index=False, float_format='%.3f'))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import tracemalloc
+import pandas as pd
+
+'''
+================================================================================
+
+    STIMULUS REGISTRY
+
+    Every visual object a task shows is built once, through the registry,
+    before the first trial. Trials only change the objects they draw (text,
+    position, colour); they never construct new ones. Texts that depend on
+    the session (scores, earnings) are registered with a template and
+    filled in place with settext.
+
+    Once the task calls seal(), adding another stimulus to the registry
+    raises an error. Only registry additions are checked: a stimulus
+    constructed directly (e.g., visual.TextStim(...)) in a trial loop is
+    not caught.
+
+    The registry times each build and measures the Python memory it
+    allocates with tracemalloc (GPU textures are not included). If tracing
+    is not already on, it is started for the build and stopped at seal().
+
+================================================================================
+'''
+
+class StimulusRegistry(object):
+    def __init__(self):
+        self.stimuli    = {}
+        self.templates  = {}
+        self.rows       = []
+        self.sealed     = False
+        self.owntracing = not tracemalloc.is_tracing()
+        if self.owntracing:
+            tracemalloc.start()
+
+    # Build a stimulus (or a group of stimuli) as factory(*args, **kwargs) and keep it under name
+    def add(self, name, factory, *args, **kwargs):
+        if self.sealed:
+            raise RuntimeError('Stimulus %r built after the registry was sealed' % name)
+        if name in self.stimuli:
+            raise ValueError('Stimulus %r is already registered' % name)
+        before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        stimulus = factory(*args, **kwargs)
+        self.rows.append({'name': name, 'type': getattr(factory, '__name__', str(factory)),
+                          'build_ms': 1e3*(time.perf_counter() - start),
+                          'bytes': tracemalloc.get_traced_memory()[0] - before})
+        self.stimuli[name] = stimulus
+        return stimulus
+
+    # Text stimulus whose text is filled in later from template (see settext)
+    def addtext(self, name, template, factory, *args, **kwargs):
+        self.templates[name] = template
+        return self.add(name, factory, *args, text='', **kwargs)
+
+    # Fill in the template of a text stimulus, in place
+    def settext(self, name, **values):
+        stimulus = self.stimuli[name]
+        stimulus.text = self.templates[name] % values
+        return stimulus
+
+    def __getitem__(self, name):
+        return self.stimuli[name]
+
+    def seal(self):
+        self.sealed = True
+        if self.owntracing:
+            tracemalloc.stop()
+
+    # Build time and memory per stimulus, with a total row
+    def report(self):
+        report = pd.DataFrame(self.rows, columns=['name', 'type', 'build_ms', 'bytes'])
+        total = pd.DataFrame([{'name': 'total', 'type': '%d stimuli' % len(self.rows),
+                               'build_ms': report['build_ms'].sum(), 'bytes': report['bytes'].sum()}])
+        return pd.concat([report, total], ignore_index=True)
+
+    def write(self, filename):
+        self.report().to_csv(filename, sep='\t', encoding='utf-8', index=False)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import functools
+import numpy as np
+import pandas as pd
+
+'''
+================================================================================
+
+    SPAN TRACER
+
+    Times function calls and named regions of a task. Each span is a name
+    code and start and end times on a monotonic clock, stored in a
+    preallocated ring buffer. The most recent capacity spans are kept.
+
+    Functions are traced by rebinding them to tracer.wrap(f), and regions
+    with "with tracer.span('name'):". A disabled tracer returns the function
+    itself from wrap and a shared no-op context from span, so leaving the
+    calls in costs nothing measurable.
+
+    The trace is written as Chrome trace-event JSON (open it in
+    chrome://tracing or https://ui.perfetto.dev). A summary of durations per
+    name is written next to it.
+
+================================================================================
+'''
+
+class NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+nullspan = NullSpan()
+
+class Span(object):
+    __slots__ = ('tracer', 'code', 'start')
+
+    def __init__(self, tracer, code):
+        self.tracer = tracer
+        self.code = code
+
+    def __enter__(self):
+        self.start = self.tracer.clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.code, self.start, self.tracer.clock())
+        return False
+
+class Tracer(object):
+    # clock must be monotonic; pass the clock the task uses (e.g., core.getTime)
+    def __init__(self, clock=time.perf_counter, capacity=2**18, enabled=True, process='task'):
+        self.clock    = clock
+        self.enabled  = enabled
+        self.process  = process
+        self.capacity = capacity
+        self.names    = []
+        self.codes    = {}
+        self.nspans   = 0
+        self.origin   = clock()
+        if enabled:
+            self.code  = np.zeros(capacity, dtype=np.int32)
+            self.start = np.zeros(capacity)
+            self.end   = np.zeros(capacity)
+
+    def namecode(self, name):
+        if name not in self.codes:
+            self.codes[name] = len(self.names)
+            self.names.append(name)
+        return self.codes[name]
+
+    def record(self, code, start, end):
+        i = self.nspans % self.capacity
+        self.code[i]  = code
+        self.start[i] = start
+        self.end[i]   = end
+        self.nspans += 1
+
+    # Traced version of func (func itself if disabled)
+    def wrap(self, func, name=None):
+        if not self.enabled:
+            return func
+        code = self.namecode(name if name is not None else func.__name__)
+        clock, record = self.clock, self.record
+
+        @functools.wraps(func)
+        def traced(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(code, start, clock())
+        return traced
+
+    # Context manager timing a named region
+    def span(self, name):
+        if not self.enabled:
+            return nullspan
+        return Span(self, self.namecode(name))
+
+    # Recorded spans in order of start time
+    def table(self):
+        if not self.enabled:
+            return pd.DataFrame(columns=['name', 'start', 'end', 'duration'])
+        n = min(self.nspans, self.capacity)
+        order = np.arange(self.nspans - n, self.nspans) % self.capacity
+        order = order[np.argsort(self.start[order], kind='stable')]
+        return pd.DataFrame({
+            'name'    : np.array(self.names, dtype=object)[self.code[order]],
+            'start'   : self.start[order],
+            'end'     : self.end[order],
+            'duration': self.end[order] - self.start[order]
+        }, columns=['name', 'start', 'end', 'duration'])
+
+    # Count and duration percentiles (ms) per name
+    def summary(self, table=None):
+        if table is None:
+            table = self.table()
+        ms = table.assign(duration=1e3*table['duration']).groupby('name', sort=False)['duration']
+        summary = pd.DataFrame({
+            'count'   : ms.count(),
+            'total'   : ms.sum(),
+            'mean'    : ms.mean(),
+            'p50'     : ms.quantile(0.5),
+            'p99'     : ms.quantile(0.99),
+            'max'     : ms.max()
+        }, columns=['count', 'total', 'mean', 'p50', 'p99', 'max'])
+        return summary.reset_index()
+
+    # Chrome trace-event format: one complete ("X") event per span, times in microseconds
+    def chrometrace(self, table=None):
+        if table is None:
+            table = self.table()
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': self.process}}]
+        ts  = 1e6*(table['start'].values - self.origin)
+        dur = 1e6*table['duration'].values
+        for name, t, d in zip(table['name'].values, ts, dur):
+            events.append({'name': name, 'ph': 'X', 'pid': 1, 'tid': 1, 'ts': float(t), 'dur': float(d)})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'nspans': self.nspans, 'dropped': max(0, self.nspans - self.capacity)}}
+
+    # Write <prefix>.json (Chrome trace) and <prefix>_summary.csv
+    def write(self, prefix):
+        if not self.enabled:
+            return
+        table = self.table()
+        with open(prefix + '.json', 'w') as f:
+            json.dump(self.chrometrace(table), f)
+        self.summary(table).to_csv(prefix + '_summary.csv', sep='\t', encoding='utf-8', index=False)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import re
+import argparse
+import numpy as np
+
+'''
+================================================================================
+
+    COMPILED EQUATION BANK
+
+    Compiles resources/operations.txt ("( a op b ) × c = d" and y/n per line)
+    into a structured array with one row per equation, and caches it next to
+    the text file as a binary .npz file. The cache is rebuilt whenever the
+    text file's modification time or size changes.
+
+    EquationSampler draws equations without replacement, balancing true and
+    false equations, optionally within a difficulty level. Every (truth,
+    difficulty) cell keeps its own shuffled list of equation IDs, so a draw
+    is O(1); a cell is reshuffled once all its equations have been shown.
+
+================================================================================
+'''
+
+equationfile = 'resources/operations.txt'
+
+equationdtype = np.dtype([
+    ('a',          np.int16),  # first operand
+    ('op',         'U1'),      # '+' or '-'
+    ('b',          np.int16),  # second operand
+    ('c',          np.int16),  # multiplier
+    ('shown',      np.int32),  # result shown to the subject
+    ('answer',     np.int32),  # true result
+    ('truth',      np.bool_),  # whether the shown result is correct
+    ('difficulty', np.int8),   # 0: answer below 10, 1: below 20, 2: 20 or above
+    ('text',       'U32')      # display string
+])
+
+difficultybounds = [10, 20]
+
+equationpattern = re.compile(r'^\(\s*(\d+)\s*([+-])\s*(\d+)\s*\)\s*×\s*(\d+)\s*=\s*(-?\d+)$')
+
+# Difficulty level from the true result
+def difficulty(answer):
+    return np.digitize(np.abs(answer), difficultybounds).astype(np.int8)
+
+# Display strings, as written in operations.txt
+def formatequations(a, op, b, c, shown):
+    return np.array([u'( %d %s %d ) × %d = %d' % row for row in zip(a, op, b, c, shown)], dtype='U32')
+
+# Raise an error if values do not fit in the integer field name of equationdtype
+def checkrange(name, values):
+    limits = np.iinfo(equationdtype[name])
+    if len(values) > 0 and (values.min() < limits.min or values.max() > limits.max):
+        raise ValueError('%s ranges from %d to %d, but the bank holds %d to %d' %
+                         (name, values.min(), values.max(), limits.min, limits.max))
+
+# Bank rows from the columns of a set of equations; truth and difficulty are computed
+def makebank(a, op, b, c, shown):
+    a, b, c, shown = [np.asarray(column, dtype=np.int64) for column in (a, b, c, shown)]
+    answer = np.where(np.asarray(op) == '+', a + b, a - b)*c
+    for name, column in [('a', a), ('b', b), ('c', c), ('shown', shown), ('answer', answer)]:
+        checkrange(name, column)
+
+    bank = np.empty(len(a), dtype=equationdtype)
+    bank['a']     = a
+    bank['op']    = op
+    bank['b']     = b
+    bank['c']     = c
+    bank['shown'] = shown
+    bank['answer'] = answer
+    bank['truth'] = bank['shown'] == bank['answer']
+    bank['difficulty'] = difficulty(bank['answer'])
+    bank['text']  = formatequations(bank['a'], bank['op'], bank['b'], bank['c'], bank['shown'])
+    return bank
+
+# Parse an equation file. The y/n column must agree with the equation itself.
+def parseequations(filename=equationfile):
+    rows, flags = [], []
+    with io.open(filename, encoding='utf-8') as f:
+        for linenumber, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            equation, flag = line.rstrip('\r\n').split('\t')
+            match = equationpattern.match(equation.strip())
+            if match is None:
+                raise ValueError('%s, line %d: cannot parse equation %r' % (filename, linenumber, equation))
+            a, op, b, c, shown = match.groups()
+            rows.append((int(a), op, int(b), int(c), int(shown)))
+            flags.append(flag.strip() == 'y')
+
+    bank = makebank(*zip(*rows))
+    wrong = np.flatnonzero(bank['truth'] != np.array(flags))
+    if len(wrong) > 0:
+        raise ValueError('%s: y/n flag disagrees with the equation on line(s) %s' %
+                         (filename, ', '.join(str(i+1) for i in wrong)))
+    return bank
+
+# Cache file for an equation file
+def cachefile(filename):
+    return os.path.splitext(filename)[0] + '.npz'
+
+# Compiled bank for an equation file, from the cache if it is up to date
+def loadbank(filename=equationfile):
+    stat = os.stat(filename)
+    cache = cachefile(filename)
+    if os.path.exists(cache):
+        with np.load(cache) as cached:
+            if cached['mtime'] == stat.st_mtime and cached['size'] == stat.st_size:
+                return cached['bank']
+
+    bank = parseequations(filename)
+    tmpfile = cache + '.tmp'
+    with open(tmpfile, 'wb') as f:
+        np.savez(f, bank=bank, mtime=stat.st_mtime, size=stat.st_size)
+    os.replace(tmpfile, cache)
+    return bank
+
+class EquationSampler(object):
+    def __init__(self, bank, rng=None):
+        self.bank = bank
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.ndifficulty = len(difficultybounds) + 1
+
+        # Shuffled equation IDs per (truth, difficulty) cell, with a cursor into each
+        self.cells = {}
+        self.cursors = {}
+        for truth in (False, True):
+            for level in range(self.ndifficulty):
+                ids = np.flatnonzero((bank['truth'] == truth) & (bank['difficulty'] == level))
+                if len(ids) > 0:
+                    self.cells[truth, level] = ids
+                    self.reshuffle(truth, level)
+        self.ndrawn = {False: 0, True: 0}
+
+    def reshuffle(self, truth, level):
+        self.rng.shuffle(self.cells[truth, level])
+        self.cursors[truth, level] = 0
+
+    def remaining(self, truth, level):
+        if (truth, level) not in self.cells:
+            return 0
+        return len(self.cells[truth, level]) - self.cursors[truth, level]
+
+    # ID of the next equation. truth=None balances true and false equations;
+    # difficulty=None draws uniformly from the unshown equations of any level.
+    def draw(self, truth=None, difficulty=None):
+        if truth is None:
+            available = [t for t in (False, True) if any((t, l) in self.cells for l in range(self.ndifficulty))]
+            fewest = min(self.ndrawn[t] for t in available)
+            candidates = [t for t in available if self.ndrawn[t] == fewest]
+            truth = candidates[self.rng.integers(len(candidates))]
+        truth = bool(truth)
+        levels = range(self.ndifficulty) if difficulty is None else [int(difficulty)]
+        levels = [l for l in levels if (truth, l) in self.cells]
+        if len(levels) == 0:
+            raise ValueError('No equations with truth=%s and difficulty=%s' % (truth, difficulty))
+
+        # Start a new pass once every equation in the chosen cells has been shown
+        counts = np.array([self.remaining(truth, l) for l in levels], dtype=float)
+        if counts.sum() == 0:
+            for l in levels:
+                self.reshuffle(truth, l)
+            counts = np.array([self.remaining(truth, l) for l in levels], dtype=float)
+
+        level = levels[self.rng.choice(len(levels), p=counts/counts.sum())]
+        equationid = self.cells[truth, level][self.cursors[truth, level]]
+        self.cursors[truth, level] += 1
+        self.ndrawn[truth] += 1
+        return equationid
+
+    # Correct key answer ('y' or 'n') and display string of an equation
+    def answer(self, equationid):
+        return 'y' if self.bank['truth'][equationid] else 'n'
+
+    def text(self, equationid):
+        return self.bank['text'][equationid]
+
+'''
+================================================================================
+
+    COMPILE EQUATION BANK
+
+================================================================================
+'''
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compile an OPSPAN equation file into a cached bank.')
+    parser.add_argument('--input', default=equationfile)
+    args = parser.parse_args()
+
+    bank = loadbank(args.input)
+    print('%d equations (%d true) cached in %s' % (len(bank), np.sum(bank['truth']), cachefile(args.input)))
+    for level in range(len(difficultybounds) + 1):
+        print('difficulty %d: %d true, %d false' % (level, np.sum(bank['truth'] & (bank['difficulty'] == level)),
+                                                   np.sum(~bank['truth'] & (bank['difficulty'] == level))))
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import argparse
+import numpy as np
+
+import equationbank
+
+'''
+================================================================================
+
+    PROCEDURAL EQUATION GENERATOR
+
+    Generates "( a op b ) × c = d" equations in bulk, in the style of
+    resources/operations.txt: single-digit operands, a non-negative
+    bracket, and a small multiplier. False equations show the true result
+    plus or minus an offset. Candidates are generated and checked as arrays,
+    and duplicates (within the batch and against equations already shown)
+    are dropped.
+
+    The result is an equation bank (see equationbank.py) that
+    EquationSampler, and so drawequation in opspan.py, can use directly. It
+    can also be written to a text file in the format of operations.txt and
+    compiled ahead of a session.
+
+================================================================================
+'''
+
+operandrange    = (1, 9)  # a and b
+multiplierrange = (1, 5)  # c
+
+# Radices of the equation keys: b and c must be below keyradix, and results
+# shown between -shownradix/2 and shownradix/2
+keyradix   = 1000
+shownradix = 100000
+
+# Integer key of each equation, for deduplication
+def equationkeys(a, op, b, c, shown):
+    opbit = (np.asarray(op) == '-').astype(np.int64)
+    key = np.asarray(a, dtype=np.int64)*2 + opbit
+    key = key*keyradix + np.asarray(b, dtype=np.int64)
+    key = key*keyradix + np.asarray(c, dtype=np.int64)
+    return key*shownradix + np.asarray(shown, dtype=np.int64) + shownradix//2
+
+def bankkeys(bank):
+    return equationkeys(bank['a'], bank['op'], bank['b'], bank['c'], bank['shown'])
+
+# Candidate equations with true (truth=True) or offset (truth=False) results
+def candidates(n, truth, rng, minoffset=1, maxoffset=3, operands=operandrange, multipliers=multiplierrange):
+    a  = rng.integers(operands[0], operands[1]+1, n)
+    b  = rng.integers(operands[0], operands[1]+1, n)
+    c  = rng.integers(multipliers[0], multipliers[1]+1, n)
+    op = np.where(rng.random(n) < 0.5, '+', '-')
+
+    # Keep the bracket non-negative
+    swap = (op == '-') & (b > a)
+    a, b = np.where(swap, b, a), np.where(swap, a, b)
+
+    answer = np.where(op == '+', a + b, a - b)*c
+    shown = answer.copy()
+    if not truth:
+        offset = rng.integers(minoffset, maxoffset+1, n)*np.where(rng.random(n) < 0.5, -1, 1)
+        offset = np.where(answer + offset < 0, -offset, offset) # results shown are never negative
+        shown = answer + offset
+    return a, op, b, c, shown
+
+# Generate n unique equations, a fraction ptrue of them true.
+#   exclude is a bank (or array of equation keys) of equations not to repeat.
+#   The default ranges allow 630 distinct true equations; widen operands or
+#   multipliers for more.
+def generate(n, rng=None, ptrue=0.5, minoffset=1, maxoffset=3, exclude=None,
+             operands=operandrange, multipliers=multiplierrange):
+    if rng is None:
+        rng = np.random.default_rng()
+    if minoffset < 1 or maxoffset < minoffset:
+        raise ValueError('Offsets must satisfy 1 <= minoffset <= maxoffset')
+    if min(operands[0], multipliers[0]) < 0 or max(operands[1], multipliers[1]) >= keyradix:
+        raise ValueError('Operands and multipliers must be between 0 and %d' % (keyradix - 1))
+    if 2*operands[1]*multipliers[1] + maxoffset >= shownradix//2:
+        raise ValueError('Results can reach %d, but must stay below %d' %
+                         (2*operands[1]*multipliers[1] + maxoffset, shownradix//2))
+
+    seen = np.zeros(0, dtype=np.int64)
+    if exclude is not None:
+        seen = bankkeys(exclude) if exclude.dtype.names else np.asarray(exclude, dtype=np.int64)
+
+    ntrue = int(round(n*ptrue))
+    parts = []
+    for truth, count in [(True, ntrue), (False, n - ntrue)]:
+        columns = [np.zeros(0, dtype=int), np.zeros(0, dtype='U1'), np.zeros(0, dtype=int),
+                   np.zeros(0, dtype=int), np.zeros(0, dtype=int)]
+        attempts = 0
+        while len(columns[0]) < count:
+            new = candidates(2*(count - len(columns[0])) + 16, truth, rng, minoffset, maxoffset,
+                             operands, multipliers)
+            keys = equationkeys(*new)
+            keys, first = np.unique(keys, return_index=True)
+            fresh = first[~np.isin(keys, seen)]
+            fresh = np.sort(fresh)[:count - len(columns[0])]
+            seen = np.concatenate([seen, equationkeys(*[column[fresh] for column in new])])
+            columns = [np.concatenate([old, column[fresh]]) for old, column in zip(columns, new)]
+
+            attempts = attempts + 1 if len(fresh) == 0 else 0
+            if attempts > 20:
+                raise ValueError('Only %d unique %s equations could be generated' %
+                                 (len(columns[0]), 'true' if truth else 'false'))
+        parts.append(columns)
+
+    columns = [np.concatenate([p[k] for p in parts]) for k in range(5)]
+    bank = equationbank.makebank(*columns)
+    bank = bank[rng.permutation(len(bank))]
+    if np.sum(bank['truth']) != ntrue:
+        raise RuntimeError('Generated equations failed verification')
+    return bank
+
+# Write a bank in the format of operations.txt
+def writebank(bank, filename):
+    with io.open(filename, 'w', encoding='utf-8') as f:
+        for text, truth in zip(bank['text'], bank['truth']):
+            f.write(u'%s\t%s\n' % (text, 'y' if truth else 'n'))
+
+'''
+================================================================================
+
+    GENERATE EQUATIONS
+
+================================================================================
+'''
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate OPSPAN equations.')
+    parser.add_argument('--n', type=int, default=1000)
+    parser.add_argument('--ptrue', type=float, default=0.5, help='fraction of true equations')
+    parser.add_argument('--minoffset', type=int, default=1, help='smallest offset of false results')
+    parser.add_argument('--maxoffset', type=int, default=3, help='largest offset of false results')
+    parser.add_argument('--operands', type=int, nargs=2, default=operandrange, help='range of a and b')
+    parser.add_argument('--multipliers', type=int, nargs=2, default=multiplierrange, help='range of c')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--exclude', nargs='*', default=[], help='equation files whose equations are not repeated')
+    parser.add_argument('--output', default='resources/generated.txt')
+    args = parser.parse_args()
+
+    exclude = None
+    if args.exclude:
+        exclude = np.concatenate([bankkeys(equationbank.loadbank(f)) for f in args.exclude])
+
+    bank = generate(args.n, np.random.default_rng(args.seed), args.ptrue, args.minoffset, args.maxoffset, exclude,
+                    args.operands, args.multipliers)
+    writebank(bank, args.output)
+    equationbank.loadbank(args.output) # compile the cache ahead of the session
+    print('%d equations (%d true) written to %s' % (len(bank), np.sum(bank['truth']), args.output))
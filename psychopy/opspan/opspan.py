@@ -2,12 +2,20 @@
 # -*- coding: utf-8 -*-
 
 from psychopy import core, visual, event, gui
+import os
 import sys
 import pandas as pd
 import numpy as np
 import numpy.random as rnd
 import matplotlib.pyplot as plt
-from random import shuffle
+
+import sessionplan
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+import frametiming
+import tracing
+import allocations
+import stimulusregistry
 
 '''
 ================================================================================
@@ -39,6 +47,13 @@ span_high     = 7
 nmathpractice = 15 #As per Unsworth et al. ￼Behavior Research Methods 2005, 37 (3), 498-505
 nspaniterations = 3 #3 #As per Unsworth et al. ￼Behavior Research Methods 2005, 37 (3), 498-505
 
+equationfile = 'resources/operations.txt' # or a bank written by equationgenerator.py
+
+sessionseed = None # seed of the session plan; drawn at random if None
+
+tracespans = False # time drawing functions and key waits, written as opspantrace<id>.json (see tracing.py)
+trackallocations = False # diagnostic: memory and live objects at every phase boundary, written as opspanallocations<id>*.csv (see allocations.py)
+
 fullscreen = True
 if fullscreen is True:
     monitor_width  = 1024.
@@ -62,27 +77,45 @@ win = visual.Window(
     units='pix'
     )
 
-equationtext = visual.TextStim(win,
+# Log every flip, tagged with the phase of the trial (see frametiming.py)
+framelog = frametiming.FrameLog(win, core.getTime)
+
+# Time flips and key waits (a disabled tracer leaves them untouched)
+tracer = tracing.Tracer(core.getTime, enabled=tracespans, process='opspan')
+win.flip = tracer.wrap(win.flip, 'flip')
+event.waitKeys = tracer.wrap(event.waitKeys, 'waitKeys')
+
+# Check memory and live objects on entering each phase (diagnostic; distorts timing)
+if trackallocations:
+    allocmonitor = allocations.AllocationMonitor(trialphase='recall')
+    framelog.onphase.append(allocmonitor.checkpoint)
+    allocmonitor.start()
+
+# Every visual object is built once through the registry, before the first trial
+stimuli = stimulusregistry.StimulusRegistry()
+
+equationtext = stimuli.add('equationtext', visual.TextStim, win,
     height=0.05*monitor_height,
     font='DejaVu Sans',
     color=[1, 1, 1]
 )
-lettertext   = visual.TextStim(win,
+lettertext   = stimuli.add('lettertext', visual.TextStim, win,
     height=0.05*monitor_height,
     font='DejaVu Sans',
     color=[1, 1, 1]
 )
 
-# Load operations and letters
-equations = np.loadtxt('resources/operations.txt',
-                        delimiter='\t',
-                        dtype='string'
-)
-
-characters = np.loadtxt('resources/consonants.txt',
-                        delimiter='\t',
-                        dtype='string'
-)
+# Build the whole session (letters, equations, span order) before the first
+# screen, and save it next to the data
+if sessionseed is None:
+    sessionseed = rnd.randint(2**31)
+plan = sessionplan.compileplan(sessionseed,
+                               equationfile=equationfile,
+                               span_low=span_low,
+                               span_high=span_high,
+                               nspaniterations=nspaniterations,
+                               nmathpractice=nmathpractice)
+sessionplan.saveplan(plan, 'opspanplan' + subject_id + '.npz')
 
 '''
 ===============================================================================
@@ -92,7 +125,7 @@ characters = np.loadtxt('resources/consonants.txt',
 ===============================================================================
 '''
 
-intromessage = visual.TextStim(win,
+intromessage = stimuli.add('intromessage', visual.TextStim, win,
     text='Thank you for participating in this study.\n\n' +
          'In the following activity, you will be asked to specify whether ' +
          'the equation displayed is true or false. After you respond, a ' +
@@ -102,7 +135,7 @@ intromessage = visual.TextStim(win,
          'Press any key to continue...'
 )
 
-characterpracticemessage = visual.TextStim(win,
+characterpracticemessage = stimuli.add('characterpracticemessage', visual.TextStim, win,
     text='First, we will begin by practicing letter recall.\n\n' +
          'You will be presented with a sequence of letters, one at a time.\n' +
          'Once all the letters have been presented, you will see a vertical bar (a cursor), indicating that you should input your answers. Please type in the letters IN THE ORDER THEY APPEARED. If you make a mistake, simply hit "backspace" button. There is no need to separate characters with spaces or commas.\n\n' +
@@ -110,7 +143,7 @@ characterpracticemessage = visual.TextStim(win,
          'Press any key to continue.'
 )
 
-equationpracticemessage = visual.TextStim(win,
+equationpracticemessage = stimuli.add('equationpracticemessage', visual.TextStim, win,
     text='Next, we will be practicing solving the equations.\n\n' +
          'You will be presented with an equation such as the following: \n' +
          '(5-1) X 2 = 9\n' +
@@ -121,20 +154,20 @@ equationpracticemessage = visual.TextStim(win,
          'Press any key to continue.'
 )
 
-fullpracticemessage = visual.TextStim(win,
+fullpracticemessage = stimuli.add('fullpracticemessage', visual.TextStim, win,
     text='Now that you understand the process of solving the equations, we will practice the full task.\n\n' +
          'After you have specified whether the equation displayed is correct or incorrect, a single letter will be displayed for a brief period of time. There will be a series of equation & answer pairs, after which you will be asked to recall the letters IN THE ORDER THEY APPEARED by typing them in. If you make a mistake, simply hit "backspace" button. There is no need to separate characters with spaces or commas.\n\n' +
          'Please answer as quickly as possible, but accuracy is most important.\n\n' +
          'Press any key to continue.'
 )
 
-taskmessage = visual.TextStim(win,
+taskmessage = stimuli.add('taskmessage', visual.TextStim, win,
     text='Now that you understand how to do the task, we will move on to the actual task itself. It is essentially the same as this last practice session, except that you will not be given any feedback, and the length of sequences you need to remember will vary.\n\n' +
          'Despite not having any feedback from now on, please continue to answer as quickly as possible, but accuracy is most important.\n\n' +
          'Press any key to continue.'
 )
 
-congratsmessage = visual.TextStim(win,
+congratsmessage = stimuli.add('congratsmessage', visual.TextStim, win,
     text='Excellent job!'
 )
 
@@ -142,38 +175,58 @@ congratsmessage = visual.TextStim(win,
 #    text='You must answer faster!'
 #)
 
-incorrectanswermessage = visual.TextStim(win,
+incorrectanswermessage = stimuli.add('incorrectanswermessage', visual.TextStim, win,
     text='Incorrect answer. Keep trying!'
 )
 
-completemessage = visual.TextStim(win,
+completemessage = stimuli.add('completemessage', visual.TextStim, win,
     text='Congratulations! You have successfully completed this task.\n\n'
 )
 
-truebutton = visual.Rect(win,
+truebutton = stimuli.add('truebutton', visual.Rect, win,
     height=0.12*monitor_height,
     width=0.12*monitor_width,
     pos=[0.25*monitor_width, -0.25*monitor_height]
 )
 
-falsebutton = visual.Rect(win,
+falsebutton = stimuli.add('falsebutton', visual.Rect, win,
     height=0.12*monitor_height,
     width=0.12*monitor_width,
     pos=[-0.25*monitor_width, -0.25*monitor_height]
 )
 
-truebuttontext = visual.TextStim(win,
+truebuttontext = stimuli.add('truebuttontext', visual.TextStim, win,
     text='True',
     pos=[0.25*monitor_width, -0.25*monitor_height],
     height=0.05*monitor_height
 )
 
-falsebuttontext = visual.TextStim(win,
+falsebuttontext = stimuli.add('falsebuttontext', visual.TextStim, win,
     text='False',
     pos=[-0.25*monitor_width, -0.25*monitor_height],
     height=0.05*monitor_height
 )
 
+# Letter recall: cursor and typed letters (reset on every recall)
+linecursor = stimuli.add('linecursor', visual.Line, win, units='pix', start=[0, -0.05*monitor_height], end=[0, 0.05*monitor_height])
+responsetext = stimuli.add('responsetext', visual.TextStim, win, text='',units='pix', height=0.07*monitor_height)
+
+# Feedback after the full practice and after each span
+practicecompletemessage = stimuli.addtext('practicecompletemessage',
+    'You responded correctly to %(ncorrect)d out of 3 trials',
+    visual.TextStim, win,
+    units='pix',
+    height = 0.05*monitor_height
+)
+trialcompletemessage = stimuli.addtext('trialcompletemessage',
+    'You responded correctly to %(ncorrect)d out of %(ntrials)d trials',
+    visual.TextStim, win,
+    units='pix',
+    height = 0.05*monitor_height
+)
+
+stimuli.seal() # no visual objects are built from here on
+
 '''
 ===============================================================================
 
@@ -191,17 +244,19 @@ def check_equation_answer(keyin,answer):
         score = 0
     return score
 
-def drawequation(equations):
-    equationindex = rnd.randint(np.size(equations, axis=0)-1, size=1)[0]
-    answer = equations[equationindex, 1]
-    equationtext.text = equations[equationindex, 0].decode('utf8')
+# Draw a planned equation
+def drawequation(equationid):
+    text, answer = sessionplan.equation(plan, equationid)
+    equationtext.text = text
     equationtext.draw()
     return answer, equationtext.text
 
 
 def getcharacterinput():
-    linecursor = visual.Line(win, units='pix', start=[0, -0.05*monitor_height], end=[0, 0.05*monitor_height])
-    response = visual.TextStim(win, text='',units='pix', height=0.07*monitor_height)
+    response = responsetext
+    response.text = ''
+    linecursor.start = [0, -0.05*monitor_height]
+    linecursor.end   = [0, 0.05*monitor_height]
 
     linecursor.draw()
     win.flip()
@@ -259,6 +314,11 @@ def drawbuttons(keysel=None):
     truebuttontext.draw()
     falsebuttontext.draw()
 
+# Time the drawing and input functions
+drawequation      = tracer.wrap(drawequation)
+getcharacterinput = tracer.wrap(getcharacterinput)
+drawbuttons       = tracer.wrap(drawbuttons)
+
 '''
 ===============================================================================
 
@@ -292,7 +352,7 @@ characterpracticemessage.draw()
 win.flip()
 event.waitKeys()
 
-spanseq = np.linspace(span_low, span_high, (span_high-span_low)+1)
+spanseq = plan['characterpractice_span']
 
 #show empty screen for a second (so that trials don't start immediately)
 win.flip()
@@ -300,9 +360,10 @@ core.wait(1.0)
 
 ncorrect = 0
 for i in range(0, len(spanseq)):
-    shuffle(characters)
+    characters = plan['characterpractice_letters'][i]
     answer = '';
     for t in range(0, int(spanseq[i])):
+        framelog.setphase('letter')
         lettertext.text = characters[t]
         answer = answer + ' ' + characters[t]
         lettertext.draw()
@@ -312,7 +373,9 @@ for i in range(0, len(spanseq)):
         win.flip()
         core.wait(1.0)
 
+    framelog.setphase('recall')
     response = getcharacterinput()
+    framelog.setphase('other')
     if response == answer:
         ncorrect = ncorrect + 1
         congratsmessage.draw()
@@ -345,8 +408,13 @@ core.wait(1.0)
 equation_rt_array = np.empty(nmathpractice);
 
 ncorrect = 0
+nattempts = 0
 while ncorrect < nmathpractice:
-    answer, eqtext = drawequation(equations)
+    # Reuse the planned equations from the start if the practice runs long
+    equationid = plan['mathpractice_equation'][nattempts % len(plan['mathpractice_equation'])]
+    nattempts += 1
+    framelog.setphase('equation')
+    answer, eqtext = drawequation(equationid)
     drawbuttons()
 
     equation_rt_starttime = core.getTime()
@@ -369,6 +437,7 @@ while ncorrect < nmathpractice:
             win.flip()
             core.wait(1.5)
 
+framelog.setphase('other')
 equation_rt_mean = np.mean(equation_rt_array)
 equation_rt_sd   = np.std(equation_rt_array)
 equationduration = equation_rt_mean + 2.5*equation_rt_sd
@@ -392,12 +461,13 @@ for i in range(0, 3):
     win.flip()
     core.wait(1.0)
 
-    shuffle(characters)
+    characters = plan['fullpractice_letters'][i]
     answer = '';
 
-    for t in range(0, 2):
+    for t in range(0, len(characters)):
 
-        eqanswer, eqtext = drawequation(equations)
+        framelog.setphase('equation')
+        eqanswer, eqtext = drawequation(plan['fullpractice_equation'][i, t])
         drawbuttons()
 
         equation_rt_starttime = core.getTime()
@@ -416,6 +486,7 @@ for i in range(0, 3):
 
         core.wait(1.0)
 
+        framelog.setphase('letter')
         lettertext.text = characters[t]
         answer = answer + ' ' + characters[t]
         lettertext.draw()
@@ -425,18 +496,15 @@ for i in range(0, 3):
         win.flip()
         core.wait(1.0)
 
+    framelog.setphase('recall')
     response = getcharacterinput()
+    framelog.setphase('other')
     if response == answer:
         ntrialscorrect = ntrialscorrect + 1
 
     ntrialscorrect = ntrialscorrect - trialincorrect
 
-practicecompletemessage = visual.TextStim(win,
-    text='You responded correctly to ' + str(ntrialscorrect) + ' out of 3 trials',
-    units='pix',
-    height = 0.05*monitor_height
-)
-
+stimuli.settext('practicecompletemessage', ncorrect=ntrialscorrect)
 practicecompletemessage.draw()
 win.flip()
 core.wait(2.0)
@@ -457,12 +525,13 @@ event.waitKeys()
 win.flip()
 core.wait(1.0)
 
-#Create order of spans (with repmat) then shuffle them
-spanorder = np.linspace(span_low, span_high, (span_high-span_low)+1)
-shuffle(spanorder)
+#Order of spans (shuffled) from the session plan
+spanorder = plan['task_span'][::nspaniterations]
 
 #Create matrices to store data
 data = np.empty([len(spanorder)*nspaniterations, 8]) #[iteration, span, %mathaccuracy, nmathtimeout, correct, mathrt_mean, mathrt_sd, mathrt_max]
+letterdata   = [] # letters presented on each trial
+responsedata = [] # letters typed in on each trial
 
 datarowindex = 0
 # LOOP OVER SPAN LENGTHS
@@ -470,7 +539,7 @@ for span in range(0, len(spanorder)):
     # LOOP OVER ITERATIONS OF EACH SPAN
     ntrialscorrect = 0
     for iteration in range(0, nspaniterations):
-        shuffle(characters)
+        characters = plan['task_letters'][datarowindex]
         charanswer = '';
 
         # Store some data about the trials
@@ -485,7 +554,8 @@ for span in range(0, len(spanorder)):
         #LOOP OVER EQUATIONS/LETTERS
         for t in range(0, int(spanorder[span])):
 
-            eqanswer, eqtext = drawequation(equations)
+            framelog.setphase('equation')
+            eqanswer, eqtext = drawequation(plan['task_equation'][datarowindex, t])
             drawbuttons()
 
             win.flip()
@@ -505,6 +575,7 @@ for span in range(0, len(spanorder)):
 
             core.wait(1.0)
 
+            framelog.setphase('letter')
             lettertext.text = characters[t]
             charanswer = charanswer + ' ' + characters[t]
             lettertext.draw()
@@ -514,7 +585,9 @@ for span in range(0, len(spanorder)):
             win.flip()
             core.wait(1.0)
 
+        framelog.setphase('recall')
         response = getcharacterinput()
+        framelog.setphase('other')
         if response == charanswer:
             trialcorrect = 1
         else:
@@ -522,6 +595,9 @@ for span in range(0, len(spanorder)):
 
         ntrialscorrect = ntrialscorrect + trialcorrect #update for feedback
 
+        letterdata.append(charanswer.strip())
+        responsedata.append(response.strip())
+
         # STORE SOME DATA ABOUT THE TRIAL
         data[datarowindex, 2] = np.mean(mathcorrect)#%mathaccuracy,
         data[datarowindex, 3] = nmathtimeout #nmathtimeout,
@@ -533,12 +609,7 @@ for span in range(0, len(spanorder)):
         #Increment the index of data storage by 1
         datarowindex = datarowindex + 1
 
-    trialcompletemessage = visual.TextStim(win,
-        text='You responded correctly to ' + str(ntrialscorrect) + ' out of ' + str(nspaniterations) + ' trials',
-        units='pix',
-        height = 0.05*monitor_height
-    )
-
+    stimuli.settext('trialcompletemessage', ncorrect=ntrialscorrect, ntrials=nspaniterations)
     trialcompletemessage.draw()
     win.flip()
     core.wait(2.0)
@@ -561,12 +632,29 @@ df = pd.DataFrame({ #[subject_id, iteration, span, %mathaccuracy, nmathtimeout,
     'correct_raw'    : data[:,4], # not corrected for math timeouts
     'mathrt_mean'    : data[:,5],
     'mathrt_sd'      : data[:,6],
-    'mathrt_max'     : data[:,7]
+    'mathrt_max'     : data[:,7],
+    'letters'        : letterdata,   # space-separated, in order of presentation
+    'response'       : responsedata, # space-separated, as typed in
+    'session_seed'   : sessionseed   # seed of opspanplan<id>.npz
 })
 
 # Write to csv
 df.to_csv('opspandata' + subject_id +'.csv', sep='\t', encoding='utf-8')
 
+# Every flip of the session, and frame intervals and dropped frames per phase
+framelog.write('opspanframes' + subject_id)
+
+# Time spent in drawing functions, flips and key waits (if tracespans)
+tracer.write('opspantrace' + subject_id)
+
+# Memory retained per phase and growth per trial (if trackallocations)
+if trackallocations:
+    allocmonitor.stop()
+    allocmonitor.write('opspanallocations' + subject_id)
+
+# Build time and memory of every stimulus
+stimuli.write('opspanstimuli' + subject_id + '.csv')
+
 '''
 ================================================================================
 
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import argparse
+import pandas as pd
+import numpy as np
+
+'''
+================================================================================
+
+    OPSPAN SCORING
+
+    Scores OPSPAN data files (opspandata*.csv) as in Unsworth et al. (2005):
+
+    - absolute score: sum of the spans of all sets recalled perfectly, in
+      order. A set with an equation timeout does not count as correct.
+    - partial score: total number of letters recalled in the correct
+      position, whether or not the whole set was correct. This needs the
+      letters and response columns; for files without them, it falls back
+      to the letters of perfectly recalled sets (correct_raw).
+    - math errors: total, speed (timeouts) and accuracy errors, and whether
+      math accuracy reached the criterion (85%).
+
+    All subjects are scored together with grouped operations.
+
+================================================================================
+'''
+
+criterion = 0.85
+
+# Read data files into one table with a row per trial and a file column
+def readfiles(filenames):
+    tables = []
+    for filename in sorted(filenames):
+        data = pd.read_csv(filename, sep='\t', encoding='utf-8', dtype={'subject_id': str,
+                           'letters': str, 'response': str}, keep_default_na=False, na_values=[''])
+        data = data.drop(columns=[c for c in data.columns if c.startswith('Unnamed')]) # pandas index
+        data['subject_id'] = data['subject_id'].fillna(
+            os.path.splitext(os.path.basename(filename))[0].replace('opspandata', '', 1))
+        data['file'] = filename
+        tables.append(data)
+    return pd.concat(tables, ignore_index=True, sort=False)
+
+# Number of letters recalled in the correct position on each trial.
+#   letters and responses are space-separated strings, as written by opspan.py.
+def positioncorrect(letters, responses):
+    letters   = pd.Series(letters).fillna('').str.replace(' ', '', regex=False).to_numpy(dtype=str)
+    responses = pd.Series(responses).fillna('').str.replace(' ', '', regex=False).to_numpy(dtype=str)
+    width = max(1, np.char.str_len(letters).max(), np.char.str_len(responses).max())
+
+    # Fixed-width arrays of single characters, shaped (trials x width); padding is ''
+    letters   = letters.astype('U%d' % width).view('U1').reshape(len(letters), width)
+    responses = responses.astype('U%d' % width).view('U1').reshape(len(responses), width)
+    return np.sum((letters == responses) & (letters != ''), axis=1)
+
+# Add trial-level scores to a table of trials
+def scoretrials(data):
+    data = data.copy()
+    data['span'] = data['span'].astype(int)
+    data['correct'] = ((data['correct_raw'] == 1) & (data['n_math_timeout'] == 0)).astype(int)
+    data['math_errors'] = np.round(data['span']*(1 - data['math_accuracy'])).astype(int)
+    data['math_speed_errors'] = data['n_math_timeout'].astype(int)
+    data['math_accuracy_errors'] = data['math_errors'] - data['math_speed_errors']
+
+    if 'letters' in data and 'response' in data:
+        recorded = data['letters'].notna() & data['response'].notna()
+    else:
+        recorded = pd.Series(False, index=data.index)
+    data['partial_positionwise'] = recorded
+    data['letters_correct'] = (data['span']*data['correct_raw']).astype(int)
+    if recorded.any():
+        data.loc[recorded, 'letters_correct'] = positioncorrect(data.loc[recorded, 'letters'],
+                                                                data.loc[recorded, 'response'])
+    return data
+
+# Scores per subject (and file) from a table of trials
+def scoresubjects(data, criterion=criterion):
+    data = scoretrials(data)
+    data['absolute'] = data['span']*data['correct']
+    grouped = data.groupby(['subject_id', 'file'], sort=False)
+
+    scores = grouped.agg(
+        ntrials              = ('span', 'size'),
+        nletters             = ('span', 'sum'),
+        absolute_score       = ('absolute', 'sum'),
+        partial_score        = ('letters_correct', 'sum'),
+        nsets_correct        = ('correct', 'sum'),
+        math_errors          = ('math_errors', 'sum'),
+        math_speed_errors    = ('math_speed_errors', 'sum'),
+        math_accuracy_errors = ('math_accuracy_errors', 'sum'),
+        partial_positionwise = ('partial_positionwise', 'all')
+    ).reset_index()
+    scores['math_accuracy'] = 1 - scores['math_errors']/scores['nletters'].astype(float)
+    scores['meets_criterion'] = scores['math_accuracy'] >= criterion
+    return scores
+
+'''
+================================================================================
+
+    RUN SCORING
+
+================================================================================
+'''
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score OPSPAN data files.')
+    parser.add_argument('files', nargs='*', default=['opspandata*.csv'], help='data files or glob patterns')
+    parser.add_argument('--criterion', type=float, default=criterion, help='minimum math accuracy')
+    parser.add_argument('--output', default='opspanscores.csv')
+    args = parser.parse_args()
+
+    filenames = sorted(set(f for pattern in args.files for f in glob.glob(pattern)))
+    scores = scoresubjects(readfiles(filenames), args.criterion)
+    scores.to_csv(args.output, sep='\t', encoding='utf-8', index=False)
+    print('%d subjects, %d below the math accuracy criterion' %
+          (len(scores), np.sum(~scores['meets_criterion'])))
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import argparse
+import pandas as pd
+import numpy as np
+
+'''
+================================================================================
+
+    SIMULATED OPSPAN RESPONDENTS
+
+    Generates OPSPAN sessions without a display, following the structure of
+    opspan.py: equation practice sets the equation time limit (mean + 2.5 SD
+    of the practice response times), then each span from span_low to
+    span_high is run nspaniterations times, in a shuffled order. Every set
+    shows span equation/letter pairs and ends with letter recall.
+
+    Each respondent has:
+
+    - capacity: number of letters they can hold in order. Letter j of a set
+      is recalled in place with probability logistic(2*(capacity' - j + 0.5)),
+      where capacity' is capacity reduced by timecost per second of mean
+      equation response time in the set (slower processing leaves less time
+      to rehearse).
+    - math_accuracy: probability of judging an equation correctly.
+    - rt_median, rt_logsd: lognormal equation response times (processing
+      speed). Responses slower than the time limit are timeouts, which count
+      as errors.
+
+    Whole sessions are simulated as arrays, so millions of sets take seconds,
+    and written in the format of opspan.py (opspandata<id>.csv).
+
+================================================================================
+'''
+
+span_low        = 3
+span_high       = 7
+nmathpractice   = 15
+nspaniterations = 3
+
+characterfile = 'resources/consonants.txt'
+
+paramnames = ['capacity', 'math_accuracy', 'rt_median', 'rt_logsd', 'timecost']
+
+datacolumns = ['subject_id', 'iteration', 'span', 'math_accuracy', 'n_math_timeout', 'correct_raw',
+               'mathrt_mean', 'mathrt_sd', 'mathrt_max', 'letters', 'response', 'session_seed']
+
+# Sample respondents from a plausible population
+def sampleparams(nsubjects, rng=None):
+    if rng is None:
+        rng = np.random.default_rng()
+
+    params = np.empty([nsubjects, len(paramnames)])
+    params[:, 0] = rng.normal(5.5, 1.2, nsubjects)            # capacity
+    params[:, 1] = rng.beta(20, 1.5, nsubjects)               # math_accuracy
+    params[:, 2] = rng.lognormal(np.log(2.0), 0.3, nsubjects) # rt_median (s)
+    params[:, 3] = rng.uniform(0.2, 0.5, nsubjects)           # rt_logsd
+    params[:, 4] = rng.uniform(0.1, 0.5, nsubjects)           # timecost (letters/s)
+    return params
+
+def logistic(x):
+    return 0.5*(1 + np.tanh(0.5*x))
+
+# Run respondents through the task.
+#   params are shaped (subjects x 5), in the order of paramnames. Returns a
+#   dict of arrays shaped (subjects x sets x span_high) for the equations and
+#   letters of each set (positions beyond the span are masked), and
+#   (subjects x sets) for the set-level data.
+def simulate(params, rng=None, span_low=span_low, span_high=span_high,
+             nspaniterations=nspaniterations, nmathpractice=nmathpractice, nchars=20):
+    if rng is None:
+        rng = np.random.default_rng()
+    params = np.atleast_2d(params)
+    nsubjects = params.shape[0]
+    capacity, accuracy, rtmedian, rtlogsd, timecost = [params[:, k, None, None] for k in range(5)]
+
+    # Equation time limit from the practice response times
+    practicert = rng.lognormal(np.log(params[:, 2, None]), params[:, 3, None], [nsubjects, nmathpractice])
+    equationduration = practicert.mean(axis=1) + 2.5*practicert.std(axis=1)
+
+    # Span order: each span nspaniterations times in a row, spans shuffled
+    spans = np.arange(span_low, span_high+1)
+    spanorder = spans[np.argsort(rng.random([nsubjects, len(spans)]), axis=1)]
+    span = np.repeat(spanorder, nspaniterations, axis=1)
+    iteration = np.tile(np.arange(1, nspaniterations+1), [nsubjects, len(spans)])
+    nsets = span.shape[1]
+    mask = np.arange(span_high) < span[:, :, None]
+
+    # Equations
+    mathrt = rng.lognormal(np.log(rtmedian), rtlogsd, [nsubjects, nsets, span_high])
+    timeout = (mathrt > equationduration[:, None, None]) & mask
+    mathrt = np.where(timeout, equationduration[:, None, None], mathrt) # time waited before the timeout
+    mathcorrect = (rng.random([nsubjects, nsets, span_high]) < accuracy) & ~timeout & mask
+
+    # Letters: span distinct consonants per set, recalled in place or replaced by another consonant
+    letters = np.argsort(rng.random([nsubjects, nsets, nchars]), axis=2)[:, :, :span_high]
+    rtmean = np.sum(mathrt*mask, axis=2)/span
+    effcapacity = capacity[:, :, 0] - timecost[:, :, 0]*rtmean
+    precall = logistic(2*(effcapacity[:, :, None] - np.arange(1, span_high+1) + 0.5))
+    recalled = (rng.random([nsubjects, nsets, span_high]) < precall) & mask
+    responses = np.where(recalled, letters, (letters + rng.integers(1, nchars, letters.shape)) % nchars)
+
+    rtdev = (mathrt - rtmean[:, :, None])*mask
+    return {
+        'span'            : span,
+        'iteration'       : iteration,
+        'mask'            : mask,
+        'equationduration': equationduration,
+        'mathrt'          : mathrt,
+        'mathcorrect'     : mathcorrect,
+        'timeout'         : timeout,
+        'letters'         : letters,
+        'responses'       : responses,
+        'math_accuracy'   : np.sum(mathcorrect, axis=2)/span.astype(float),
+        'n_math_timeout'  : np.sum(timeout, axis=2),
+        'correct_raw'     : np.all(recalled | ~mask, axis=2),
+        'mathrt_mean'     : rtmean,
+        'mathrt_sd'       : np.sqrt(np.sum(rtdev**2, axis=2)/span),
+        'mathrt_max'      : np.max(np.where(mask, mathrt, -np.inf), axis=2)
+    }
+
+# Space-separated letter strings from letter indices, shaped like indices[..., 0]
+def letterstrings(indices, mask, characters):
+    strings = np.where(mask[..., 0], characters[indices[..., 0]], '')
+    for j in range(1, indices.shape[-1]):
+        strings = np.where(mask[..., j], np.char.add(np.char.add(strings, ' '), characters[indices[..., j]]), strings)
+    return strings
+
+# One table of all simulated sets, with the columns opspan.py writes
+def totable(sim, subject_ids, characters):
+    nsubjects, nsets = sim['span'].shape
+    data = pd.DataFrame({
+        'subject_id'     : np.repeat(subject_ids, nsets),
+        'iteration'      : sim['iteration'].ravel().astype(float),
+        'span'           : sim['span'].ravel().astype(float),
+        'math_accuracy'  : sim['math_accuracy'].ravel(),
+        'n_math_timeout' : sim['n_math_timeout'].ravel().astype(float),
+        'correct_raw'    : sim['correct_raw'].ravel().astype(float),
+        'mathrt_mean'    : sim['mathrt_mean'].ravel(),
+        'mathrt_sd'      : sim['mathrt_sd'].ravel(),
+        'mathrt_max'     : sim['mathrt_max'].ravel(),
+        'letters'        : letterstrings(sim['letters'], sim['mask'], characters).ravel(),
+        'response'       : letterstrings(sim['responses'], sim['mask'], characters).ravel(),
+        'session_seed'   : -1 # simulated sessions do not come from a session plan
+    })
+    return data[datacolumns]
+
+# Write one opspandata<id>.csv per simulated subject, in the task's format
+def writecsv(data, outdir='.'):
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    for subject_id, subjectdata in data.groupby('subject_id', sort=False):
+        subjectdata.reset_index(drop=True).to_csv(os.path.join(outdir, 'opspandata' + subject_id + '.csv'),
+                                                  sep='\t', encoding='utf-8')
+
+'''
+================================================================================
+
+    RUN SIMULATION
+
+================================================================================
+'''
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate synthetic respondents on the OPSPAN task.')
+    parser.add_argument('--nsubjects', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--chunksize', type=int, default=10000, help='subjects simulated at a time')
+    parser.add_argument('--outdir', default='simulated')
+    parser.add_argument('--nowrite', action='store_true', help='only time the simulation')
+    args = parser.parse_args()
+
+    characters = np.loadtxt(characterfile, delimiter='\t', dtype=str)
+    seeds  = np.random.SeedSequence(args.seed).spawn(2)
+    params = sampleparams(args.nsubjects, np.random.default_rng(seeds[0]))
+    subject_ids = np.array(['sim%06d' % i for i in range(args.nsubjects)])
+
+    starttime = time.time()
+    nsets = 0
+    for start, seed in zip(range(0, args.nsubjects, args.chunksize),
+                           seeds[1].spawn((args.nsubjects + args.chunksize - 1)//args.chunksize)):
+        chunk = slice(start, start+args.chunksize)
+        sim = simulate(params[chunk], np.random.default_rng(seed), nchars=len(characters))
+        nsets += sim['span'].size
+        if not args.nowrite:
+            writecsv(totable(sim, subject_ids[chunk], characters), args.outdir)
+    print('%d sets (%d equations) in %.2f s' %
+          (nsets, nsets*np.mean(np.arange(span_low, span_high+1)), time.time() - starttime))
+
+    if not args.nowrite:
+        pd.DataFrame(params, columns=paramnames).assign(subject_id=subject_ids)[['subject_id'] + paramnames].to_csv(
+            os.path.join(args.outdir, 'params.csv'), sep='\t', encoding='utf-8', index=False)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import numpy as np
+
+import equationbank
+
+'''
+================================================================================
+
+    OPSPAN SESSION PLAN
+
+    Builds everything a session will show from a single seed, before the
+    first screen: the letters of the character practice, the equations of
+    the math practice, the letters and equations of the full practice, and
+    the span order, letters and equations of the task. The run loop in
+    opspan.py only looks items up, and the plan is saved next to the data
+    (opspanplan<id>.npz) so the session can be reproduced exactly.
+
+    Equations are drawn without replacement across the whole session,
+    balancing true and false equations (equationbank.EquationSampler). The
+    math practice runs until nmathpractice answers are correct, so it gets a
+    longer list of equations, which is reused from the start if it runs out.
+
+    Letter arrays are padded with '' and equation arrays with -1 beyond each
+    set's span.
+
+================================================================================
+'''
+
+characterfile = 'resources/consonants.txt'
+
+# Build the plan of a session. Returns a dict of arrays.
+def compileplan(seed, equationfile=equationbank.equationfile, characterfile=characterfile,
+                span_low=3, span_high=7, nspaniterations=3, nmathpractice=15, nmathpracticemax=None,
+                nfullpractice=3, fullpracticespan=2):
+    rng = np.random.default_rng(seed)
+    characters = np.loadtxt(characterfile, delimiter='\t', dtype=str)
+    bank = equationbank.loadbank(equationfile)
+    sampler = equationbank.EquationSampler(bank, rng)
+    if nmathpracticemax is None:
+        nmathpracticemax = 4*nmathpractice
+
+    # Letters: distinct characters within each set, in order of presentation
+    def letters(spans, width):
+        order = np.argsort(rng.random([len(spans), len(characters)]), axis=1)[:, :width]
+        return np.where(np.arange(width) < spans[:, None], characters[order], '')
+
+    def equations(spans, width):
+        ids = np.full([len(spans), width], -1)
+        mask = np.arange(width) < spans[:, None]
+        ids[mask] = [sampler.draw() for _ in range(np.sum(mask))]
+        return ids
+
+    spans = np.arange(span_low, span_high+1)
+    characterpractice_span = spans
+    characterpractice_letters = letters(spans, span_high)
+
+    mathpractice_equation = equations(np.array([nmathpracticemax]), nmathpracticemax)[0]
+
+    fullpractice_span = np.full(nfullpractice, fullpracticespan)
+    fullpractice_letters = letters(fullpractice_span, fullpracticespan)
+    fullpractice_equation = equations(fullpractice_span, fullpracticespan)
+
+    # Task: each span nspaniterations times in a row, spans shuffled
+    task_span = np.repeat(rng.permutation(spans), nspaniterations)
+    task_iteration = np.tile(np.arange(1, nspaniterations+1), len(spans))
+    task_letters = letters(task_span, span_high)
+    task_equation = equations(task_span, span_high)
+
+    return {
+        'seed'                     : seed,
+        'equationfile'             : equationfile,
+        'characterpractice_span'   : characterpractice_span,
+        'characterpractice_letters': characterpractice_letters,
+        'mathpractice_equation'    : mathpractice_equation,
+        'fullpractice_letters'     : fullpractice_letters,
+        'fullpractice_equation'    : fullpractice_equation,
+        'task_span'                : task_span,
+        'task_iteration'           : task_iteration,
+        'task_letters'             : task_letters,
+        'task_equation'            : task_equation,
+        'equation_text'            : bank['text'],    # by equation ID
+        'equation_answer'          : np.where(bank['truth'], 'y', 'n')
+    }
+
+# Display string and correct answer ('y' or 'n') of a planned equation
+def equation(plan, equationid):
+    return plan['equation_text'][equationid], plan['equation_answer'][equationid]
+
+def saveplan(plan, filename):
+    with open(filename, 'wb') as f:
+        np.savez(f, **plan)
+
+def loadplan(filename):
+    with np.load(filename) as saved:
+        return dict((key, saved[key][()] if saved[key].ndim == 0 else saved[key]) for key in saved.files)
+
+'''
+================================================================================
+
+    SHOW A PLAN
+
+================================================================================
+'''
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build (or show) the plan of an OPSPAN session.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--load', default=None, help='saved plan to show instead')
+    args = parser.parse_args()
+
+    plan = loadplan(args.load) if args.load else compileplan(args.seed)
+    print('Seed %d, equations from %s' % (plan['seed'], plan['equationfile']))
+    for span, iteration, letters, ids in zip(plan['task_span'], plan['task_iteration'],
+                                             plan['task_letters'], plan['task_equation']):
+        print('span %d (%d): %s' % (span, iteration, ' '.join(letters[:span])))
+        for equationid in ids[:span]:
+            print('    %-24s %s' % equation(plan, equationid))
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import numpy as np
+import pandas as pd
+from PIL import Image
+from pyglet import gl as GL
+from psychopy import visual
+
+'''
+================================================================================
+
+    BATCHED DRAWING OF THE TWO-STEP OPTIONS
+
+    Draws every option on a screen with three element-array draws: the box
+    outlines (four edges per box, around the fill rather than under it, so
+    a faded box blends over the background as a Rect does), the box fills,
+    and the symbols. The symbols come from one
+    shared texture (an atlas with one cell per symbol), rendered once from
+    the task's own TextStims. Each element picks its cell through its
+    spatial frequency and phase. The current path, by comparison, draws a
+    Rect and a TextStim per option: six draws for a step 2 screen with the
+    selected step 1 option, and twelve for the structure screens.
+
+    The six options have one element each, always in the same order. A
+    screen sets the position and opacity of the options it shows and hides
+    the others (opacity 0).
+
+    Whether the atlas is sampled the right way round depends on the
+    PsychoPy version, so the batch renders a test screen both ways, at full
+    and half opacity, and compares it with the current path before it is
+    used (verify).
+
+    bakeoptions instead renders each option (box, colour and symbol) once
+    into an ImageStim, so moving or fading an option is one textured quad
+    rather than a Rect and a TextStim.
+
+================================================================================
+'''
+
+# Options in element order: (step, state, option)
+optionkeys = [(0, 0, 0), (0, 0, 1), (1, 0, 0), (1, 0, 1), (1, 1, 0), (1, 1, 1)]
+
+# Test screen for verify: the six options on a 3 x 2 grid (pix)
+def checkpositions(width, height):
+    return [[x*width, y*height] for y in (0.2, -0.2) for x in (-0.3, 0, 0.3)]
+
+# GL entry points counted as draw calls
+gldrawcalls = ['glBegin', 'glCallList', 'glCallLists', 'glDrawArrays', 'glDrawElements']
+
+def nextpowerof2(n):
+    return 2**int(np.ceil(np.log2(max(n, 1))))
+
+# Back buffer as an array, cropped to size x size around pos (pix, origin at the centre)
+def capture(win, size=None, pos=(0, 0)):
+    frame = np.asarray(win.getMovieFrame(buffer='back'), dtype=float)[:, :, :3]
+    win.movieFrames.pop()
+    if size is None:
+        return frame
+    height, width = frame.shape[:2]
+    top  = int(round(height/2. - pos[1] - size/2.))
+    left = int(round(width/2. + pos[0] - size/2.))
+    return frame[top:top+int(size), left:left+int(size)]
+
+# Atlas of the symbols of texts, one cell per symbol in a single row, as an RGBA image
+def glyphatlas(win, texts, size):
+    cell = nextpowerof2(size)
+    nslots = nextpowerof2(len(texts))
+    atlas = np.zeros([cell, cell*nslots, 4], dtype=np.uint8)
+
+    win.clearBuffer()
+    background = capture(win, size).max(axis=2)
+    for k, text in enumerate(texts):
+        color, pos, opacity = text.color, text.pos, text.opacity
+        text.color, text.pos, text.opacity = [1, 1, 1], [0, 0], 1
+        text.draw()
+        coverage = (capture(win, size).max(axis=2) - background)/np.maximum(255. - background, 1)
+        win.clearBuffer()
+        text.color, text.pos, text.opacity = color, pos, opacity
+
+        alpha = Image.fromarray(np.uint8(255*np.clip(coverage, 0, 1))).resize([cell, cell], Image.BILINEAR)
+        atlas[:, k*cell:(k+1)*cell, 3] = np.asarray(alpha)
+        atlas[:, k*cell:(k+1)*cell, :3] = np.uint8(255*(np.asarray(color[:3], dtype=float) + 1)/2)
+    return Image.fromarray(atlas, 'RGBA'), nslots
+
+# One ImageStim per option ([step][state][option], as stim), rendered from its Rect and TextStim
+def bakeoptions(win, stim, stimtext, size, linewidth=1.5):
+    crop = int(np.ceil(size + 2*linewidth))
+    images = {}
+    win.clearBuffer()
+    for s, t, o in optionkeys:
+        pos, opacity = stim[s][t][o].pos, stim[s][t][o].opacity
+        for stimulus in (stim[s][t][o], stimtext[s][t][o]):
+            stimulus.pos, stimulus.opacity = [0, 0], 1
+            stimulus.draw()
+        image = Image.fromarray(np.uint8(capture(win, crop)))
+        win.clearBuffer()
+        for stimulus in (stim[s][t][o], stimtext[s][t][o]):
+            stimulus.pos, stimulus.opacity = pos, opacity
+
+        images.setdefault(s, {}).setdefault(t, {})[o] = visual.ImageStim(win, image=image, units='pix',
+                                                                         size=[crop, crop], pos=pos)
+    return images
+
+# Number of GL draw calls (gldrawcalls) made while draw() runs
+def countdrawcalls(draw):
+    count = [0]
+    originals = dict((name, getattr(GL, name)) for name in gldrawcalls if hasattr(GL, name))
+
+    def counted(func):
+        def call(*args):
+            count[0] += 1
+            return func(*args)
+        return call
+
+    for name, func in originals.items():
+        setattr(GL, name, counted(func))
+    try:
+        draw()
+    finally:
+        for name, func in originals.items():
+            setattr(GL, name, func)
+    return count[0]
+
+class OptionBatch(object):
+    def __init__(self, win, stim, stimtext, size, linewidth=1.5):
+        self.win = win
+        self.size = size
+        self.index = dict((key, i) for i, key in enumerate(optionkeys))
+        n = len(optionkeys)
+        self.xys = np.zeros([n, 2])
+        self.opacities = np.zeros(n)
+        self.edgexys = np.zeros([4*n, 2])
+        self.edgeopacities = np.zeros(4*n)
+        self.verified = False
+        self.error = {}   # verify's difference from the current path, per phase direction
+
+        fills = [stim[s][t][o].fillColor for s, t, o in optionkeys]
+        atlas, self.nslots = glyphatlas(win, [stimtext[s][t][o] for s, t, o in optionkeys], size)
+
+        # Top, bottom, left and right edge of each box, centred on the edge of the Rect
+        half = size/2.
+        self.edgeoffsets = np.array([[0, half], [0, -half], [-half, 0], [half, 0]])
+        edgesizes = [[size + linewidth, linewidth]]*2 + [[linewidth, size - linewidth]]*2
+        self.outlines = visual.ElementArrayStim(win, units='pix', nElements=4*n, sizes=edgesizes*n,
+                                                elementTex=None, elementMask=None, colors=[-1, -1, -1],
+                                                xys=self.edgexys, opacities=self.edgeopacities)
+        self.fills    = visual.ElementArrayStim(win, units='pix', nElements=n, sizes=size - linewidth,
+                                                elementTex=None, elementMask=None, colors=fills,
+                                                xys=self.xys, opacities=self.opacities)
+        self.symbols  = visual.ElementArrayStim(win, units='pix', nElements=n, sizes=size,
+                                                elementTex=atlas, elementMask=None, colors=[1, 1, 1],
+                                                sfs=[[1./self.nslots, 1]]*n, phases=self.cellphases(1),
+                                                xys=self.xys, opacities=self.opacities)
+
+    # Texture phases that put cell k of the atlas on element k. direction is
+    # the sign PsychoPy applies to phases when mapping textures (see verify).
+    def cellphases(self, direction):
+        k = np.arange(len(optionkeys))
+        return np.stack([direction*(0.5 - (2*k + 1)/(2.*self.nslots)), np.zeros(len(k))], axis=1)
+
+    def hide(self):
+        self.opacities[:] = 0
+
+    def place(self, key, pos, opacity=1):
+        i = self.index[key]
+        self.xys[i] = pos
+        self.opacities[i] = opacity
+
+    def pos(self, key):
+        return self.xys[self.index[key]].copy()
+
+    def draw(self):
+        n = len(optionkeys)
+        np.add(self.xys[:, None, :], self.edgeoffsets, out=self.edgexys.reshape(n, 4, 2))
+        self.edgeopacities.reshape(n, 4)[:] = self.opacities[:, None]
+        self.outlines.xys = self.edgexys
+        self.outlines.opacities = self.edgeopacities
+        self.outlines.draw()
+        for elements in (self.fills, self.symbols):
+            elements.xys = self.xys
+            elements.opacities = self.opacities
+            elements.draw()
+
+    # Whether the batch draws options as stim/stimtext do, at each of
+    # opacities; tries both phase directions and keeps the one that matches.
+    # tolerance is a mean absolute difference in 8-bit levels over the option
+    # boxes, and error holds the largest one over opacities per direction.
+    def verify(self, stim, stimtext, positions, tolerance=12., opacities=(1, 0.5)):
+        win = self.win
+        reference = {}
+        win.clearBuffer()
+        for opacity in opacities:
+            for (s, t, o), pos in zip(optionkeys, positions):
+                for stimulus in (stim[s][t][o], stimtext[s][t][o]):
+                    stimulus.pos, stimulus.opacity = pos, opacity
+                    stimulus.draw()
+            reference[opacity] = [capture(win, self.size, pos) for pos in positions]
+            win.clearBuffer()
+        for s, t, o in optionkeys:
+            stim[s][t][o].opacity, stimtext[s][t][o].opacity = 1, 1
+
+        for direction in (1, -1):
+            self.symbols.phases = self.cellphases(direction)
+            errors = []
+            for opacity in opacities:
+                self.hide()
+                for key, pos in zip(optionkeys, positions):
+                    self.place(key, pos, opacity)
+                self.draw()
+                batch = [capture(win, self.size, pos) for pos in positions]
+                win.clearBuffer()
+                errors.append(np.mean([np.mean(np.abs(a - b)) for a, b in zip(reference[opacity], batch)]))
+            self.error[direction] = max(errors)
+            if self.error[direction] < tolerance:
+                self.verified = True
+                break
+        self.hide()
+        return self.verified
+
+# Draw time per frame of the current path and the batch, for the same step 2
+# screen (two options and the selected step 1 option), with the number of GL
+# draw calls and the result of verify. The GL pipeline is finished before and
+# at the end of each timed frame, so the times include the GPU's work.
+def comparedrawtime(win, stim, stimtext, batch, positions, nframes=300):
+    keys = [(0, 0, 0), (1, 0, 0), (1, 0, 1)]
+    opacities = [0.5, 1, 1]
+
+    def drawcurrent():
+        for (s, t, o), pos, opacity in zip(keys, positions, opacities):
+            stim[s][t][o].pos, stim[s][t][o].opacity = pos, opacity
+            stimtext[s][t][o].pos, stimtext[s][t][o].opacity = pos, opacity
+            stim[s][t][o].draw()
+            stimtext[s][t][o].draw()
+
+    def drawbatch():
+        batch.hide()
+        for key, pos, opacity in zip(keys, positions, opacities):
+            batch.place(key, pos, opacity)
+        batch.draw()
+
+    paths = [('current', drawcurrent), ('batch', drawbatch)]
+    times = dict((path, np.zeros(nframes)) for path, draw in paths)
+    drawcalls = {}
+    for path, draw in paths:
+        drawcalls[path] = countdrawcalls(draw)
+        win.clearBuffer()
+    for frame in range(nframes):
+        for path, draw in paths:
+            GL.glFinish()
+            start = time.perf_counter()
+            draw()
+            GL.glFinish()
+            times[path][frame] = time.perf_counter() - start
+            win.clearBuffer()
+    batch.hide()
+
+    return pd.DataFrame({
+        'path'       : ['current', 'batch'],
+        'draw_calls' : [drawcalls['current'], drawcalls['batch']],
+        'nframes'    : nframes,
+        'mean_ms'    : [1e3*np.mean(times[p]) for p in ('current', 'batch')],
+        'p50_ms'     : [1e3*np.percentile(times[p], 50) for p in ('current', 'batch')],
+        'p99_ms'     : [1e3*np.percentile(times[p], 99) for p in ('current', 'batch')],
+        'verified'   : [True, batch.verified],
+        'check_error': [0, min(batch.error.values()) if batch.error else np.nan]
+    }, columns=['path', 'draw_calls', 'nframes', 'mean_ms', 'p50_ms', 'p99_ms', 'verified', 'check_error'])
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import argparse
+import numpy as np
+from scipy.optimize import minimize
+
+import twostepsim
+import twostepfit
+
+'''
+================================================================================
+
+    BENCHMARK: ANALYTIC GRADIENT VS. FINITE DIFFERENCES
+
+    Simulates sessions, then fits each from the same starting point with
+    L-BFGS-B twice: once with the analytic gradient (loglikgrad) and once with
+    finite differences (loglik only). Reports likelihood calls to convergence,
+    wall time, and the difference in the final negative log-likelihood.
+
+================================================================================
+'''
+
+# Wrap a function so that its calls are counted
+class CallCounter(object):
+    def __init__(self, fun):
+        self.fun = fun
+        self.ncalls = 0
+
+    def __call__(self, *args):
+        self.ncalls += 1
+        return self.fun(*args)
+
+# Fit one session from x0 and return (calls, seconds, final nll)
+def timefit(fun, jac, x0, data):
+    counter = CallCounter(fun)
+    starttime = time.perf_counter()
+    res = minimize(counter, x0, args=data, method='L-BFGS-B', jac=jac, bounds=twostepfit.bounds)
+    return counter.ncalls, time.perf_counter() - starttime, res.fun
+
+# Run the benchmark on nsessions simulated sessions
+def benchmark(nsessions=20, ntrials=twostepsim.ntrials, seed=0):
+    rng    = np.random.default_rng(seed)
+    params = twostepsim.sampleparams(nsessions, rng)
+    sim    = twostepsim.simulate(params, ntrials, rng)
+    lower, upper = np.array(twostepfit.initbounds).T
+
+    results = np.empty([nsessions, 2, 3]) # [session, (gradient, finite differences), (calls, seconds, nll)]
+    for i in range(nsessions):
+        choices = np.column_stack([sim['choice1'][i], sim['choice2'][i]]).astype(int)
+        data = (choices, sim['step2state'][i].astype(int), sim['reward'][i].astype(float))
+        x0 = rng.uniform(lower, upper)
+
+        results[i, 0] = timefit(twostepfit.negloglikgrad, True, x0, data)
+        results[i, 1] = timefit(twostepfit.negloglik, None, x0, data)
+
+    return results
+
+# Print a summary of the benchmark results
+def report(results):
+    print('%-20s %12s %12s %12s %12s' % ('', 'calls (med)', 'calls (sum)', 'time (med)', 'time (sum)'))
+    for k, label in enumerate(['analytic gradient', 'finite differences']):
+        calls, seconds = results[:, k, 0], results[:, k, 1]
+        print('%-20s %12d %12d %11.3fs %11.2fs' % (label, np.median(calls), np.sum(calls),
+                                                   np.median(seconds), np.sum(seconds)))
+    print('Speed-up in total wall time: %.1fx' % (np.sum(results[:, 1, 1])/np.sum(results[:, 0, 1])))
+    dnll = results[:, 0, 2] - results[:, 1, 2]
+    print('Final nll, gradient minus finite differences: median %.2g' % np.median(dnll))
+    print('Sessions that ended at different optima (|difference| > 0.01): %d of %d' %
+          (np.sum(np.abs(dnll) > 0.01), len(dnll)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare gradient and gradient-free fits of the two-step model.')
+    parser.add_argument('--nsessions', type=int, default=20)
+    parser.add_argument('--ntrials', type=int, default=twostepsim.ntrials)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    report(benchmark(args.nsessions, args.ntrials, args.seed))
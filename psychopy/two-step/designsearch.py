@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import itertools
+import pandas as pd
+import numpy as np
+from multiprocessing import Pool
+
+import twostepsim
+import twostepfit
+
+'''
+================================================================================
+
+    TASK-DESIGN SEARCH
+
+    Scores candidate designs of the two-step task (ntrials, lbound, ubound,
+    sdrewardpath and the common transition probability) by how well they
+    identify the model parameters. For each design, sessions are simulated at
+    a set of reference parameters and the expected Fisher information is
+    estimated as the mean outer product of the exact score (loglikgrad) over
+    sessions. The Cramer-Rao bound then gives the smallest achievable
+    standard error of each target parameter, which is converted to
+    information per minute of session time.
+
+    Designs with the same reward and transition dynamics are simulated once,
+    at the longest ntrials among them, and shorter designs reuse the first
+    trials of those sessions. Every group uses the same seed (common random
+    numbers), so differences between designs are not swamped by simulation
+    noise.
+
+================================================================================
+'''
+
+# Expected duration of a trial in twostep.py, in seconds: ISI (mean of the
+# exponential), two animations of 0.4 s plus 0.1 s pauses, 1 s outcome, and
+# two choices at an assumed mean response time of 0.8 s
+meanrt = 0.8
+trialduration = 1.0 + 2*(0.4 + 0.1) + 1.0 + 2*meanrt
+
+designkeys = ['ntrials', 'lbound', 'ubound', 'sdrewardpath', 'pcommon']
+dynamicskeys = ['lbound', 'ubound', 'sdrewardpath', 'pcommon']
+
+# All combinations of the candidate values of each design setting
+def designgrid(ntrials=(twostepsim.ntrials,), lbound=(twostepsim.lbound,), ubound=(twostepsim.ubound,),
+               sdrewardpath=(twostepsim.sdrewardpath,), pcommon=(0.7,)):
+    designs = pd.DataFrame(list(itertools.product(ntrials, lbound, ubound, sdrewardpath, pcommon)),
+                           columns=designkeys)
+    return designs[designs['lbound'] < designs['ubound']].reset_index(drop=True)
+
+# Expected Fisher information of each design in a group that shares its dynamics
+#   (run inside a worker process). Returns an array shaped
+#   (designs x reference parameters x 6 x 6).
+def groupinformation(job):
+    dynamics, ntrialslist, refparams, nsims, seed = job
+    ptrans = np.array([1 - dynamics['pcommon'], dynamics['pcommon']])
+    params = np.repeat(refparams, nsims, axis=0)
+
+    sim = twostepsim.simulate(params, max(ntrialslist), np.random.default_rng(seed),
+                              lbound=dynamics['lbound'], ubound=dynamics['ubound'],
+                              sd=dynamics['sdrewardpath'], ptrans=ptrans)
+    choices = np.stack([sim['choice1'], sim['choice2']], axis=2).astype(int)
+    states  = sim['step2state'].astype(int)
+    rewards = sim['reward'].astype(float)
+
+    info = np.empty([len(ntrialslist), len(refparams), params.shape[1], params.shape[1]])
+    for k, ntrials in enumerate(ntrialslist):
+        ll, grad = twostepfit.loglikgrad(params, choices[:, :ntrials], states[:, :ntrials],
+                                         rewards[:, :ntrials], ptrans)
+        grad = grad.reshape(len(refparams), nsims, -1)
+        info[k] = np.einsum('jni,jnk->jik', grad, grad)/nsims
+    return info
+
+# Score every design. targets are the parameters whose identifiability counts.
+#   Returns the designs with, for each target, the median Cramer-Rao standard
+#   error and information per minute over the reference parameters, plus
+#   their geometric mean across targets as the overall score.
+def scoredesigns(designs, targets=('w', 'beta1'), nrefs=50, nsims=20, seed=0, nworkers=None):
+    designs = designs.reset_index(drop=True)
+    paramseed, simseed = twostepsim.seedsequence(seed).spawn(2)
+    refparams = twostepsim.sampleparams(nrefs, np.random.default_rng(paramseed))
+
+    groups = list(designs.groupby(dynamicskeys, sort=False))
+    jobs = [(dict(zip(dynamicskeys, key)), sorted(set(group['ntrials'])), refparams, nsims, simseed)
+            for key, group in groups]
+
+    if nworkers == 1 or len(jobs) == 1:
+        infos = [groupinformation(job) for job in jobs]
+    else:
+        pool = Pool(nworkers)
+        try:
+            infos = pool.map(groupinformation, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    targetindex = [twostepsim.paramnames.index(name) for name in targets]
+    scores = designs.copy()
+    for (key, group), job, info in zip(groups, jobs, infos):
+        for i in group.index:
+            k = job[1].index(designs.loc[i, 'ntrials'])
+            bound = np.array([np.diag(np.linalg.pinv(infoj)) for infoj in info[k]])
+            minutes = designs.loc[i, 'ntrials']*trialduration/60
+            for name, j in zip(targets, targetindex):
+                scores.loc[i, 'se_' + name] = np.median(np.sqrt(bound[:, j]))
+                scores.loc[i, 'info_per_min_' + name] = np.median(1/(bound[:, j]*minutes))
+            scores.loc[i, 'minutes'] = minutes
+
+    scores['score'] = np.exp(np.mean(np.log(scores[['info_per_min_' + name for name in targets]]), axis=1))
+    return scores.sort_values('score', ascending=False).reset_index(drop=True)
+
+'''
+================================================================================
+
+    RUN SEARCH
+
+================================================================================
+'''
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score two-step task designs by parameter identifiability.')
+    parser.add_argument('--ntrials', type=int, nargs='+', default=[101, 151, 201, 251, 301])
+    parser.add_argument('--lbound', type=float, nargs='+', default=[0.2, 0.25])
+    parser.add_argument('--ubound', type=float, nargs='+', default=[0.75, 0.8])
+    parser.add_argument('--sdrewardpath', type=float, nargs='+', default=[0.015, 0.025, 0.035])
+    parser.add_argument('--pcommon', type=float, nargs='+', default=[0.6, 0.7, 0.8])
+    parser.add_argument('--targets', nargs='+', default=['w', 'beta1'])
+    parser.add_argument('--nrefs', type=int, default=50)
+    parser.add_argument('--nsims', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--nworkers', type=int, default=None)
+    parser.add_argument('--output', default='designs.csv')
+    args = parser.parse_args()
+
+    designs = designgrid(args.ntrials, args.lbound, args.ubound, args.sdrewardpath, args.pcommon)
+    scores = scoredesigns(designs, args.targets, args.nrefs, args.nsims, args.seed, args.nworkers)
+    print(scores.head(10).to_string(index=False, float_format='%.4g'))
+    scores.to_csv(args.output, sep='\t', encoding='utf-8', index=False)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import argparse
+import numpy as np
+
+import twostepsim
+import twostepfit
+
+'''
+================================================================================
+
+    ONLINE ESTIMATION OF THE MODEL-BASED WEIGHT
+
+    Keeps a grid posterior over the hybrid model's parameters during a
+    session and updates it after every trial. Each grid point carries its
+    own Q-values, so an update is one step of the likelihood recursion
+    (twostepfit.trialloglik) over the grid: constant time per trial,
+    whatever the session length. The posterior of w is the grid posterior
+    marginalized over the other parameters, and a session can stop once its
+    credible interval is narrow enough.
+
+================================================================================
+'''
+
+# Default grid: every value of w against a coarse grid of the other parameters
+gridaxes = [np.linspace(0.1, 0.9, 5),        # alpha
+            np.array([1., 2.5, 4., 6., 9.]), # beta1
+            np.array([1., 3., 6.]),          # beta2
+            np.array([0., 0.5, 1.]),         # lambda
+            np.linspace(0, 1, 21),           # w
+            np.array([-0.2, 0.1, 0.4])]      # perseveration
+
+class OnlineEstimator(object):
+    def __init__(self, axes=gridaxes, ptrans=twostepsim.ptrans):
+        self.axes = [np.atleast_1d(axis) for axis in axes]
+        shape = [len(axis) for axis in self.axes]
+        self.params = twostepfit.gridpoints(self.axes, 0, int(np.prod(shape)))
+        self.ptrans = ptrans
+
+        self.windex = twostepsim.paramnames.index('w')
+        self.wvalues = self.axes[self.windex]
+        self.wpoint = np.unravel_index(np.arange(self.params.shape[0]), shape)[self.windex]
+
+        self.q1 = np.zeros([self.params.shape[0], 2])
+        self.q2 = np.zeros([self.params.shape[0], 2, 2])
+        self.prev = 0.0
+        self.logpost = np.zeros(self.params.shape[0]) # flat prior over the grid
+        self.ntrials = 0
+
+    # Add one completed trial
+    def update(self, choice1, state, choice2, reward):
+        self.logpost += twostepfit.trialloglik(self.params, self.q1, self.q2, self.prev,
+                                               int(choice1), int(choice2), int(state), reward,
+                                               ptrans=self.ptrans)
+        self.logpost -= self.logpost.max() # keep the log posterior in range
+        self.prev = 2.0*choice1 - 1
+        self.ntrials += 1
+
+    # Posterior probability of each value of w
+    def wposterior(self):
+        post = np.exp(self.logpost)
+        return np.bincount(self.wpoint, weights=post, minlength=len(self.wvalues))/post.sum()
+
+    def wmean(self):
+        return np.dot(self.wposterior(), self.wvalues)
+
+    # Central credible interval of w, interpolated on the grid of w values
+    def credibleinterval(self, mass=0.95):
+        cdf = np.cumsum(self.wposterior())
+        tail = (1 - mass)/2
+        return (np.interp(tail, cdf, self.wvalues, left=self.wvalues[0]),
+                np.interp(1 - tail, cdf, self.wvalues, left=self.wvalues[0]))
+
+    def ciwidth(self, mass=0.95):
+        low, high = self.credibleinterval(mass)
+        return high - low
+
+    # Whether the session can stop: at least nminimum trials and a narrow enough interval
+    def done(self, widthtarget, nminimum=0, mass=0.95):
+        return self.ntrials >= nminimum and self.ciwidth(mass) <= widthtarget
+
+'''
+================================================================================
+
+    SIMULATED CHECK OF ADAPTIVE STOPPING
+
+================================================================================
+'''
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate adaptive stopping on the w credible interval.')
+    parser.add_argument('--nsessions', type=int, default=20)
+    parser.add_argument('--widthtarget', type=float, default=0.4)
+    parser.add_argument('--nminimum', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng    = np.random.default_rng(args.seed)
+    params = twostepsim.sampleparams(args.nsessions, rng)
+    sim    = twostepsim.simulate(params, twostepsim.ntrials, rng)
+
+    nstop, covered, updatetime = [], [], []
+    for i in range(args.nsessions):
+        estimator = OnlineEstimator()
+        for t in range(twostepsim.ntrials):
+            starttime = time.perf_counter()
+            estimator.update(sim['choice1'][i, t], sim['step2state'][i, t], sim['choice2'][i, t], sim['reward'][i, t])
+            stop = estimator.done(args.widthtarget, args.nminimum)
+            updatetime.append(time.perf_counter() - starttime)
+            if stop:
+                break
+        low, high = estimator.credibleinterval()
+        nstop.append(estimator.ntrials)
+        covered.append(low <= params[i, 4] <= high)
+
+    print('Trials per session: mean %.1f (of %d), %d of %d sessions stopped early' %
+          (np.mean(nstop), twostepsim.ntrials, np.sum(np.array(nstop) < twostepsim.ntrials), args.nsessions))
+    print('95%% interval coverage of the true w: %.2f' % np.mean(covered))
+    print('Update time per trial: median %.2f ms, max %.2f ms' %
+          (1e3*np.median(updatetime), 1e3*np.max(updatetime)))
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import argparse
+import pandas as pd
+import numpy as np
+
+import twostepsim
+import twostepfit
+import rewardbank
+import sessionrandom
+
+'''
+================================================================================
+
+    POSTERIOR PREDICTIVE CHECKS
+
+    Simulates replicate sessions from fitted parameters (any number of draws
+    per subject) against each subject's own reward path, and compares them
+    with the observed data on:
+
+    - stay probabilities by previous reward x transition type
+    - the reward rate on each trial
+
+    Replicates are simulated in vectorized chunks and reduced to summary
+    statistics as they go, so memory does not grow with the number of
+    replicates.
+
+================================================================================
+'''
+
+staylabels = ['rewarded_common', 'rewarded_rare', 'unrewarded_common', 'unrewarded_rare']
+
+# Stay probabilities by previous reward x transition type, shaped (sessions x 4).
+#   A transition is common when the step 2 state matches the step 1 choice.
+def stayprobabilities(choice1, states, rewards):
+    choice1, states, rewards = np.atleast_2d(choice1, states, rewards)
+    stay   = choice1[:, 1:] == choice1[:, :-1]
+    common = states[:, :-1] == choice1[:, :-1]
+    reward = rewards[:, :-1] == 1
+
+    probs = np.empty([choice1.shape[0], 4])
+    for k, (r, c) in enumerate([(True, True), (True, False), (False, True), (False, False)]):
+        cell = (reward == r) & (common == c)
+        with np.errstate(invalid='ignore'):
+            probs[:, k] = np.sum(stay & cell, axis=1)/np.sum(cell, axis=1).astype(float)
+    return probs
+
+# Reward probabilities the subject actually faced, from the bank (path_id) or
+# the session seed; None if the data file records neither
+def sessionpaths(filename, ntrials, bankfile=rewardbank.bankfile):
+    data = pd.read_csv(filename, sep='\t', encoding='utf-8', dtype={'subject_id': str})
+    if 'path_id' in data and data['path_id'].iloc[0] >= 0:
+        if not os.path.exists(bankfile):
+            raise IOError('%s used reward path %d, but the bank %s does not exist' %
+                          (filename, data['path_id'].iloc[0], bankfile))
+        return rewardbank.getpath(rewardbank.loadbank(bankfile), int(data['path_id'].iloc[0]), ntrials)
+    if 'session_seed' in data and data['session_seed'].iloc[0] >= 0:
+        return sessionrandom.rewardpaths(int(data['session_seed'].iloc[0]), ntrials,
+                                         twostepsim.lbound, twostepsim.ubound, twostepsim.sdrewardpath)
+    return None
+
+# Parameter rows for replicates start to stop of a group of subjects, where
+# replicate k of subject i is draw k//nreplicates. offsets are the cumulative
+# replicate counts of the group.
+def replicaterows(draws, group, offsets, nreplicates, start, stop):
+    replicate = np.arange(start, stop)
+    position = np.searchsorted(offsets, replicate, side='right') - 1
+    params = [np.atleast_2d(draws[group[j]])[(replicate[position == j] - offsets[j])//nreplicates]
+              for j in np.unique(position)]
+    return position, np.concatenate(params)
+
+# Quantile q of histograms over [0, 1] (last axis), at the centre of the bin
+# that holds it; NaN where a histogram is empty
+def histogramquantile(histogram, counts, q):
+    nbins = histogram.shape[-1]
+    with np.errstate(invalid='ignore'):
+        cumulative = np.cumsum(histogram, axis=-1)/counts[..., None]
+    return np.where(counts > 0, (np.sum(cumulative < q, axis=-1) + 0.5)/nbins, np.nan)
+
+# Simulate nreplicates sessions per draw for every subject and reduce them.
+#   draws is a list with one (draws x 6) array per subject, paths a list of
+#   each subject's reward path (ntrials+1 x 4; None for a fresh path), and
+#   ntrials the session length (one per subject, or one for all). Replicates
+#   are generated chunksize at a time and only running sums are kept: the
+#   stay probabilities go into a histogram of nbins bins per subject and
+#   condition, so the credible interval is accurate to 1/nbins.
+#   Returns a dict of (subjects x 4) arrays with the mean stay probabilities,
+#   the 95% interval and, if the observed stay probabilities are given, the
+#   posterior predictive p (the fraction of replicates >= observed), and
+#   lists with the mean and SD of the reward on each trial of each subject.
+def ppc(draws, paths, ntrials, nreplicates=1, seed=0, chunksize=5000, observed=None, nbins=1000):
+    rng = np.random.default_rng(seed)
+    nsubjects = len(draws)
+    ntrials = np.broadcast_to(ntrials, (nsubjects,))
+
+    staycount = np.zeros([nsubjects, 4])
+    staysum   = np.zeros([nsubjects, 4])
+    stayover  = np.zeros([nsubjects, 4])
+    histogram = np.zeros([nsubjects, 4, nbins])
+    rewardmean, rewardsd = [None]*nsubjects, [None]*nsubjects
+
+    # Subjects with the same session length are simulated together
+    for n in np.unique(ntrials):
+        group = np.flatnonzero(ntrials == n)
+        offsets = np.concatenate([[0], np.cumsum([len(np.atleast_2d(draws[i]))*nreplicates for i in group])])
+        rewardsum  = np.zeros([len(group), n])
+        rewardsum2 = np.zeros([len(group), n])
+        for start in range(0, offsets[-1], chunksize):
+            position, params = replicaterows(draws, group, offsets, nreplicates, start,
+                                             min(start + chunksize, offsets[-1]))
+            chunkpaths = np.empty([len(position), n+1, 4])
+            for j in np.unique(position):
+                if paths[group[j]] is None:
+                    chunkpaths[position == j] = twostepsim.rewardpaths(np.sum(position == j), n, rng)
+                else:
+                    chunkpaths[position == j] = paths[group[j]][:n+1]
+
+            sim = twostepsim.simulate(params, n, rng, paths=chunkpaths)
+            stay = stayprobabilities(sim['choice1'], sim['step2state'], sim['reward'])
+            subject = group[position]
+            valid = ~np.isnan(stay)
+            for k in range(4):
+                rows, values = subject[valid[:, k]], stay[valid[:, k], k]
+                np.add.at(staycount[:, k], rows, 1)
+                np.add.at(staysum[:, k], rows, values)
+                np.add.at(histogram[:, k], (rows, np.minimum((values*nbins).astype(int), nbins-1)), 1)
+                if observed is not None:
+                    np.add.at(stayover[:, k], rows, values >= observed[rows, k])
+            np.add.at(rewardsum, position, sim['reward'])
+            np.add.at(rewardsum2, position, sim['reward']**2)
+
+        counts = np.diff(offsets)[:, None].astype(float)
+        for j, i in enumerate(group):
+            rewardmean[i] = rewardsum[j]/counts[j]
+            rewardsd[i] = np.sqrt(np.maximum(rewardsum2[j]/counts[j] - rewardmean[i]**2, 0))
+
+    with np.errstate(invalid='ignore'):
+        stay = {
+            'predicted': staysum/staycount,
+            'ci_low'   : histogramquantile(histogram, staycount, 0.025),
+            'ci_high'  : histogramquantile(histogram, staycount, 0.975),
+            'p_value'  : stayover/staycount if observed is not None else np.full([nsubjects, 4], np.nan)
+        }
+    return stay, rewardmean, rewardsd
+
+# Run the checks for data files and a table of fitted parameters.
+#   fits holds one row per draw with a subject_id column and the columns of
+#   paramnames (e.g., the output of twostepfit.py, which has one draw per
+#   subject). Each subject is simulated for as many trials as their own
+#   session. Returns a table of observed and predicted stay probabilities per
+#   subject, and a table of observed and predicted reward rates per trial.
+def ppcfiles(fits, filenames, nreplicates=100, seed=0, bankfile=rewardbank.bankfile, chunksize=5000):
+    subject_ids, observed, draws, paths, rewards = [], [], [], [], []
+    for filename in sorted(filenames):
+        subject_id, choices, states, reward = twostepfit.readdata(filename)
+        subjectdraws = fits.loc[fits['subject_id'].astype(str) == subject_id, twostepsim.paramnames].values
+        if len(subjectdraws) == 0:
+            continue
+        subject_ids.append(subject_id)
+        observed.append(stayprobabilities(choices[:, 0], states, reward)[0])
+        draws.append(subjectdraws)
+        paths.append(sessionpaths(filename, len(states), bankfile))
+        rewards.append(reward)
+
+    if len(subject_ids) == 0:
+        raise ValueError('None of the %d data files has a subject_id in the fits' % len(filenames))
+
+    ntrials = [len(r) for r in rewards]
+    observed = np.array(observed)
+    stay, rewardmean, rewardsd = ppc(draws, paths, ntrials, nreplicates, seed, chunksize, observed)
+
+    rows = []
+    for i, subject_id in enumerate(subject_ids):
+        for k, label in enumerate(staylabels):
+            rows.append({
+                'subject_id': subject_id,
+                'condition' : label,
+                'observed'  : observed[i, k],
+                'predicted' : stay['predicted'][i, k],
+                'ci_low'    : stay['ci_low'][i, k],
+                'ci_high'   : stay['ci_high'][i, k],
+                'p_value'   : stay['p_value'][i, k] # posterior predictive p
+            })
+    staytable = pd.DataFrame(rows, columns=['subject_id', 'condition', 'observed', 'predicted',
+                                            'ci_low', 'ci_high', 'p_value'])
+
+    ratetable = pd.DataFrame({
+        'subject_id'     : np.repeat(subject_ids, ntrials),
+        'trial'          : np.concatenate([np.arange(1, n+1) for n in ntrials]),
+        'observed_reward': np.concatenate(rewards),
+        'predicted_mean' : np.concatenate(rewardmean),
+        'predicted_sd'   : np.concatenate(rewardsd)
+    })
+    return staytable, ratetable
+
+'''
+================================================================================
+
+    RUN CHECKS
+
+================================================================================
+'''
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Posterior predictive checks for two-step fits.')
+    parser.add_argument('fits', help='fitted parameters (one row per draw, with subject_id)')
+    parser.add_argument('files', nargs='*', default=['data_*.csv'], help='data files or glob patterns')
+    parser.add_argument('--nreplicates', type=int, default=100, help='replicate sessions per draw')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--bank', default=rewardbank.bankfile)
+    parser.add_argument('--output', default='ppc')
+    args = parser.parse_args()
+
+    fits = pd.read_csv(args.fits, sep='\t', encoding='utf-8', dtype={'subject_id': str})
+    filenames = sorted(set(f for pattern in args.files for f in glob.glob(pattern)))
+    staytable, ratetable = ppcfiles(fits, filenames, args.nreplicates, args.seed, args.bank)
+
+    staytable.to_csv(args.output + '_stay.csv', sep='\t', encoding='utf-8', index=False)
+    ratetable.to_csv(args.output + '_rewardrate.csv', sep='\t', encoding='utf-8', index=False)
+    print(staytable.groupby('condition')[['observed', 'predicted']].mean().to_string(float_format='%.3f'))
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import argparse
+import pandas as pd
+import numpy as np
+from multiprocessing import Pool
+
+import twostepsim
+import twostepfit
+
+'''
+================================================================================
+
+    PARAMETER RECOVERY
+
+    Samples true parameters, simulates sessions with the task's transition
+    and reward dynamics (twostepsim.py), fits them back (twostepfit.py), and
+    reports how well each parameter is recovered. Recoveries are split into
+    chunks, each with its own child seed, so results are the same whatever
+    the number of worker processes. Within a chunk, all sessions are fitted
+    in lockstep (twostepfit.fitbatch), one batched likelihood evaluation per
+    optimizer step.
+
+================================================================================
+'''
+
+paramnames = twostepsim.paramnames
+
+# Simulate and refit one chunk of sessions (run inside a worker process)
+def recoverchunk(job):
+    params, ntrials, nrestarts, seed = job
+    simseed, fitseed = seed.spawn(2)
+    sim = twostepsim.simulate(params, ntrials, np.random.default_rng(simseed))
+    rng = np.random.default_rng(fitseed)
+
+    choices = np.stack([sim['choice1'], sim['choice2']], axis=2).astype(int)
+    fits = twostepfit.fitbatch(choices, sim['step2state'].astype(int), sim['reward'].astype(float), nrestarts, rng)
+    fitted = np.array([[fit[name] for name in paramnames] for fit in fits])
+    nll = np.array([fit['nll'] for fit in fits])
+    return fitted, nll
+
+# Run nrecoveries simulate-and-fit cycles with sessions of ntrials trials.
+#   Returns one row per recovery with the true and fitted parameters.
+def recover(nrecoveries, ntrials=twostepsim.ntrials, nrestarts=2, seed=0, nworkers=None, chunksize=200):
+    paramseed, chunkseed = twostepsim.seedsequence(seed).spawn(2)
+    params = twostepsim.sampleparams(nrecoveries, np.random.default_rng(paramseed))
+
+    starts = range(0, nrecoveries, chunksize)
+    jobs = [(params[i:i+chunksize], ntrials, nrestarts, s)
+            for i, s in zip(starts, chunkseed.spawn(len(starts)))]
+
+    if nworkers == 1 or len(jobs) == 1:
+        results = [recoverchunk(job) for job in jobs]
+    else:
+        pool = Pool(nworkers)
+        try:
+            results = pool.map(recoverchunk, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    fitted = np.concatenate([r[0] for r in results])
+    table = pd.DataFrame(params, columns=['true_' + name for name in paramnames])
+    for k, name in enumerate(paramnames):
+        table['fit_' + name] = fitted[:, k]
+    table['nll'] = np.concatenate([r[1] for r in results])
+    table['ntrials'] = ntrials
+    return table
+
+# Recovery statistics per parameter: correlation of true and fitted values, bias and RMSE
+def summarize(table):
+    rows = []
+    for name in paramnames:
+        true, fit = table['true_' + name].values, table['fit_' + name].values
+        rows.append({
+            'parameter'  : name,
+            'r'          : np.corrcoef(true, fit)[0, 1],
+            'spearman_r' : pd.Series(true).corr(pd.Series(fit), method='spearman'),
+            'bias'       : np.mean(fit - true),
+            'rmse'       : np.sqrt(np.mean((fit - true)**2))
+        })
+    return pd.DataFrame(rows, columns=['parameter', 'r', 'spearman_r', 'bias', 'rmse'])
+
+'''
+================================================================================
+
+    RUN RECOVERY
+
+================================================================================
+'''
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parameter recovery for the two-step hybrid model.')
+    parser.add_argument('--nrecoveries', type=int, default=1000)
+    parser.add_argument('--ntrials', type=int, nargs='+', default=[twostepsim.ntrials],
+                        help='session lengths to compare')
+    parser.add_argument('--nrestarts', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--nworkers', type=int, default=None)
+    parser.add_argument('--chunksize', type=int, default=200, help='recoveries fitted together in one worker')
+    parser.add_argument('--output', default='recovery.csv')
+    args = parser.parse_args()
+
+    tables = []
+    for ntrials in args.ntrials:
+        starttime = time.time()
+        table = recover(args.nrecoveries, ntrials, args.nrestarts, args.seed, args.nworkers, args.chunksize)
+        elapsed = time.time() - starttime
+        print('\n%d trials, %d recoveries in %.1f s (%.1f min per 10^4 recoveries)' %
+              (ntrials, args.nrecoveries, elapsed, elapsed/args.nrecoveries*1e4/60))
+        print(summarize(table).to_string(index=False, float_format='%.3f'))
+        tables.append(table)
+
+    pd.concat(tables).to_csv(args.output, sep='\t', encoding='utf-8', index=False)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import argparse
+import numpy as np
+
+import twostepsim
+
+'''
+================================================================================
+
+    REWARD PATH BANK
+
+    Pre-generates reward probability random walks (as in rewardpathupdate of
+    twostep.py) and stores them in a memory-mapped .npy file shaped
+    (paths x trials+1 x 4). A session uses one row of the bank, and the row
+    index (the path ID) is logged with the data, so any session's reward
+    probabilities can be recovered in O(1).
+
+    The generation settings are written next to the bank in a .json file.
+
+================================================================================
+'''
+
+# Default location of the bank used by twostep.py
+bankfile = 'resources/rewardpaths.npy'
+
+# Name of the metadata file stored next to a bank
+def infofile(filename):
+    return os.path.splitext(filename)[0] + '.json'
+
+# Generate a bank of reward paths and write it to a memory-mapped .npy file.
+#   Paths are generated chunksize at a time, each chunk from its own child of
+#   the seed, so the bank is determined by (seed, chunksize).
+def buildbank(filename, npaths, ntrials=twostepsim.ntrials, seed=0,
+              lbound=twostepsim.lbound, ubound=twostepsim.ubound, sd=twostepsim.sdrewardpath,
+              dtype='float32', chunksize=10000):
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    bank = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=(npaths, ntrials+1, 4))
+
+    starts = range(0, npaths, chunksize)
+    seeds  = np.random.SeedSequence(seed).spawn(len(starts))
+    for start, s in zip(starts, seeds):
+        n = min(chunksize, npaths - start)
+        bank[start:start+n] = twostepsim.rewardpaths(n, ntrials, np.random.default_rng(s), lbound, ubound, sd)
+    bank.flush()
+
+    info = {
+        'npaths'      : npaths,
+        'ntrials'     : ntrials,
+        'seed'        : seed,
+        'lbound'      : lbound,
+        'ubound'      : ubound,
+        'sdrewardpath': sd,
+        'dtype'       : str(np.dtype(dtype)),
+        'chunksize'   : chunksize
+    }
+    with open(infofile(filename), 'w') as f:
+        json.dump(info, f, indent=4)
+
+    return bank
+
+# Open a bank read-only without loading it into memory
+def loadbank(filename=bankfile):
+    return np.load(filename, mmap_mode='r')
+
+# Read the generation settings of a bank
+def bankinfo(filename=bankfile):
+    with open(infofile(filename)) as f:
+        return json.load(f)
+
+# Number of trials to read from the bank (all of them if ntrials is None)
+def pathlength(bank, ntrials=None):
+    if ntrials is None:
+        return bank.shape[1] - 1
+    if ntrials + 1 > bank.shape[1]:
+        raise ValueError('Bank paths have %d trials, but %d were requested' % (bank.shape[1] - 1, ntrials))
+    return ntrials
+
+# Pull the reward path with the given ID, shaped (ntrials+1 x 4)
+def getpath(bank, pathid, ntrials=None):
+    if pathid < 0 or pathid >= bank.shape[0]:
+        raise IndexError('Path ID %d is outside of the bank (%d paths)' % (pathid, bank.shape[0]))
+    return np.array(bank[pathid, :pathlength(bank, ntrials)+1], dtype=float)
+
+# Pull several paths at once, shaped (len(pathids) x ntrials+1 x 4)
+def getpaths(bank, pathids, ntrials=None):
+    return np.array(bank[np.asarray(pathids), :pathlength(bank, ntrials)+1], dtype=float)
+
+'''
+================================================================================
+
+    BUILD BANK
+
+================================================================================
+'''
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a bank of two-step reward paths.')
+    parser.add_argument('--npaths', type=int, default=100000)
+    parser.add_argument('--ntrials', type=int, default=twostepsim.ntrials)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dtype', default='float32')
+    parser.add_argument('--output', default=bankfile)
+    args = parser.parse_args()
+
+    buildbank(args.output, args.npaths, args.ntrials, args.seed, dtype=args.dtype)
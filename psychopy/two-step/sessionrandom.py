@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+'''
+================================================================================
+
+    SEEDED SESSION RANDOMNESS
+
+    Counter-based random numbers for the two-step task. Every draw is a hash
+    of (session seed, stream, trial), so the draw for a given trial does not
+    depend on how many numbers were drawn before it. This lets twostep.py
+    (one session, one trial at a time) and twostepenv.py (many sessions,
+    all at once) produce identical trial data from the same seeds without a
+    per-session random generator.
+
+================================================================================
+'''
+
+# Streams of draws within a session
+TRANSITION = 0 # uniform compared with ptrans[choice1] to pick the step 2 state
+REWARD     = 1 # uniform compared with the reward probability of the chosen option
+PATHSTART  = 2 # uniforms for the initial reward probabilities
+PATHSTEP   = 3 # uniforms for the Gaussian steps of the reward probabilities (two per normal)
+ISI        = 4 # uniforms for the intertrial intervals
+LAYOUT     = 5 # uniforms for the left/right placement of the options (two per trial)
+nstreams   = 8
+
+# SplitMix64 finalizer, applied elementwise to uint64 arrays
+def splitmix64(x):
+    with np.errstate(over='ignore'):
+        z = np.asarray(x, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+# Seed for a separate part of a session (e.g., the practice trials)
+def derivedseed(seed, part):
+    with np.errstate(over='ignore'):
+        return int(splitmix64(np.uint64(seed)*np.uint64(nstreams) + np.uint64(nstreams - 1 - part)))
+
+# Uniform draws in [0, 1) for the given seeds, stream and counters.
+#   seeds and index broadcast against each other, e.g. seeds shaped (sessions x 1)
+#   and index shaped (trials,) give draws shaped (sessions x trials).
+def uniform(seeds, stream, index):
+    with np.errstate(over='ignore'):
+        key  = splitmix64(np.asarray(seeds, dtype=np.uint64)*np.uint64(nstreams) + np.uint64(stream))
+        bits = splitmix64(key + np.asarray(index, dtype=np.uint64))
+    return (bits >> np.uint64(11))*(1.0/2**53)
+
+# Standard normal draws (Box-Muller), indexed like uniform
+def normal(seeds, stream, index):
+    index = np.asarray(index, dtype=np.uint64)
+    u1 = 1 - uniform(seeds, stream, 2*index)
+    u2 = uniform(seeds, stream, 2*index + np.uint64(1))
+    return np.sqrt(-2*np.log(u1))*np.cos(2*np.pi*u2)
+
+# Initial reward probabilities of each session, shaped (sessions x 4)
+def pathstart(seeds, lbound, ubound):
+    seeds = np.asarray(seeds, dtype=np.uint64)
+    return lbound + (ubound - lbound)*uniform(seeds[..., None], PATHSTART, np.arange(4))
+
+# Reward probabilities on trial t+1 given those on trial t, as in rewardpathupdate
+def pathstep(paths, seeds, t, lbound, ubound, sd):
+    seeds = np.asarray(seeds, dtype=np.uint64)
+    steps = normal(seeds[..., None], PATHSTEP, 4*t + np.arange(4))
+    return np.maximum(np.minimum(paths + sd*steps, ubound), lbound)
+
+# Full reward probability paths, shaped (sessions x ntrials+1 x 4), or
+# (ntrials+1 x 4) for a single seed
+def rewardpaths(seeds, ntrials, lbound, ubound, sd):
+    seeds = np.asarray(seeds, dtype=np.uint64)
+    paths = np.empty(seeds.shape + (ntrials+1, 4))
+    paths[..., 0, :] = pathstart(seeds, lbound, ubound)
+    for t in range(ntrials):
+        paths[..., t+1, :] = pathstep(paths[..., t, :], seeds, t, lbound, ubound, sd)
+    return paths
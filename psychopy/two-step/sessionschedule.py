@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import pandas as pd
+import numpy as np
+
+import twostepsim
+import sessionrandom
+
+'''
+================================================================================
+
+    TWO-STEP SESSION SCHEDULE
+
+    Draws all of a session's per-trial randomness up front from its seed:
+
+    - the intertrial interval (exponential, optionally truncated)
+    - the left/right placement of the options at step 1 and step 2
+    - the step 2 state that each step 1 choice would lead to
+    - the reward that each step 2 option would give
+
+    Transitions and rewards use the same counter-based streams as
+    twostepenv.py (sessionrandom.TRANSITION and sessionrandom.REWARD), so
+    sessions are unchanged for a given seed and choices. During a trial,
+    twostep.py only looks up the entries for trial t. The schedule is written
+    with the data (schedule_<id>.csv) so sessions can be audited.
+
+    A trial that is aborted for a slow response is repeated with the same
+    entries.
+
+================================================================================
+'''
+
+# Intertrial intervals: exponential with mean isi, truncated to [isimin, isimax]
+# by inverting the truncated CDF (not by clipping)
+def intervals(u, isi, isimin=0, isimax=None):
+    lower = 1 - np.exp(-isimin/float(isi))
+    upper = 1 if isimax is None else 1 - np.exp(-isimax/float(isi))
+    return -isi*np.log(1 - (lower + u*(upper - lower)))
+
+# Schedule of a session from its seed and reward probabilities (ntrials+1 x 4)
+def buildschedule(seed, paths, ntrials, isi=1, isimin=0, isimax=None, ptrans=twostepsim.ptrans):
+    t = np.arange(ntrials)
+    utransition = sessionrandom.uniform(seed, sessionrandom.TRANSITION, t)
+    ureward     = sessionrandom.uniform(seed, sessionrandom.REWARD, t)
+    ulayout     = sessionrandom.uniform(seed, sessionrandom.LAYOUT, np.arange(2*ntrials)).reshape(ntrials, 2)
+
+    # Options in left/right order at each step ([0, 1] or [1, 0], as in drawrect)
+    swapped = (ulayout < 0.5).astype(int)
+    layout = np.stack([swapped, 1 - swapped], axis=2)
+
+    # Outcomes of every possible choice: state[t, choice1] and reward[t, state, choice2]
+    state = np.stack([twostepsim.transition(np.full(ntrials, c), utransition, ptrans) for c in (0, 1)], axis=1)
+    reward = (ureward[:, None] < paths[:ntrials]).astype(np.int8).reshape(ntrials, 2, 2)
+
+    return {
+        'seed'        : seed,
+        'isi'         : intervals(sessionrandom.uniform(seed, sessionrandom.ISI, t), isi, isimin, isimax),
+        'layout'      : layout,
+        'u_transition': utransition,
+        'u_reward'    : ureward,
+        'state'       : state,
+        'reward'      : reward,
+        'paths'       : paths[:ntrials+1]
+    }
+
+# One row per trial, for storing with the data
+def scheduletable(schedule, block='task'):
+    ntrials = len(schedule['isi'])
+    return pd.DataFrame({
+        'block'             : block,
+        'trial'             : np.arange(1, ntrials+1),
+        'session_seed'      : np.full(ntrials, schedule['seed'], dtype=np.uint64),
+        'isi'               : schedule['isi'],
+        'left_step1'        : schedule['layout'][:, 0, 0],
+        'left_step2'        : schedule['layout'][:, 1, 0],
+        'u_transition'      : schedule['u_transition'],
+        'u_reward'          : schedule['u_reward'],
+        'state_if_choice1_0': schedule['state'][:, 0],
+        'state_if_choice1_1': schedule['state'][:, 1],
+        'reward_state0_0'   : schedule['reward'][:, 0, 0],
+        'reward_state0_1'   : schedule['reward'][:, 0, 1],
+        'reward_state1_0'   : schedule['reward'][:, 1, 0],
+        'reward_state1_1'   : schedule['reward'][:, 1, 1],
+        'rprob_state0_0'    : schedule['paths'][:ntrials, 0],
+        'rprob_state0_1'    : schedule['paths'][:ntrials, 1],
+        'rprob_state1_0'    : schedule['paths'][:ntrials, 2],
+        'rprob_state1_1'    : schedule['paths'][:ntrials, 3]
+    })
+
+'''
+================================================================================
+
+    SHOW A SCHEDULE
+
+================================================================================
+'''
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the schedule of a two-step session from its seed.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ntrials', type=int, default=twostepsim.ntrials)
+    parser.add_argument('--isimax', type=float, default=None, help='truncate intertrial intervals')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    paths = sessionrandom.rewardpaths(args.seed, args.ntrials, twostepsim.lbound, twostepsim.ubound,
+                                      twostepsim.sdrewardpath)
+    table = scheduletable(buildschedule(args.seed, paths, args.ntrials, isimax=args.isimax))
+    if args.output:
+        table.to_csv(args.output, sep='\t', encoding='utf-8', index=False)
+    else:
+        print(table.head(10).to_string(index=False, float_format='%.3f'))
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import argparse
+from multiprocessing import Pool
+import pandas as pd
+import numpy as np
+from scipy import stats
+
+'''
+================================================================================
+
+    STAY/SWITCH REGRESSION FOR THE TWO-STEP TASK
+
+    Logistic regression of step 1 choices on the outcomes of previous
+    trials, for every subject at once and pooled over subjects. A transition
+    is common when the step 2 state matches the step 1 choice (see
+    transition in twostep.py).
+
+    For each lag k the predictors are the choice on trial t-k (coded +1/-1)
+    times 1, the reward (+1/-1), the transition type (+1 common, -1 rare) and
+    reward x transition on that trial. With one lag, these four weights are
+    the stay, reward, transition and reward x transition effects of the
+    standard stay/switch analysis (Daw et al. 2011); the intercept absorbs any
+    bias towards one option.
+
+    All subjects are fitted together by batched IRLS on padded arrays.
+
+================================================================================
+'''
+
+termnames = ['stay', 'reward', 'transition', 'reward_x_transition']
+
+# Names of the regression coefficients for nlags lags
+def coefnames(nlags=1):
+    names = ['intercept']
+    for k in range(1, nlags+1):
+        names += [name if nlags == 1 else '%s_lag%d' % (name, k) for name in termnames]
+    return names
+
+datacolumns = ['subject_id', 'step2state', 'choice1', 'reward']
+
+# Step 1 choices, step 2 states and rewards of one data file.
+#   Only the columns the regression needs are parsed (cf. twostepfit.readdata).
+def readfile(filename):
+    data = pd.read_csv(filename, sep='\t', encoding='utf-8', dtype={'subject_id': str},
+                       usecols=lambda column: column in datacolumns)
+    data = data.dropna(subset=['step2state', 'choice1', 'reward'])
+    if 'subject_id' in data and len(data) > 0:
+        subject_id = data['subject_id'].iloc[0]
+    else:
+        subject_id = os.path.splitext(os.path.basename(filename))[0].replace('data_', '', 1)
+    return (subject_id, data['choice1'].values.astype(int), data['step2state'].values.astype(int),
+            data['reward'].values.astype(float))
+
+# Read data files (across a process pool) into padded arrays shaped
+# (subjects x trials); mask marks real trials
+def readfiles(filenames, nworkers=None):
+    filenames = sorted(filenames)
+    if nworkers == 1 or len(filenames) <= 1:
+        sessions = [readfile(f) for f in filenames]
+    else:
+        pool = Pool(nworkers)
+        try:
+            sessions = pool.map(readfile, filenames)
+        finally:
+            pool.close()
+            pool.join()
+    subject_ids = [s[0] for s in sessions]
+    sessions = [s[1:] for s in sessions]
+
+    ntrials = max(len(s[1]) for s in sessions)
+    choice1 = np.zeros([len(sessions), ntrials], dtype=int)
+    states  = np.zeros([len(sessions), ntrials], dtype=int)
+    rewards = np.zeros([len(sessions), ntrials])
+    mask    = np.zeros([len(sessions), ntrials], dtype=bool)
+    for i, (c, s, r) in enumerate(sessions):
+        choice1[i, :len(s)] = c
+        states[i, :len(s)]  = s
+        rewards[i, :len(s)] = r
+        mask[i, :len(s)]    = True
+    return subject_ids, choice1, states, rewards, mask
+
+# Lagged design matrices for all subjects at once.
+#   Returns X shaped (subjects x trials-nlags x coefficients), the outcome y
+#   (step 1 choice on each trial) and the mask of usable rows.
+def designmatrix(choice1, states, rewards, mask, nlags=1):
+    nsubjects, ntrials = choice1.shape
+    c  = 2.0*choice1 - 1
+    r  = 2.0*rewards - 1
+    tr = np.where(states == choice1, 1.0, -1.0)
+
+    nrows = ntrials - nlags
+    X = np.empty([nsubjects, nrows, 1 + 4*nlags])
+    X[:, :, 0] = 1
+    for k in range(1, nlags+1):
+        lagged = slice(nlags - k, ntrials - k)
+        X[:, :, 4*k - 3] = c[:, lagged]
+        X[:, :, 4*k - 2] = c[:, lagged]*r[:, lagged]
+        X[:, :, 4*k - 1] = c[:, lagged]*tr[:, lagged]
+        X[:, :, 4*k]     = c[:, lagged]*r[:, lagged]*tr[:, lagged]
+
+    y = choice1[:, nlags:].astype(float)
+    rowmask = mask[:, nlags:]
+    return X, y, rowmask
+
+# Logistic regressions for a batch of datasets by iteratively reweighted least squares.
+#   X is shaped (datasets x rows x coefficients), y and mask (datasets x rows).
+#   A small ridge keeps the updates defined under separation. Returns the
+#   coefficients and their standard errors, shaped (datasets x coefficients).
+def batchirls(X, y, mask, maxiter=50, tol=1e-8, ridge=1e-6):
+    ndatasets, nrows, ncoefs = X.shape
+    weight = mask.astype(float)
+    beta = np.zeros([ndatasets, ncoefs])
+    penalty = ridge*np.eye(ncoefs)
+
+    Xt = X.transpose(0, 2, 1)
+
+    for iteration in range(maxiter):
+        mu = 1/(1 + np.exp(-np.matmul(X, beta[:, :, None])[:, :, 0]))
+        H  = np.matmul(Xt, X*(weight*mu*(1 - mu))[:, :, None]) + penalty
+        g  = np.matmul(Xt, (weight*(y - mu))[:, :, None])[:, :, 0] - ridge*beta
+        step = np.linalg.solve(H, g[:, :, None])[:, :, 0]
+        beta += step
+        if np.max(np.abs(step)) < tol:
+            break
+
+    mu = 1/(1 + np.exp(-np.matmul(X, beta[:, :, None])[:, :, 0]))
+    H  = np.matmul(Xt, X*(weight*mu*(1 - mu))[:, :, None]) + penalty
+    se = np.sqrt(np.diagonal(np.linalg.inv(H), axis1=1, axis2=2))
+    return beta, se
+
+# Per-subject and pooled regressions for a set of data files.
+#   Returns a table of per-subject coefficients and a table with the pooled
+#   fit and a t-test of the per-subject coefficients across subjects.
+def analyse(filenames, nlags=1, nworkers=None):
+    subject_ids, choice1, states, rewards, mask = readfiles(filenames, nworkers)
+    X, y, rowmask = designmatrix(choice1, states, rewards, mask, nlags)
+    names = coefnames(nlags)
+
+    beta, se = batchirls(X, y, rowmask)
+    subjects = pd.DataFrame(beta, columns=names)
+    for k, name in enumerate(names):
+        subjects['se_' + name] = se[:, k]
+    subjects.insert(0, 'subject_id', subject_ids)
+
+    ncoefs = X.shape[2]
+    pooledbeta, pooledse = batchirls(X.reshape(1, -1, ncoefs), y.reshape(1, -1), rowmask.reshape(1, -1))
+    tstat, tp = stats.ttest_1samp(beta, 0, axis=0)
+    summary = pd.DataFrame({
+        'coefficient'   : names,
+        'pooled'        : pooledbeta[0],
+        'pooled_se'     : pooledse[0],
+        'pooled_p'      : 2*stats.norm.sf(np.abs(pooledbeta[0]/pooledse[0])),
+        'subject_mean'  : beta.mean(axis=0),
+        'subject_sd'    : beta.std(axis=0, ddof=1) if len(beta) > 1 else np.nan,
+        't'             : tstat,
+        'p'             : tp
+    })
+    return subjects, summary
+
+'''
+================================================================================
+
+    RUN ANALYSIS
+
+================================================================================
+'''
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stay/switch logistic regression for two-step data files.')
+    parser.add_argument('files', nargs='*', default=['data_*.csv'], help='data files or glob patterns')
+    parser.add_argument('--nlags', type=int, default=1)
+    parser.add_argument('--nworkers', type=int, default=None)
+    parser.add_argument('--output', default='stay')
+    args = parser.parse_args()
+
+    filenames = sorted(set(f for pattern in args.files for f in glob.glob(pattern)))
+    subjects, summary = analyse(filenames, args.nlags, args.nworkers)
+
+    subjects.to_csv(args.output + '_subjects.csv', sep='\t', encoding='utf-8', index=False)
+    summary.to_csv(args.output + '_summary.csv', sep='\t', encoding='utf-8', index=False)
+    print(summary.to_string(index=False, float_format='%.3f'))
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 from psychopy import core, visual, event, gui
+import os
 import sys
 import pandas as pd
 import numpy as np
@@ -9,6 +10,18 @@ import numpy.random as rnd
 import matplotlib.pyplot as plt
 from random import shuffle
 
+import rewardbank
+import sessionrandom
+import onlineestimate
+import sessionschedule
+import batchdraw
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+import frametiming
+import tracing
+import allocations
+import stimulusregistry
+
 '''
 ================================================================================
 
@@ -40,12 +53,44 @@ lbound = 0.25 # lower bound on reward probabilities
 ubound = 0.75 # upper bound on reward probabilities
 sdrewardpath = 0.025 # SD of the Gaussian process for reward probabilities
 
+# All transitions, rewards and reward paths are drawn from the session seed (see sessionrandom.py),
+# so a session can be reproduced, or run in twostepenv.py, from its logged seed.
+sessionseed = None # None picks a seed at random
+
+# Reward paths for the task proper are pulled from a pre-generated bank (built with rewardbank.py).
+# If the bank file does not exist, the path is generated from the session seed and logged with ID -1.
+pathbankfile = rewardbank.bankfile
+pathid = None # ID of the path to use from the bank (None uses the session seed modulo the bank size)
+
+if sessionseed is None:
+    sessionseed = rnd.randint(2**31)
+
 # Specify whether subjects will be paid per reward, and the amount that will be paid per reward gained
 pay_per_reward = True
 val_reward = 0.02 # amount to pay per reward on task
 
+# Adaptive stopping: the task ends early once the 95% credible interval of the
+# model-based weight w (estimated online, see onlineestimate.py) is narrow enough
+adaptivestop   = False
+ciwidthtarget  = 0.3 # credible interval width at which to stop
+nminimumtrials = 100 # never stop before this many trials
+
 tlimitchoice = 3.0 # time limit for choices
-isi = 1 # intertrial interval
+isi = 1 # intertrial interval (mean of an exponential distribution)
+isimin = 0    # truncate intertrial intervals to [isimin, isimax] (isimax None: no upper limit)
+isimax = None
+
+# Draw the options with element arrays and a shared symbol texture (see batchdraw.py). The batch is
+# checked against the current drawing at startup and only used if it matches; both are timed and
+# written as drawtime_<id>.csv.
+batchdrawing = False
+
+# Pre-render each option (box, colour and symbol) into one image in initgraphics, so that moving or
+# fading an option draws one textured quad instead of a Rect and a TextStim
+bakeoptions = False
+
+tracespans = False # time drawing functions and key waits, written as trace_<id>.json (see tracing.py)
+trackallocations = False # diagnostic: memory and live objects at every phase boundary, written as allocations_<id>*.csv (see allocations.py)
 
 fullscreen = True
 if fullscreen is True:
@@ -71,6 +116,23 @@ win = visual.Window(
     units='pix'
 )
 
+# Log every flip, tagged with the phase of the trial (see frametiming.py)
+framelog = frametiming.FrameLog(win, core.getTime)
+
+# Time flips and key waits (a disabled tracer leaves them untouched)
+tracer = tracing.Tracer(core.getTime, enabled=tracespans, process='two-step')
+win.flip = tracer.wrap(win.flip, 'flip')
+event.waitKeys = tracer.wrap(event.waitKeys, 'waitKeys')
+
+# Check memory and live objects on entering each phase (diagnostic; distorts timing)
+if trackallocations:
+    allocmonitor = allocations.AllocationMonitor(trialphase='fixation')
+    framelog.onphase.append(allocmonitor.checkpoint)
+    allocmonitor.start()
+
+# Every visual object is built once through the registry, before the first trial
+stimuli = stimulusregistry.StimulusRegistry()
+
 # Color palette (Colorbrewer qualitative set 1)
 pal = [[ 0.78125  , -0.796875 , -0.78125  ],
        [-0.5703125, -0.015625 ,  0.4375   ],
@@ -109,7 +171,7 @@ trainchars = [u'\u03E0',
 '''
 
 # Introduction message
-intromessage = visual.TextStim(win,
+intromessage = stimuli.add('intromessage', visual.TextStim, win,
     text='Thank you for participating in our study.\n\n' +
          'You will be playing a game in which the goal is to maximize the amount of reward you receive.\n\n' +
          'We will start with a training step in order to familiarize yourself with the task.\n\n'
@@ -117,10 +179,14 @@ intromessage = visual.TextStim(win,
 )
 
 # Respond faster message
-respondfaster = visual.TextStim(win,
+respondfaster = stimuli.add('respondfaster', visual.TextStim, win,
     text='You must respond faster!'
 )
 
+# Fixation cross
+fixationvert = stimuli.add('fixationvert', visual.Rect, win, units='pix', height=0.025*monitor_height, width=0.005*monitor_width, fillColor=[1,1,1], lineColor=[1,1,1])
+fixationhorz = stimuli.add('fixationhorz', visual.Rect, win, units='pix', height=0.005*monitor_height, width=0.025*monitor_width, fillColor=[1,1,1], lineColor=[1,1,1])
+
 '''
 ================================================================================
 
@@ -129,8 +195,8 @@ respondfaster = visual.TextStim(win,
 ================================================================================
 '''
 
-# Function to initialize the stimuli
-def initgraphics(pal=pal, chars=chars):
+# Function to initialize the stimuli (bake: also render each option into one ImageStim)
+def initgraphics(pal=pal, chars=chars, bake=False):
     shuffle(chars)
     shuffle(pal)
     stim = {
@@ -186,10 +252,29 @@ def initgraphics(pal=pal, chars=chars):
         }
     }
 
-    return stim, stimtext, rewardicons
+    optionimages = None
+    if bake:
+        optionimages = batchdraw.bakeoptions(win, stim, stimtext, 0.25*monitor_height)
+
+    return stim, stimtext, rewardicons, optionimages
 
 # Function to initialize the small stimuli for training
 def drawstructurestims(stim, stimtext):
+    positions = {(0, 0, 0): [-0.1*monitor_width, 0.4*monitor_height],
+                 (0, 0, 1): [ 0.1*monitor_width, 0.4*monitor_height],
+                 (1, 0, 0): [-0.7*monitor_width, -0.2*monitor_height],
+                 (1, 0, 1): [-0.5*monitor_width, -0.2*monitor_height],
+                 (1, 1, 0): [ 0.5*monitor_width, -0.2*monitor_height],
+                 (1, 1, 1): [ 0.7*monitor_width, -0.2*monitor_height]}
+    if optionbatch is not None:
+        for key in batchdraw.optionkeys:
+            optionbatch.place(key, positions[key])
+        optionbatch.draw()
+        return
+    if optionimages is not None:
+        for key in batchdraw.optionkeys:
+            drawimage(key[0], key[1], key[2], positions[key])
+        return
 
     stim[0][0][0].pos     = [-0.1*monitor_width, 0.4*monitor_height]
     stim[0][0][1].pos     = [ 0.1*monitor_width, 0.4*monitor_height]
@@ -236,23 +321,34 @@ def drawstructurestims(stim, stimtext):
 
 # Draw fixation cross
 def drawfixation():
-    vert = visual.Rect(win, units='pix', height=0.025*monitor_height, width=0.005*monitor_width, fillColor=[1,1,1], lineColor=[1,1,1])
-    horz = visual.Rect(win, units='pix', height=0.005*monitor_height, width=0.025*monitor_width, fillColor=[1,1,1], lineColor=[1,1,1])
-    vert.draw()
-    horz.draw()
+    fixationvert.draw()
+    fixationhorz.draw()
 
-# Function to draw the stimuli
-def drawrect(step, state, stim, stimtext, sel=None):
+# Function to draw the stimuli (stimorder gives the options on the left and right)
+def drawrect(step, state, stimorder, stim, stimtext, sel=None):
     pos = [[-0.25*monitor_width, -0.1*monitor_height   ],
            [0.25*monitor_width , -0.1*monitor_height   ],
            [0   , 0.25*monitor_height ]];
 
+    if optionbatch is not None:
+        optionbatch.hide()
+        if sel is not None:
+            optionbatch.place((0, 0, sel), pos[2], 0.5)
+        optionbatch.place((step, state, stimorder[0]), pos[0])
+        optionbatch.place((step, state, stimorder[1]), pos[1])
+        optionbatch.draw()
+        return stimorder
+
+    if optionimages is not None:
+        if sel is not None:
+            drawimage(0, 0, sel, pos[2], 0.5)
+        drawimage(step, state, stimorder[0], pos[0])
+        drawimage(step, state, stimorder[1], pos[1])
+        return stimorder
+
     if sel is not None:
         drawselected(0, 0, sel, stim, stimtext)
 
-    stimorder = [0, 1]
-    shuffle(stimorder)
-
     stim[step][state][stimorder[0]].pos = pos[0]
     stim[step][state][stimorder[1]].pos = pos[1]
     stim[step][state][stimorder[0]].opacity = 1
@@ -273,6 +369,15 @@ def drawrect(step, state, stim, stimtext, sel=None):
 
 # Draw the selected stimulus with reduced opacity
 def drawselected(step, state, sel, stim, stimtext):
+    if optionbatch is not None:
+        optionbatch.hide()
+        optionbatch.place((step, state, sel), [0, 0.25*monitor_height], 0.5)
+        optionbatch.draw()
+        return
+    if optionimages is not None:
+        drawimage(step, state, sel, [0, 0.25*monitor_height], 0.5)
+        return
+
     stim[step][state][sel].pos = [0, 0.25*monitor_height]
     stim[step][state][sel].opacity = 0.5
     stimtext[step][state][sel].pos = [0, 0.25*monitor_height]
@@ -281,11 +386,11 @@ def drawselected(step, state, sel, stim, stimtext):
     stim[step][state][sel].draw()
     stimtext[step][state][sel].draw()
 
-# Transition function
-def transition(sel):
-    ptrans = [0.3, 0.7]
-
-    return rnd.binomial(1, ptrans[sel])
+# Move, fade and draw the baked image of an option (one textured quad)
+def drawimage(step, state, option, pos, opacity=1):
+    optionimages[step][state][option].pos = pos
+    optionimages[step][state][option].opacity = opacity
+    optionimages[step][state][option].draw()
 
 # Translate key to choice
 def key2choice(stimorder, keys):
@@ -295,14 +400,13 @@ def key2choice(stimorder, keys):
         choice = stimorder[1]
     return choice
 
-# Update reward probabilities
-def rewardpathupdate(paths, lbound=lbound, ubound=ubound, sd=sdrewardpath):
-    return np.maximum(np.minimum(paths + sd*rnd.normal(0, 1, 4), ubound), lbound)
+# Reward probability paths for a whole block of trials (see sessionrandom.pathstep for the update)
+def rewardpaths(seed, ntrials, lbound=lbound, ubound=ubound, sd=sdrewardpath):
+    return sessionrandom.rewardpaths(seed, ntrials, lbound, ubound, sd)
 
-# Sample reward
-def rewardfunction(state, choice, paths):
-    rprob = paths[2*state + choice]
-    return rnd.binomial(1, rprob)
+# Intertrial intervals, option layouts, transitions and rewards of a block of trials, drawn up front
+def schedule(seed, paths, ntrials):
+    return sessionschedule.buildschedule(seed, paths, ntrials, isi, isimin, isimax)
 
 # Draw reward or no-reward icon
 def displayreward(reward, rewardicons):
@@ -314,9 +418,26 @@ def displayreward(reward, rewardicons):
 # Animate movement of chosen option to top of screen
 def animatechoice(step, state, sel, stim, stimtext):
     endpos = np.array([0, 0.25*monitor_height])
-    startpos = stim[step][state][sel].pos
+    if optionbatch is not None:
+        startpos = optionbatch.pos((step, state, sel))
+    elif optionimages is not None:
+        startpos = np.array(optionimages[step][state][sel].pos, dtype=float)
+    else:
+        startpos = stim[step][state][sel].pos
     nframes = int(np.floor(0.4/win.monitorFramePeriod))
     ddist = (endpos - startpos)/nframes
+    if optionbatch is not None:
+        optionbatch.hide()
+        for frame in range(nframes):
+            optionbatch.place((step, state, sel), startpos + (frame + 1)*ddist)
+            optionbatch.draw()
+            win.flip()
+        return
+    if optionimages is not None:
+        for frame in range(nframes):
+            drawimage(step, state, sel, startpos + (frame + 1)*ddist)
+            win.flip()
+        return
     for frame in range(nframes):
         stim[step][state][sel].pos = stim[step][state][sel].pos + ddist
         stimtext[step][state][sel].pos = stim[step][state][sel].pos
@@ -324,6 +445,13 @@ def animatechoice(step, state, sel, stim, stimtext):
         stimtext[step][state][sel].draw()
         win.flip()
 
+# Time the drawing functions
+drawfixation  = tracer.wrap(drawfixation)
+drawrect      = tracer.wrap(drawrect)
+drawselected  = tracer.wrap(drawselected)
+displayreward = tracer.wrap(displayreward)
+animatechoice = tracer.wrap(animatechoice)
+
 '''
 ================================================================================
 
@@ -340,35 +468,47 @@ def animatechoice(step, state, sel, stim, stimtext):
 --------------------------------------------------------------------------------
 '''
 # Load training stimuli
-stim, stimtext, rewardicons = initgraphics()
+stim, stimtext, rewardicons, optionimages = stimuli.add('options', initgraphics, bake=bakeoptions)
+
+# Batched drawing of the options (None: draw each Rect and TextStim)
+optionbatch = None
+if batchdrawing:
+    batch = stimuli.add('optionbatch', batchdraw.OptionBatch, win, stim, stimtext, 0.25*monitor_height)
+    batch.verify(stim, stimtext, batchdraw.checkpositions(monitor_width, monitor_height))
+    batchdraw.comparedrawtime(win, stim, stimtext, batch,
+                              [[0, 0.25*monitor_height], [-0.25*monitor_width, -0.1*monitor_height],
+                               [0.25*monitor_width, -0.1*monitor_height]]).to_csv(
+        'drawtime_' + subject_id + '.csv', sep='\t', encoding='utf-8', index=False)
+    if batch.verified:
+        optionbatch = batch
 
 # TEXT ELEMENTS
 
-ftext = visual.TextStim(win,
+ftext = stimuli.add('ftext', visual.TextStim, win,
     text='"f"',
     units='pix',
     pos=[-0.25*monitor_width, -0.3*monitor_height]
 )
 
-jtext = visual.TextStim(win,
+jtext = stimuli.add('jtext', visual.TextStim, win,
     text='"j"',
     units='pix',
     pos=[0.25*monitor_width, -0.3*monitor_height]
 )
 
-makeselection = visual.TextStim(win,
+makeselection = stimuli.add('makeselection', visual.TextStim, win,
     text='Make your selection',
     units='pix',
     pos=[0, -0.3*monitor_height]
 )
 
-trainingstep1msg = visual.TextStim(win,
+trainingstep1msg = stimuli.add('trainingstep1msg', visual.TextStim, win,
     text = 'At the first step, you will see two shapes with symbols inside of them.\n\n' +
     'You must select between one or the other using the "f" key (for the left one), or the "j" key (for the right one):\n\n' +
     'Press the "Q" key to try it out...'
 )
 
-trainingstep1resultmsg = visual.TextStim(win,
+trainingstep1resultmsg = stimuli.add('trainingstep1resultmsg', visual.TextStim, win,
     text = 'As you can see, your choice will move to the top of the screen.\n\n' +
     'After the first step choice, you will be presented with another pair of choices that will look different. You will again need to choose between them using the "f" or "j" keys, as before.\n\n' +
     'Press the "Q" key to try it out...',
@@ -376,7 +516,7 @@ trainingstep1resultmsg = visual.TextStim(win,
 
 )
 
-trainingstep2resultmsg = visual.TextStim(win,
+trainingstep2resultmsg = stimuli.add('trainingstep2resultmsg', visual.TextStim, win,
     text = 'Again, your choice will move to the top of the screen.\n\n' +
     'You will now either receive a reward (a gold coin), or not (a red "X") depending on your selection.\n\n' +
     'This sequence of steps will be repeated many times.\n\n' +
@@ -385,22 +525,22 @@ trainingstep2resultmsg = visual.TextStim(win,
     pos = [0, -0.1*monitor_height]
 )
 
-step1options = visual.TextStim(win,
+step1options = stimuli.add('step1options', visual.TextStim, win,
     text = 'First Step Options',
     pos = [0, 0.6*monitor_height]
 )
 
-step2optionsA = visual.TextStim(win,
+step2optionsA = stimuli.add('step2optionsA', visual.TextStim, win,
     text = 'Step 2 Options (Pair A)',
     pos = [-0.6*monitor_width, -0.0*monitor_height]
 )
 
-step2optionsB = visual.TextStim(win,
+step2optionsB = stimuli.add('step2optionsB', visual.TextStim, win,
     text = 'Step 2 Options (Pair B)',
     pos = [0.6*monitor_width, -0.0*monitor_height]
 )
 
-structuredemomsg = visual.TextStim(win,
+structuredemomsg = stimuli.add('structuredemomsg', visual.TextStim, win,
     text = 'The symbols that you are presented with at Step 1 are shown above. They never change throughout the task, but their order (left side vs. right side) can change.\n\n' +
     'After your choice at Step 1, you will be presented with either "Pair A" (here shown on the left), or "Pair B" (here shown on the right). Pair A and Pair B never get mixed up. You will always be presented with either one or the other at Step 2.\n\n' +
     'Selecting one of the symbols during Step 1 will lead you to Pair A more often, but the other symbol will lead you to Pair B more often.\n\n' +
@@ -409,13 +549,13 @@ structuredemomsg = visual.TextStim(win,
     pos = [0, -0.1*monitor_height]
 )
 
-rewardstructuredemomsg = visual.TextStim(win,
+rewardstructuredemomsg = stimuli.add('rewardstructuredemomsg', visual.TextStim, win,
     text = 'At Step 2, each option gives you a different chance of winning a reward (again, this is like rolling dice).\n\n' +
     'NOW BEWARE...the dice at this second step will gradually change over time! So the best options early in the game might not be the best later on.\n\n' +
     'Press the "Q" key to continue'
 )
 
-practicetrialsmsg = visual.TextStim(win,
+practicetrialsmsg = stimuli.add('practicetrialsmsg', visual.TextStim, win,
     text = 'We\'ll now do some practice of the game. \n\n' +
            'You\'ll do 50 trials that won\'t count toward your overall rewards. They are just to help familiarize you with the game.\n\n' +
            'Note that there will be time limits at each step. If you respond too slowly, that trial will be aborted and you will see a message asking you to respond faster. Don\'t worry, though, you\'ll still receive a total of 50 practice trials.\n\n' +
@@ -423,12 +563,26 @@ practicetrialsmsg = visual.TextStim(win,
            'Press the "Q" key to continue'
 )
 
-donepracticemsg = visual.TextStim(win,
+donepracticemsg = stimuli.add('donepracticemsg', visual.TextStim, win,
     text = 'Great work!\n\n' +
            'Now that you have familiarized yourself with how the task works, you are ready to perform the real trials.\n\n' +
            'When you are ready to begin, press the "W" key'
 )
 
+# Done task message; the earnings are filled in at the end of the session
+if pay_per_reward is True:
+    donetasktext = ('Great work! You\'ve successfully completed the task!\n\n' +
+                    'Total Earnings: $%(payout)s\n\n' +
+                    'Thank you for participating in our research study.\n\n' +
+                    'Press the "V" key to exit.')
+else:
+    donetasktext = ('Great work! You\'ve successfully completed the task!\n\n' +
+                    'Thank you for participating in our research study.\n\n' +
+                    'Press the "V" key to exit.')
+donetaskmsg = stimuli.addtext('donetaskmsg', donetasktext, visual.TextStim, win)
+
+stimuli.seal() # no visual objects are built from here on
+
 '''
 --------------------------------------------------------------------------------
 
@@ -450,6 +604,9 @@ event.waitKeys()
 '''
 core.wait(1.0)
 
+demoseed = sessionrandom.derivedseed(sessionseed, 1)                 # The demonstration trial has its own draws
+demo     = schedule(demoseed, rewardpaths(demoseed, 1), 1)
+
 # FIRST STEP TRAINING
 trainingstep1msg.draw() #insructions
 win.flip()
@@ -458,9 +615,9 @@ event.waitKeys(keyList=['q'])
 
 drawfixation() #fixation cross
 win.flip()
-core.wait(rnd.exponential(isi))
+core.wait(demo['isi'][0])
 
-tstimorder = drawrect(0, 0, stim=stim, stimtext=stimtext) #stimuli
+tstimorder = drawrect(0, 0, demo['layout'][0, 0], stim=stim, stimtext=stimtext) #stimuli
 ftext.draw()
 jtext.draw()
 makeselection.draw()
@@ -470,7 +627,7 @@ tkeys = event.waitKeys(keyList=['f','j'], timeStamped=True) #record response for
 tstep1key    = tkeys[0][0]
 tstep1choice = key2choice(tstimorder, tkeys[0][0])
 
-tstep2state = transition(tstep1choice) #conduct transition
+tstep2state = int(demo['state'][0, tstep1choice]) #conduct transition
 
 # STEP 2 TRAINING
 animatechoice(0, 0, tstep1choice, stim, stimtext) #animate the choice
@@ -480,7 +637,7 @@ win.flip()
 core.wait(5.0)
 event.waitKeys(keyList=['q'])
 
-tstimorder = drawrect(1, tstep2state, stim=stim, stimtext=stimtext, sel=tstep1choice) # present step 2 stim
+tstimorder = drawrect(1, tstep2state, demo['layout'][0, 1], stim=stim, stimtext=stimtext, sel=tstep1choice) # present step 2 stim
 ftext.draw()
 jtext.draw()
 makeselection.draw()
@@ -515,8 +672,9 @@ core.wait(1.0)
 --------------------------------------------------------------------------------
 '''
 
-paths      = np.zeros([ntrain+1, 4])          # Initialize path array
-paths[0,:] = rnd.uniform(lbound, ubound, 4)    # Set initial reward probabilities
+practiceseed = sessionrandom.derivedseed(sessionseed, 0) # Practice trials use their own draws
+paths = rewardpaths(practiceseed, ntrain)                  # Reward probabilities for all practice trials
+practiceschedule = schedule(practiceseed, paths, ntrain)   # Everything else drawn for the practice trials
 
 t = 0
 while t <= ntrain-1:
@@ -524,21 +682,25 @@ while t <= ntrain-1:
         '''
             INTER-STIMULUS INTERVAL
         '''
+        framelog.setphase('fixation')
         drawfixation()
         win.flip()
-        core.wait(rnd.exponential(isi))
+        with tracer.span('isi'):
+            core.wait(practiceschedule['isi'][t])
 
         '''
             STEP 1
         '''
         # Present stimuli
-        stimorder = drawrect(0, 0, stim=stim, stimtext=stimtext)
+        framelog.setphase('step1')
+        stimorder = drawrect(0, 0, practiceschedule['layout'][t, 0], stim=stim, stimtext=stimtext)
         win.flip()
 
         # Collect response within step time limit
         starttime = core.getTime()
         keys = event.waitKeys(maxWait=tlimitchoice, keyList=['f','j'], timeStamped=True)
         if keys is None:
+            framelog.setphase('other')
             respondfaster.draw()
             win.flip()
             core.wait(2.0)
@@ -553,9 +715,10 @@ while t <= ntrain-1:
         '''
 
         # Conduct the transition
-        step2state = transition(step1choice)
+        step2state = int(practiceschedule['state'][t, step1choice])
 
         # During the transition period, draw the selected Step1 choice above
+        framelog.setphase('transition')
         animatechoice(0, 0, step1choice, stim, stimtext)
         drawselected(0, 0, step1choice, stim, stimtext)
         win.flip()
@@ -565,13 +728,15 @@ while t <= ntrain-1:
             STEP 2
         '''
         # Draw the Step2 Stimuli
-        stimorder = drawrect(1, step2state, stim=stim, stimtext=stimtext, sel=step1choice)
+        framelog.setphase('step2')
+        stimorder = drawrect(1, step2state, practiceschedule['layout'][t, 1], stim=stim, stimtext=stimtext, sel=step1choice)
         win.flip()
 
         # Collect the response
         starttime = core.getTime()
         keys=event.waitKeys(maxWait=tlimitchoice, keyList=['f','j'], timeStamped=True)
         if keys is None:
+            framelog.setphase('other')
             respondfaster.draw()
             win.flip()
             core.wait(2.0)
@@ -585,9 +750,10 @@ while t <= ntrain-1:
             OUTCOME
         '''
         # Compute the reward from reward fuction based on choices
-        reward = rewardfunction(step2state, step2choice, paths[t,:])
+        reward = int(practiceschedule['reward'][t, step2state, step2choice])
 
         # Draw the selected step 2 choice
+        framelog.setphase('outcome')
         animatechoice(1, step2state, step2choice, stim, stimtext)
         drawselected(1, step2state, step2choice, stim, stimtext)
         win.flip()
@@ -607,12 +773,10 @@ while t <= ntrain-1:
         # Reset keys
         keys = None
 
-        # Update the paths
-        paths[t+1,:] = rewardpathupdate(paths[t,:]) # Update reward path
-
         # Increment trial number
         t += 1
 
+framelog.setphase('other')
 donepracticemsg.draw()
 win.flip()
 core.wait(5.0)
@@ -626,10 +790,18 @@ event.waitKeys(keyList=['w'])
 ================================================================================
 '''
 
-#stim, stimtext, rewardicons = initgraphics()             # Initialize the stimuli
+#stim, stimtext, rewardicons, optionimages = initgraphics()             # Initialize the stimuli
 
-paths      = np.zeros([ntrials+1, 4])          # Initialize path array
-paths[0,:] = rnd.uniform(lbound, ubound, 4)    # Set initial reward probabilities
+if os.path.exists(pathbankfile):
+    pathbank = rewardbank.loadbank(pathbankfile)
+    if pathid is None:
+        pathid = sessionseed % pathbank.shape[0]
+    paths = rewardbank.getpath(pathbank, pathid, ntrials) # Reward probabilities for the whole session
+else:
+    pathid = -1
+    paths  = rewardpaths(sessionseed, ntrials)
+
+taskschedule = schedule(sessionseed, paths, ntrials) # Intertrial intervals, layouts, transitions and rewards
 
 choices  = np.zeros([ntrials, 2])
 states   = np.zeros(ntrials)                   # Only one column because step 1 state is always 0
@@ -637,6 +809,10 @@ rewards  = np.zeros(ntrials)
 rt       = np.zeros([ntrials, 2])              # Store reaction times
 keyarray = np.empty([ntrials, 2], dtype='<U1') # Log the keys pressed for choices
 
+estimator = onlineestimate.OnlineEstimator() if adaptivestop else None # Online posterior over w
+westimate = np.full([ntrials, 3], np.nan)       # Posterior mean and credible interval of w after each trial
+stopearly = False
+
 
 '''
 --------------------------------------------------------------------------------
@@ -647,26 +823,30 @@ keyarray = np.empty([ntrials, 2], dtype='<U1') # Log the keys pressed for choice
 '''
 
 t = 0
-while t <= ntrials-1:
+while t <= ntrials-1 and not stopearly:
     for trial in range(t, ntrials):
         '''
             INTER-STIMULUS INTERVAL
         '''
+        framelog.setphase('fixation')
         drawfixation()
         win.flip()
-        core.wait(rnd.exponential(isi))
+        with tracer.span('isi'):
+            core.wait(taskschedule['isi'][t])
 
         '''
             STEP 1
         '''
         # Present stimuli
-        stimorder = drawrect(0, 0, stim=stim, stimtext=stimtext)
+        framelog.setphase('step1')
+        stimorder = drawrect(0, 0, taskschedule['layout'][t, 0], stim=stim, stimtext=stimtext)
         win.flip()
 
         # Collect response within step time limit
         starttime = core.getTime()
         keys = event.waitKeys(maxWait=tlimitchoice, keyList=['f','j'], timeStamped=True)
         if keys is None:
+            framelog.setphase('other')
             respondfaster.draw()
             win.flip()
             core.wait(2.0)
@@ -681,9 +861,10 @@ while t <= ntrials-1:
         '''
 
         # Conduct the transition
-        step2state = transition(step1choice)
+        step2state = int(taskschedule['state'][t, step1choice])
 
         # During the transition period, draw the selected Step1 choice above
+        framelog.setphase('transition')
         animatechoice(0, 0, step1choice, stim, stimtext)
         drawselected(0, 0, step1choice, stim, stimtext)
         win.flip()
@@ -693,13 +874,15 @@ while t <= ntrials-1:
             STEP 2
         '''
         # Draw the Step2 Stimuli
-        stimorder = drawrect(1, step2state, stim=stim, stimtext=stimtext, sel=step1choice)
+        framelog.setphase('step2')
+        stimorder = drawrect(1, step2state, taskschedule['layout'][t, 1], stim=stim, stimtext=stimtext, sel=step1choice)
         win.flip()
 
         # Collect the response
         starttime = core.getTime()
         keys=event.waitKeys(maxWait=tlimitchoice, keyList=['f','j'], timeStamped=True)
         if keys is None:
+            framelog.setphase('other')
             respondfaster.draw()
             win.flip()
             core.wait(2.0)
@@ -713,9 +896,10 @@ while t <= ntrials-1:
             OUTCOME
         '''
         # Compute the reward from reward fuction based on choices
-        reward = rewardfunction(step2state, step2choice, paths[t,:])
+        reward = int(taskschedule['reward'][t, step2state, step2choice])
 
         # Draw the selected step 2 choice
+        framelog.setphase('outcome')
         animatechoice(1, step2state, step2choice, stim, stimtext)
         drawselected(1, step2state, step2choice, stim, stimtext)
         win.flip()
@@ -735,9 +919,6 @@ while t <= ntrials-1:
         # Reset keys
         keys = None
 
-        # Update the paths
-        paths[t+1,:] = rewardpathupdate(paths[t,:]) # Update reward path
-
         # Add to data arrays
         states[t]     = step2state
         choices[t,:]  = np.array([step1choice, step2choice])
@@ -746,9 +927,20 @@ while t <= ntrials-1:
         keyarray[t,0] = step1key
         keyarray[t,1] = step2key
 
+        # Update the online estimate of w (only needed for adaptive stopping)
+        if estimator is not None:
+            estimator.update(step1choice, step2state, step2choice, reward)
+            westimate[t,0]  = estimator.wmean()
+            westimate[t,1:] = estimator.credibleinterval()
+
         # Increment trial number
         t += 1
 
+        # Stop once w is estimated precisely enough
+        if adaptivestop and estimator.done(ciwidthtarget, nminimumtrials):
+            stopearly = True
+            break
+
 '''
 ================================================================================
 
@@ -757,22 +949,57 @@ while t <= ntrials-1:
 ================================================================================
 '''
 
+ncompleted = t # fewer than ntrials if the session stopped early
+framelog.setphase('other')
+
 # Create data frame
 data = pd.DataFrame({
     'subject_id': subject_id,
-    'step2state': states,
-    'choice1'   : choices[:, 0],
-    'choice2'   : choices[:, 1],
-    'reward'    : rewards,
-    'rt_step1'  : rt[:,0],
-    'rt_step2'  : rt[:,1],
-    'key_step1' : keyarray[:,0],
-    'key_step2' : keyarray[:,1]
+    'step2state': states[:ncompleted],
+    'choice1'   : choices[:ncompleted, 0],
+    'choice2'   : choices[:ncompleted, 1],
+    'reward'    : rewards[:ncompleted],
+    'rt_step1'  : rt[:ncompleted,0],
+    'rt_step2'  : rt[:ncompleted,1],
+    'key_step1' : keyarray[:ncompleted,0],
+    'key_step2' : keyarray[:ncompleted,1],
+    'path_id'   : pathid,
+    'session_seed': sessionseed
 })
 
 # Write to csv
 data.to_csv('data_' + subject_id + '.csv', sep='\t', encoding='utf-8', index=False)
 
+# Online estimate of w after each trial (only computed for adaptive stopping)
+if estimator is not None:
+    online = pd.DataFrame({
+        'subject_id': subject_id,
+        'trial'     : np.arange(1, ncompleted+1),
+        'w_mean'    : westimate[:ncompleted,0],
+        'w_ci_low'  : westimate[:ncompleted,1],
+        'w_ci_high' : westimate[:ncompleted,2]
+    })
+    online.to_csv('online_' + subject_id + '.csv', sep='\t', encoding='utf-8', index=False)
+
+# Everything drawn for the session, for auditing
+pd.concat([sessionschedule.scheduletable(practiceschedule, 'practice'),
+           sessionschedule.scheduletable(taskschedule, 'task')]).to_csv(
+    'schedule_' + subject_id + '.csv', sep='\t', encoding='utf-8', index=False)
+
+# Every flip of the session, and frame intervals and dropped frames per phase
+framelog.write('frames_' + subject_id)
+
+# Time spent in drawing functions, flips and key waits (if tracespans)
+tracer.write('trace_' + subject_id)
+
+# Memory retained per phase and growth per trial (if trackallocations)
+if trackallocations:
+    allocmonitor.stop()
+    allocmonitor.write('allocations_' + subject_id)
+
+# Build time and memory of every stimulus
+stimuli.write('stimuli_' + subject_id + '.csv')
+
 '''
 ================================================================================
 
@@ -783,20 +1010,9 @@ data.to_csv('data_' + subject_id + '.csv', sep='\t', encoding='utf-8', index=Fal
 
 if pay_per_reward is True:
     payout = np.round(val_reward * np.sum(rewards), 2)
-
-    # Done task message
-    donetaskmsg = visual.TextStim(win,
-        text='Great work! You\'ve successfully completed the task!\n\n' +
-        'Total Earnings: $' + str(payout) + '\n\n' +
-        'Thank you for participating in our research study.\n\n' +
-        'Press the "V" key to exit.'
-    )
+    stimuli.settext('donetaskmsg', payout=str(payout))
 else:
-    donetaskmsg = visual.TextStim(win,
-        text='Great work! You\'ve successfully completed the task!\n\n' +
-        'Thank you for participating in our research study.\n\n' +
-        'Press the "V" key to exit.'
-    )
+    stimuli.settext('donetaskmsg')
 
 donetaskmsg.draw()
 win.flip()
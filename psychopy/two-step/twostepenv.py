@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import numpy as np
+
+import twostepsim
+import sessionrandom
+
+'''
+================================================================================
+
+    BATCHED TWO-STEP ENVIRONMENT
+
+    Steps B independent copies of the two-step task at once, using the task
+    logic of twostep.py (transitions, rewards and reward paths) on
+    arrays. All randomness comes from sessionrandom.py, so a copy reset with
+    seed k produces the same step 2 states, rewards and reward paths as an
+    interactive session run with sessionseed = k and the same choices.
+
+    Each trial takes two calls to step: the first takes step 1 choices and
+    returns the step 2 states, the second takes step 2 choices and returns
+    the rewards. Observations are 0 at step 1, and 1 + state at step 2.
+
+================================================================================
+'''
+
+class TwoStepEnv(object):
+    def __init__(self, ntrials=twostepsim.ntrials, lbound=twostepsim.lbound, ubound=twostepsim.ubound,
+                 sd=twostepsim.sdrewardpath, ptrans=twostepsim.ptrans, bankfile=None):
+        self.ntrials = ntrials
+        self.lbound  = lbound
+        self.ubound  = ubound
+        self.sd      = sd
+        self.ptrans  = np.asarray(ptrans, dtype=float)
+
+        # With a reward path bank, a copy with seed k uses path k modulo the bank size (as in twostep.py)
+        self.bank = None
+        if bankfile is not None:
+            self.bank = np.load(bankfile, mmap_mode='r')
+
+    # Start a new session in every copy. Returns the step 1 observations.
+    def reset(self, seeds, pathids=None):
+        self.seeds = np.asarray(seeds, dtype=np.uint64)
+        nenvs = len(self.seeds)
+
+        self.pathids = np.full(nenvs, -1)
+        if self.bank is not None:
+            if pathids is None:
+                self.pathids = (self.seeds % np.uint64(self.bank.shape[0])).astype(int)
+            else:
+                self.pathids = np.asarray(pathids)
+            self.paths = np.array(self.bank[self.pathids, 0], dtype=float)
+        else:
+            self.paths = sessionrandom.pathstart(self.seeds, self.lbound, self.ubound)
+
+        self.t     = 0
+        self.stage = 0
+
+        # Trial data, laid out as in twostep.py
+        self.choices = np.zeros([nenvs, self.ntrials, 2], dtype=np.int8)
+        self.states  = np.zeros([nenvs, self.ntrials], dtype=np.int8)
+        self.rewards = np.zeros([nenvs, self.ntrials], dtype=np.int8)
+
+        return np.zeros(nenvs, dtype=np.int8)
+
+    # Apply one choice (0 or 1) per copy. Returns (observations, rewards, done, info).
+    def step(self, actions):
+        if self.t >= self.ntrials:
+            raise RuntimeError('All sessions are done; call reset first')
+        actions = np.asarray(actions).astype(np.int8)
+        t = self.t
+
+        if self.stage == 0:
+            u = sessionrandom.uniform(self.seeds, sessionrandom.TRANSITION, t)
+            state = twostepsim.transition(actions, u, self.ptrans)
+            self.choices[:, t, 0] = actions
+            self.states[:, t] = state
+            self.stage = 1
+            obs = 1 + state
+            reward = np.zeros(len(actions), dtype=np.int8)
+            done = np.zeros(len(actions), dtype=bool)
+            info = {'trial': t, 'common': state == actions}
+        else:
+            state = self.states[:, t]
+            u = sessionrandom.uniform(self.seeds, sessionrandom.REWARD, t)
+            reward = twostepsim.rewardfunction(state, actions, self.paths, u)
+            self.choices[:, t, 1] = actions
+            self.rewards[:, t] = reward
+
+            # Update the reward paths
+            if self.bank is not None:
+                self.paths = np.array(self.bank[self.pathids, t+1], dtype=float)
+            else:
+                self.paths = sessionrandom.pathstep(self.paths, self.seeds, t, self.lbound, self.ubound, self.sd)
+
+            self.t += 1
+            self.stage = 0
+            obs = np.zeros(len(actions), dtype=np.int8)
+            done = np.full(len(actions), self.t >= self.ntrials)
+            info = {'trial': t}
+
+        return obs, reward, done, info
+
+    # Trial data collected so far, as the arrays twostep.py builds
+    def data(self):
+        return {
+            'choices': self.choices[:, :self.t],
+            'states' : self.states[:, :self.t],
+            'rewards': self.rewards[:, :self.t],
+            'path_id': self.pathids,
+            'seed'   : self.seeds
+        }
+
+'''
+================================================================================
+
+    THROUGHPUT CHECK
+
+================================================================================
+'''
+
+if __name__ == '__main__':
+    nenvs = 10000
+    env = TwoStepEnv()
+    rng = np.random.default_rng(0)
+
+    starttime = time.time()
+    obs = env.reset(np.arange(nenvs))
+    for t in range(env.ntrials):
+        for stage in range(2):
+            obs, reward, done, info = env.step(rng.integers(0, 2, nenvs))
+    elapsed = time.time() - starttime
+    print('%d copies x %d trials: %.2f s, %.2g steps per second' %
+          (nenvs, env.ntrials, elapsed, 2*nenvs*env.ntrials/elapsed))
@@ -0,0 +1,461 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import glob
+import argparse
+import threading
+import pandas as pd
+import numpy as np
+from multiprocessing import Pool
+from scipy.optimize import minimize
+
+import twostepsim
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+import fitcache
+
+'''
+================================================================================
+
+    MAXIMUM-LIKELIHOOD FITTING OF THE TWO-STEP TASK
+
+    Fits the hybrid model-based/model-free model (Daw et al. 2011) to the
+    data_<id>.csv files written by twostep.py. Subjects are spread across a
+    process pool and each is fitted from several random starting points.
+
+================================================================================
+'''
+
+paramnames = twostepsim.paramnames
+
+# Name and version of the model, used as part of the fit cache key.
+# Increase modelversion whenever a change to this file alters the fits.
+modelname = 'twostep-hybrid'
+modelversion = 1
+
+# Bounds used by the optimizer, in the order of paramnames
+bounds = [(0, 1),    # alpha
+          (0, 20),   # beta1
+          (0, 20),   # beta2
+          (0, 1),    # lambda
+          (0, 1),    # w
+          (-5, 5)]   # perseveration
+
+# Range of the random starting points of each restart
+initbounds = [(0.1, 0.9),
+              (1, 10),
+              (1, 10),
+              (0.1, 0.9),
+              (0.1, 0.9),
+              (-0.5, 0.5)]
+
+'''
+================================================================================
+
+    DATA
+
+================================================================================
+'''
+
+# Read a task output file into the arrays that twostep.py builds (choices, states, rewards)
+def readdata(filename):
+    data = pd.read_csv(filename, sep='\t', encoding='utf-8', dtype={'subject_id': str})
+    data = data.dropna(subset=['step2state', 'choice1', 'choice2', 'reward'])
+
+    choices = data[['choice1', 'choice2']].values.astype(int)
+    states  = data['step2state'].values.astype(int)
+    rewards = data['reward'].values.astype(float)
+
+    if 'subject_id' in data and len(data) > 0:
+        subject_id = data['subject_id'].iloc[0]
+    else:
+        subject_id = os.path.splitext(os.path.basename(filename))[0].replace('data_', '', 1)
+
+    return subject_id, choices, states, rewards
+
+'''
+================================================================================
+
+    LIKELIHOOD
+
+================================================================================
+'''
+
+# Choices, state and reward on trial t, as scalars (one shared session) or arrays (one session per set)
+def trialdata(choices, states, rewards, t):
+    if np.ndim(states) == 2:
+        return choices[:, t, 0], choices[:, t, 1], states[:, t], rewards[:, t]
+    return choices[t, 0], choices[t, 1], states[t], rewards[t]
+
+# Index of the parameter sets along the first axis: a plain slice when all
+# sets share one session, which keeps the single-session recursion fast
+def setindex(states, nsets):
+    if np.ndim(states) == 2:
+        return np.arange(nsets)
+    return slice(None)
+
+# Log-likelihood of one trial's choices for every parameter set (sets x 6).
+#   q1, q2 hold the current Q-values and are updated in place; prev is +1/-1
+#   if the previous step 1 choice was option 1/0 (0 on the first trial).
+def trialloglik(params, q1, q2, prev, a, b, s, r, rows=slice(None), ptrans=twostepsim.ptrans):
+    alpha, beta1, beta2, lamb, w, pers = params.T
+
+    # Step 1 choice probability
+    qmax = q2.max(axis=2)
+    qmb  = (1 - ptrans)*qmax[:, [0]] + ptrans*qmax[:, [1]]
+    qnet = w[:, None]*qmb + (1 - w[:, None])*q1
+    x1 = beta1*(qnet[:, 1] - qnet[:, 0] + pers*prev)
+    ll = -np.logaddexp(0, -(2*a - 1)*x1)
+
+    # Step 2 choice probability
+    x2 = beta2*(q2[rows, s, 1] - q2[rows, s, 0])
+    ll -= np.logaddexp(0, -(2*b - 1)*x2)
+
+    # SARSA(lambda) updates
+    delta1 = q2[rows, s, b] - q1[rows, a]
+    q1[rows, a] += alpha*delta1
+    delta2 = r - q2[rows, s, b]
+    q2[rows, s, b] += alpha*delta2
+    q1[rows, a] += alpha*lamb*delta2
+
+    return ll
+
+# Log-likelihood of one subject's choices.
+#   params is one parameter set or a batch shaped (sets x 6); the recursion
+#   runs over trials with every parameter set updated at once. The data are
+#   either one session (choices shaped trials x 2, states and rewards shaped
+#   trials) shared by all sets, or one session per set (sets x trials x 2 and
+#   sets x trials). Returns an array with one log-likelihood per parameter set.
+def loglik(params, choices, states, rewards, ptrans=twostepsim.ptrans):
+    params = np.atleast_2d(np.asarray(params, dtype=float))
+    nsets = params.shape[0]
+
+    q1 = np.zeros([nsets, 2])
+    q2 = np.zeros([nsets, 2, 2])
+    prev = 0.0
+    ll = np.zeros(nsets)
+    rows = setindex(states, nsets)
+
+    for t in range(np.shape(states)[-1]):
+        a, b, s, r = trialdata(choices, states, rewards, t)
+        ll += trialloglik(params, q1, q2, prev, a, b, s, r, rows, ptrans)
+        prev = 2.0*a - 1
+
+    return ll
+
+# Negative log-likelihood of a single parameter set (for the optimizer)
+def negloglik(params, choices, states, rewards):
+    return -loglik(params, choices, states, rewards)[0]
+
+# Log-likelihood and its exact gradient with respect to every parameter.
+#   The derivatives of the Q-values are carried forward alongside the
+#   Q-value updates (forward-mode accumulation), so one pass over the trials
+#   gives both. Where two step 2 values are tied, the derivative of their
+#   maximum follows the first option. Data are laid out as for loglik.
+#   Returns (ll, grad) shaped (sets,) and (sets x 6).
+def loglikgrad(params, choices, states, rewards, ptrans=twostepsim.ptrans):
+    params = np.atleast_2d(np.asarray(params, dtype=float))
+    nsets, nparams = params.shape
+    alpha, beta1, beta2, lamb, w, pers = params.T
+    e = np.eye(nparams) # unit vectors: derivative of each parameter with respect to the parameters
+
+    q1  = np.zeros([nsets, 2])
+    q2  = np.zeros([nsets, 2, 2])
+    dq1 = np.zeros([nsets, 2, nparams])
+    dq2 = np.zeros([nsets, 2, 2, nparams])
+    prev = 0.0
+    ll   = np.zeros(nsets)
+    grad = np.zeros([nsets, nparams])
+    sets = np.arange(nsets)
+    rows = setindex(states, nsets)
+
+    for t in range(np.shape(states)[-1]):
+        a, b, s, r = trialdata(choices, states, rewards, t)
+        sign1, sign2 = 2*a - 1, 2*b - 1
+
+        # Step 1 choice probability
+        best  = q2.argmax(axis=2)
+        qmax  = q2.max(axis=2)
+        dqmax = dq2[sets[:, None], [0, 1], best]
+        qmb   = (1 - ptrans)*qmax[:, [0]] + ptrans*qmax[:, [1]]
+        dqmb  = (1 - ptrans)[:, None]*dqmax[:, [0], :] + ptrans[:, None]*dqmax[:, [1], :]
+        qnet  = w[:, None]*qmb + (1 - w[:, None])*q1
+        dqnet = w[:, None, None]*dqmb + (1 - w[:, None, None])*dq1 + (qmb - q1)[:, :, None]*e[4]
+
+        d1  = qnet[:, 1] - qnet[:, 0] + pers*prev
+        dd1 = dqnet[:, 1] - dqnet[:, 0] + np.multiply.outer(prev, e[5])
+        x1  = beta1*d1
+        ll   -= np.logaddexp(0, -sign1*x1)
+        grad += (sign1*twostepsim.logistic(-sign1*x1))[:, None]*(beta1[:, None]*dd1 + d1[:, None]*e[1])
+
+        # Step 2 choice probability
+        d2  = q2[rows, s, 1] - q2[rows, s, 0]
+        dd2 = dq2[rows, s, 1] - dq2[rows, s, 0]
+        x2  = beta2*d2
+        ll   -= np.logaddexp(0, -sign2*x2)
+        grad += (sign2*twostepsim.logistic(-sign2*x2))[:, None]*(beta2[:, None]*dd2 + d2[:, None]*e[2])
+
+        # SARSA(lambda) updates and their derivatives
+        delta1  = q2[rows, s, b] - q1[rows, a]
+        ddelta1 = dq2[rows, s, b] - dq1[rows, a]
+        q1[rows, a]  += alpha*delta1
+        dq1[rows, a] += alpha[:, None]*ddelta1 + delta1[:, None]*e[0]
+
+        delta2  = r - q2[rows, s, b]
+        ddelta2 = -dq2[rows, s, b]
+        q2[rows, s, b]  += alpha*delta2
+        dq2[rows, s, b] += alpha[:, None]*ddelta2 + delta2[:, None]*e[0]
+        q1[rows, a]  += alpha*lamb*delta2
+        dq1[rows, a] += (alpha*lamb)[:, None]*ddelta2 + delta2[:, None]*(lamb[:, None]*e[0] + alpha[:, None]*e[3])
+
+        prev = 2.0*a - 1
+
+    return ll, grad
+
+# Negative log-likelihood and its gradient for a single parameter set (for the optimizer)
+def negloglikgrad(params, choices, states, rewards):
+    ll, grad = loglikgrad(params, choices, states, rewards)
+    return -ll[0], -grad[0]
+
+# Log-likelihood of many parameter sets (points x 6), evaluated chunksize
+# points at a time so that memory stays bounded
+def batchloglik(points, choices, states, rewards, chunksize=20000):
+    points = np.atleast_2d(points)
+    ll = np.empty(points.shape[0])
+    for start in range(0, points.shape[0], chunksize):
+        ll[start:start+chunksize] = loglik(points[start:start+chunksize], choices, states, rewards)
+    return ll
+
+# Parameter sets for the flat indices [start, stop) of the grid spanned by axes
+def gridpoints(axes, start, stop):
+    shape = [len(axis) for axis in axes]
+    index = np.unravel_index(np.arange(start, stop), shape)
+    return np.column_stack([np.asarray(axis, dtype=float)[i] for axis, i in zip(axes, index)])
+
+# Log-likelihood over the full grid spanned by axes (one array of values per
+# parameter, in the order of paramnames; use a single value to hold a
+# parameter fixed). Grid points are generated chunksize at a time and never
+# stored, so a 10^6 point grid only needs memory for the result. Returns an
+# array shaped like the grid.
+def gridloglik(axes, choices, states, rewards, chunksize=20000):
+    axes  = [np.atleast_1d(axis) for axis in axes]
+    shape = [len(axis) for axis in axes]
+    npoints = int(np.prod(shape))
+
+    ll = np.empty(npoints)
+    for start in range(0, npoints, chunksize):
+        stop = min(start + chunksize, npoints)
+        ll[start:stop] = loglik(gridpoints(axes, start, stop), choices, states, rewards)
+    return ll.reshape(shape)
+
+# Parameter set at the maximum of a grid log-likelihood (e.g., as a starting value)
+def gridmax(axes, ll):
+    axes = [np.atleast_1d(axis) for axis in axes]
+    best = int(np.argmax(ll))
+    return gridpoints(axes, best, best + 1)[0]
+
+'''
+================================================================================
+
+    FITTING
+
+================================================================================
+'''
+
+# Fit one subject from nrestarts random starting points and keep the best fit.
+#   Any starting points in starts (e.g., from gridmax) are tried as well. With
+#   gradient=False the optimizer uses finite differences instead of loglikgrad.
+def fitsubject(choices, states, rewards, nrestarts=5, rng=None, starts=(), gradient=True):
+    if rng is None:
+        rng = np.random.default_rng()
+
+    lower, upper = np.array(initbounds).T
+    x0s = list(starts) + [rng.uniform(lower, upper) for restart in range(nrestarts)]
+    best = None
+    for x0 in x0s:
+        if gradient:
+            res = minimize(negloglikgrad, x0, args=(choices, states, rewards),
+                           method='L-BFGS-B', jac=True, bounds=bounds)
+        else:
+            res = minimize(negloglik, x0, args=(choices, states, rewards),
+                           method='L-BFGS-B', bounds=bounds)
+        if best is None or res.fun < best.fun:
+            best = res
+
+    return fitresult(best, len(states))
+
+# Fitted parameters and fit statistics from the best optimizer result
+def fitresult(best, ntrials):
+    nobs = 2*ntrials # two choices per trial
+    fit = dict(zip(paramnames, best.x))
+    fit['nll'] = best.fun
+    fit['bic'] = 2*best.fun + len(paramnames)*np.log(nobs)
+    fit['ntrials'] = ntrials
+    fit['converged'] = bool(best.success)
+    return fit
+
+# Negative log-likelihood and gradient for many optimizers at once. Each
+# optimizer runs in its own thread with its own session (row i of the data)
+# and calls objective(x, i). Calls wait until every running optimizer has
+# submitted a point, and the last one to arrive evaluates all of them with
+# one batched loglikgrad. Call done() when an optimizer finishes.
+class LockstepObjective(object):
+    def __init__(self, choices, states, rewards):
+        self.choices   = choices
+        self.states    = states
+        self.rewards   = rewards
+        self.condition = threading.Condition()
+        self.nrunning  = len(states)
+        self.points    = {}
+        self.results   = {}
+        self.error     = None
+
+    def evaluate(self):
+        sets = sorted(self.points)
+        try:
+            ll, grad = loglikgrad(np.array([self.points[i] for i in sets]),
+                                  self.choices[sets], self.states[sets], self.rewards[sets])
+            for k, i in enumerate(sets):
+                self.results[i] = (-ll[k], -grad[k])
+        except Exception as error:
+            self.error = error
+        self.points.clear()
+        self.condition.notify_all()
+
+    def __call__(self, x, i):
+        with self.condition:
+            self.points[i] = np.array(x, dtype=float)
+            if len(self.points) == self.nrunning:
+                self.evaluate()
+            while i not in self.results and self.error is None:
+                self.condition.wait()
+            if self.error is not None:
+                raise self.error
+            return self.results.pop(i)
+
+    def done(self):
+        with self.condition:
+            self.nrunning -= 1
+            if self.points and len(self.points) == self.nrunning:
+                self.evaluate()
+
+# Fit many sessions of equal length (choices shaped subjects x trials x 2,
+# states and rewards subjects x trials) with every restart of every subject
+# optimized in lockstep, so each optimizer step costs one batched likelihood
+# evaluation for all of them instead of one each. Starting points are drawn
+# as fitsubject draws them, subject by subject, and each restart is the same
+# L-BFGS-B run, so the fits match calling fitsubject on each subject in turn
+# with the same rng. Returns one fit per subject.
+def fitbatch(choices, states, rewards, nrestarts=5, rng=None):
+    if rng is None:
+        rng = np.random.default_rng()
+
+    nsubjects = len(states)
+    lower, upper = np.array(initbounds).T
+    x0s = [rng.uniform(lower, upper) for i in range(nsubjects) for restart in range(nrestarts)]
+    subject = np.repeat(np.arange(nsubjects), nrestarts)
+    objective = LockstepObjective(choices[subject], states[subject], rewards[subject])
+
+    results = [None]*len(x0s)
+    def run(k):
+        try:
+            results[k] = minimize(objective, x0s[k], args=(k,), method='L-BFGS-B', jac=True, bounds=bounds)
+        finally:
+            objective.done()
+
+    threads = [threading.Thread(target=run, args=(k,)) for k in range(len(x0s))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if objective.error is not None:
+        raise objective.error
+
+    fits = []
+    for i in range(nsubjects):
+        best = None
+        for res in results[i*nrestarts:(i+1)*nrestarts]:
+            if best is None or res.fun < best.fun:
+                best = res
+        fits.append(fitresult(best, np.shape(states)[1]))
+    return fits
+
+# Fit one file (run inside a worker process)
+def fitfile(job):
+    filename, nrestarts, seed = job
+    subject_id, choices, states, rewards = readdata(filename)
+    fit = fitsubject(choices, states, rewards, nrestarts, np.random.default_rng(seed))
+    fit['subject_id'] = subject_id
+    return fit
+
+# Fit many files across a process pool and return one row of parameters per subject.
+#   Each file's restarts are seeded from seed and the file's contents, so a
+#   fit does not depend on which other files are in the batch. If a
+#   fitcache.FitCache is given, files whose contents and fit settings are
+#   unchanged are read from the cache instead of being refitted.
+def fitfiles(filenames, nrestarts=5, seed=0, nworkers=None, cache=None):
+    filenames = sorted(filenames)
+    digests   = [fitcache.filedigest(f) for f in filenames]
+    settings  = {'nrestarts': nrestarts, 'seed': seed, 'bounds': bounds, 'initbounds': initbounds}
+    keys      = [fitcache.cachekey(d, modelname, modelversion, settings) for d in digests]
+
+    fits = [None]*len(filenames)
+    if cache is not None:
+        fits = [cache.get(key) for key in keys]
+
+    todo = [i for i in range(len(filenames)) if fits[i] is None]
+    jobs = [(filenames[i], nrestarts, np.random.SeedSequence([seed, int(digests[i][:15], 16)]))
+            for i in todo]
+
+    if nworkers == 1 or len(jobs) <= 1:
+        newfits = [fitfile(job) for job in jobs]
+    else:
+        pool = Pool(nworkers)
+        try:
+            newfits = pool.map(fitfile, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    for i, fit in zip(todo, newfits):
+        fits[i] = fit
+        if cache is not None:
+            cache.put(keys[i], fit)
+
+    fits = [dict(fit, file=f) for fit, f in zip(fits, filenames)]
+
+    columns = ['subject_id'] + paramnames + ['nll', 'bic', 'ntrials', 'converged', 'file']
+    return pd.DataFrame(fits, columns=columns)
+
+'''
+================================================================================
+
+    RUN FITS
+
+================================================================================
+'''
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fit the hybrid model to two-step data files.')
+    parser.add_argument('files', nargs='*', default=['data_*.csv'], help='data files or glob patterns')
+    parser.add_argument('--nrestarts', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--nworkers', type=int, default=None)
+    parser.add_argument('--output', default='fits.csv')
+    parser.add_argument('--cache', default='.fitcache', help='fit cache directory')
+    parser.add_argument('--cachesize', type=float, default=500, help='fit cache size limit in MB')
+    parser.add_argument('--nocache', action='store_true', help='refit every file')
+    args = parser.parse_args()
+
+    cache = None
+    if not args.nocache:
+        cache = fitcache.FitCache(args.cache, int(args.cachesize*2**20))
+
+    filenames = sorted(set(f for pattern in args.files for f in glob.glob(pattern)))
+    fits = fitfiles(filenames, args.nrestarts, args.seed, args.nworkers, cache)
+    fits.to_csv(args.output, sep='\t', encoding='utf-8', index=False)
+
+    if cache is not None:
+        print(cache.report())
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import argparse
+import pandas as pd
+import numpy as np
+from multiprocessing import Pool
+
+'''
+================================================================================
+
+    HEADLESS SIMULATION OF THE TWO-STEP TASK
+
+    Runs hybrid model-based/model-free agents (Daw et al. 2011) through the
+    task dynamics of twostep.py. Every quantity is an array shaped
+    (subjects x trials), so the only Python loop is over trials.
+
+================================================================================
+'''
+
+'''
+================================================================================
+
+    TASK PARAMETERS (same defaults as twostep.py)
+
+================================================================================
+'''
+
+ntrials = 201 # number of trials to complete
+
+lbound = 0.25 # lower bound on reward probabilities
+ubound = 0.75 # upper bound on reward probabilities
+sdrewardpath = 0.025 # SD of the Gaussian process for reward probabilities
+
+ptrans = np.array([0.3, 0.7]) # probability of reaching step 2 state 1 for each step 1 choice
+
+# Order of the model parameters in every parameter array
+paramnames = ['alpha', 'beta1', 'beta2', 'lambda', 'w', 'perseveration']
+
+# Column layout of the task's output file
+datacolumns = ['subject_id', 'step2state', 'choice1', 'choice2', 'reward',
+               'rt_step1', 'rt_step2', 'key_step1', 'key_step2', 'path_id', 'session_seed']
+
+'''
+================================================================================
+
+    TASK DYNAMICS
+
+================================================================================
+'''
+
+# Logistic function written with tanh so that large arguments do not overflow
+def logistic(x):
+    return 0.5*(1 + np.tanh(0.5*x))
+
+# Transition function, vectorized over subjects (u are uniform draws)
+def transition(sel, u, ptrans=ptrans):
+    return (u < ptrans[sel]).astype(np.int8)
+
+# Update reward probabilities for every subject at once (paths has 4 as its last axis)
+def rewardpathupdate(paths, rng, lbound=lbound, ubound=ubound, sd=sdrewardpath):
+    return np.maximum(np.minimum(paths + sd*rng.normal(0, 1, np.shape(paths)), ubound), lbound)
+
+# Generate reward probability random walks, shaped (subjects x trials+1 x 4)
+def rewardpaths(nsubjects, ntrials=ntrials, rng=None, lbound=lbound, ubound=ubound, sd=sdrewardpath):
+    if rng is None:
+        rng = np.random.default_rng()
+
+    paths = np.empty([nsubjects, ntrials+1, 4])
+    paths[:, 0, :] = rng.uniform(lbound, ubound, [nsubjects, 4])
+    for t in range(ntrials):
+        paths[:, t+1, :] = rewardpathupdate(paths[:, t, :], rng, lbound, ubound, sd)
+    return paths
+
+# Sample reward, vectorized over subjects (paths holds the current probabilities, shaped subjects x 4)
+def rewardfunction(state, choice, paths, u):
+    rprob = paths[np.arange(len(state)), 2*state + choice]
+    return (u < rprob).astype(np.int8)
+
+'''
+================================================================================
+
+    AGENTS
+
+================================================================================
+'''
+
+# Draw a cohort of plausible parameter sets, shaped (subjects x parameters)
+def sampleparams(nsubjects, rng=None):
+    if rng is None:
+        rng = np.random.default_rng()
+
+    params = np.empty([nsubjects, len(paramnames)])
+    params[:, 0] = rng.uniform(0.05, 0.95, nsubjects) # alpha
+    params[:, 1] = rng.gamma(3.0, 1.5, nsubjects)     # beta1
+    params[:, 2] = rng.gamma(3.0, 1.5, nsubjects)     # beta2
+    params[:, 3] = rng.uniform(0, 1, nsubjects)       # lambda
+    params[:, 4] = rng.uniform(0, 1, nsubjects)       # w
+    params[:, 5] = rng.normal(0.1, 0.15, nsubjects)   # perseveration
+    return params
+
+# Run hybrid MB/MF agents through the task.
+#   params are shaped (subjects x 6), in the order of paramnames. If paths is
+#   given (trials+1 x 4, or subjects x trials+1 x 4) those reward
+#   probabilities are used instead of freshly generated ones, and pathids
+#   records which rows of a reward path bank they came from.
+def simulate(params, ntrials=ntrials, rng=None, paths=None, pathids=None,
+             lbound=lbound, ubound=ubound, sd=sdrewardpath, ptrans=ptrans):
+    if rng is None:
+        rng = np.random.default_rng()
+
+    params = np.atleast_2d(np.asarray(params, dtype=float))
+    nsubjects = params.shape[0]
+    alpha, beta1, beta2, lamb, w, pers = params.T
+
+    if paths is None:
+        paths = rewardpaths(nsubjects, ntrials, rng, lbound, ubound, sd)
+    else:
+        paths = np.broadcast_to(paths, (nsubjects, ntrials+1, 4))
+
+    if pathids is None:
+        pathids = np.full(nsubjects, -1)
+
+    rows = np.arange(nsubjects)
+    q1 = np.zeros([nsubjects, 2])     # model-free values of the step 1 options
+    q2 = np.zeros([nsubjects, 2, 2])  # values of the step 2 options, by state
+    prev = np.zeros(nsubjects)        # +1/-1 if the previous step 1 choice was option 1/0
+
+    states  = np.empty([nsubjects, ntrials], dtype=np.int8)
+    choice1 = np.empty([nsubjects, ntrials], dtype=np.int8)
+    choice2 = np.empty([nsubjects, ntrials], dtype=np.int8)
+    rewards = np.empty([nsubjects, ntrials], dtype=np.int8)
+
+    for t in range(ntrials):
+        # Step 1 choice from the weighted model-based and model-free values
+        qmax = q2.max(axis=2)
+        qmb  = (1 - ptrans)*qmax[:, [0]] + ptrans*qmax[:, [1]]
+        qnet = w[:, None]*qmb + (1 - w[:, None])*q1
+        p1 = logistic(beta1*(qnet[:, 1] - qnet[:, 0] + pers*prev))
+        a  = (rng.random(nsubjects) < p1).astype(np.int8)
+
+        s = transition(a, rng.random(nsubjects), ptrans)
+
+        # Step 2 choice
+        p2 = logistic(beta2*(q2[rows, s, 1] - q2[rows, s, 0]))
+        b  = (rng.random(nsubjects) < p2).astype(np.int8)
+
+        r = rewardfunction(s, b, paths[:, t, :], rng.random(nsubjects))
+
+        # SARSA(lambda) updates
+        delta1 = q2[rows, s, b] - q1[rows, a]
+        q1[rows, a] += alpha*delta1
+        delta2 = r - q2[rows, s, b]
+        q2[rows, s, b] += alpha*delta2
+        q1[rows, a] += alpha*lamb*delta2
+
+        prev = 2.0*a - 1
+
+        states[:, t]  = s
+        choice1[:, t] = a
+        choice2[:, t] = b
+        rewards[:, t] = r
+
+    # Left/right layouts, as shuffled by drawrect (1 means option 1 was on the left)
+    layout = rng.random([nsubjects, ntrials, 2]) < 0.5
+
+    return {
+        'step2state': states,
+        'choice1'   : choice1,
+        'choice2'   : choice2,
+        'reward'    : rewards,
+        'layout'    : layout,
+        'paths'     : np.array(paths),
+        'path_id'   : np.broadcast_to(pathids, (nsubjects,)).astype(int)
+    }
+
+'''
+================================================================================
+
+    PARALLEL EXECUTION
+
+================================================================================
+'''
+
+# Accept either an integer seed (or None) or an existing SeedSequence
+def seedsequence(seed):
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+# Simulate one chunk of subjects (run inside a worker process)
+def simulatechunk(job):
+    params, ntrials, seed, bankfile, pathids = job
+    paths = None
+    if bankfile is not None:
+        paths = np.array(np.load(bankfile, mmap_mode='r')[pathids, :ntrials+1], dtype=float)
+    return simulate(params, ntrials, rng=np.random.default_rng(seed), paths=paths, pathids=pathids)
+
+# Simulate a cohort, spreading chunks of subjects across a process pool.
+#   Each chunk gets its own child seed, so results depend on the seed and
+#   chunksize but not on the number of workers. If bankfile is given, subject
+#   i uses reward path pathids[i] of that bank (see rewardbank.py), and each
+#   worker reads only the rows it needs from the memory-mapped file.
+def simulatecohort(params, ntrials=ntrials, seed=None, nworkers=None, chunksize=1000,
+                   bankfile=None, pathids=None):
+    params = np.atleast_2d(np.asarray(params, dtype=float))
+    starts = range(0, params.shape[0], chunksize)
+    seeds  = seedsequence(seed).spawn(len(starts))
+    if bankfile is not None and pathids is None:
+        pathids = np.arange(params.shape[0])
+    jobs   = [(params[i:i+chunksize], ntrials, s, bankfile,
+               None if pathids is None else np.asarray(pathids)[i:i+chunksize])
+              for i, s in zip(starts, seeds)]
+
+    if nworkers == 1 or len(jobs) == 1:
+        results = [simulatechunk(job) for job in jobs]
+    else:
+        pool = Pool(nworkers)
+        try:
+            results = pool.map(simulatechunk, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    return dict((key, np.concatenate([r[key] for r in results])) for key in results[0])
+
+'''
+================================================================================
+
+    CONVERT AND STORE DATA
+
+================================================================================
+'''
+
+# Convert one simulated subject into the data frame that twostep.py writes
+def todataframe(sim, index, subject_id):
+    # 'f' selects the option on the left, as in key2choice
+    layout = sim['layout'][index]
+    ntrials = layout.shape[0]
+    keys = np.empty([ntrials, 2], dtype='<U1')
+    keys[:, 0] = np.where(layout[:, 0] == (sim['choice1'][index] == 1), 'f', 'j')
+    keys[:, 1] = np.where(layout[:, 1] == (sim['choice2'][index] == 1), 'f', 'j')
+
+    data = pd.DataFrame({
+        'subject_id': subject_id,
+        'step2state': sim['step2state'][index].astype(float),
+        'choice1'   : sim['choice1'][index].astype(float),
+        'choice2'   : sim['choice2'][index].astype(float),
+        'reward'    : sim['reward'][index].astype(float),
+        'rt_step1'  : np.full(ntrials, np.nan), # agents have no response times
+        'rt_step2'  : np.full(ntrials, np.nan),
+        'key_step1' : keys[:, 0],
+        'key_step2' : keys[:, 1],
+        'path_id'   : sim['path_id'][index],
+        'session_seed': -1 # simulated sessions do not use sessionrandom.py
+    })
+    return data[datacolumns]
+
+# Write one data_<id>.csv per simulated subject, in the task's format
+def writecsv(sim, outdir='.', subject_ids=None):
+    nsubjects = sim['choice1'].shape[0]
+    if subject_ids is None:
+        subject_ids = ['sim%05d' % i for i in range(nsubjects)]
+
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    for i in range(nsubjects):
+        data = todataframe(sim, i, subject_ids[i])
+        data.to_csv(os.path.join(outdir, 'data_' + subject_ids[i] + '.csv'),
+                    sep='\t', encoding='utf-8', index=False)
+
+'''
+================================================================================
+
+    RUN SIMULATION
+
+================================================================================
+'''
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate synthetic subjects on the two-step task.')
+    parser.add_argument('--nsubjects', type=int, default=1000)
+    parser.add_argument('--ntrials', type=int, default=ntrials)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--nworkers', type=int, default=None)
+    parser.add_argument('--chunksize', type=int, default=1000)
+    parser.add_argument('--outdir', default='simulated')
+    parser.add_argument('--bank', default=None, help='reward path bank built with rewardbank.py')
+    args = parser.parse_args()
+
+    seeds  = np.random.SeedSequence(args.seed).spawn(2)
+    params = sampleparams(args.nsubjects, np.random.default_rng(seeds[0]))
+    sim    = simulatecohort(params, args.ntrials, seeds[1], args.nworkers, args.chunksize, args.bank)
+
+    writecsv(sim, args.outdir)
+    pd.DataFrame(params, columns=paramnames).to_csv(
+        os.path.join(args.outdir, 'params.csv'), sep='\t', encoding='utf-8', index=False)